@@ -0,0 +1,1087 @@
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from element import Element, BinaryOperation
+import glob, os, random, statistics, subprocess, sys, time, timeit, tracemalloc
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_TIMER = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+BINARY_OPERATORS = ['+', '-', '*', '/', '==', '!=', '<', '<=', '>', '>=', '&&', '||']
+
+# Generates a syntactically valid (but not necessarily runnable) Brewin' program
+# that uses every construct in the grammar
+def generate_program(rng, num_funcs=5, num_statements=8):
+    def expression(depth):
+        choice = rng.randrange(12 if depth < 3 else 6)
+        match choice:
+            case 0 | 1:
+                return str(rng.randrange(1000))
+            case 2:
+                return f"v{rng.randrange(5)}"
+            case 3:
+                return f'"s{rng.randrange(100)}"'
+            case 4:
+                return rng.choice(["true", "false", "nil", "@"])
+            case 5:
+                return f"o{rng.randrange(3)}.m{rng.randrange(3)}"
+            case 6 | 7 | 8:
+                return f"{expression(depth + 1)} {rng.choice(BINARY_OPERATORS)} {expression(depth + 1)}"
+            case 9:
+                return f"{rng.choice(['-', '!'])}({expression(depth + 1)})"
+            case 10:
+                args = ", ".join(expression(depth + 1) for _ in range(rng.randrange(3)))
+                if rng.randrange(2):
+                    return f"f{rng.randrange(num_funcs)}({args})"
+                return f"o{rng.randrange(3)}.m{rng.randrange(3)}({args})"
+            case 11:
+                return f"lambda(a, ref b) {{ {statement(depth + 1)} return a; }}"
+
+    def statement(depth):
+        choice = rng.randrange(7 if depth < 2 else 4)
+        match choice:
+            case 0:
+                return f"v{rng.randrange(5)} = {expression(depth)};"
+            case 1:
+                return f"o{rng.randrange(3)}.m{rng.randrange(3)} = {expression(depth)};"
+            case 2:
+                return f"print({expression(depth)}, {expression(depth)});"
+            case 3:
+                return f"return {expression(depth)};" if rng.randrange(2) else "return;"
+            case 4:
+                return f"if ({expression(depth)}) {{ {block(depth + 1)} }}"
+            case 5:
+                return f"if ({expression(depth)}) {{ {block(depth + 1)} }} else {{ {block(depth + 1)} }}"
+            case 6:
+                return f"/* loop */ while ({expression(depth)}) {{\n{block(depth + 1)}\n}}"
+
+    def block(depth):
+        return "\n".join(statement(depth) for _ in range(rng.randrange(1, num_statements)))
+
+    funcs = []
+    for i in range(num_funcs):
+        params = ", ".join(f"{'ref ' if rng.randrange(3) == 0 else ''}p{j}" for j in range(rng.randrange(3)))
+        funcs.append(f"func f{i}({params}) {{\n{block(0)}\n}}")
+    funcs.append(f"func main() {{\n{block(0)}\n}}")
+    return "\n\n".join(funcs)
+
+def time_import(module, env, runs):
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", IMPORT_TIMER.format(module=module)],
+                                cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+        timings.append(float(result.stdout) * 1000)
+    return timings
+
+def bench_startup(args):
+    default_env = { k: v for k, v in os.environ.items() if k != "BREWIN_OPTIMIZE" }
+    optimized_env = dict(default_env, BREWIN_OPTIMIZE="1")
+    # Prepare the tree the same way the Docker image build does, so that the timed
+    # runs load the lexer/parser tables and bytecode instead of generating them
+    for env in (default_env, optimized_env):
+        time_import("brewparse", env, 1)
+    subprocess.run([sys.executable, "-m", "compileall", "-q", "."], cwd=ROOT, check=True)
+
+    for mode, env in (("default", default_env), ("optimized", optimized_env)):
+        timings = time_import(args.module, env, args.runs)
+        print(f"{mode:>9}: import {args.module} min {min(timings):.1f} ms, median {statistics.median(timings):.1f} ms")
+
+    if statistics.median(timings) > args.budget:
+        print(f"Optimized startup exceeds the {args.budget:.0f} ms budget")
+        exit(1)
+
+# The dict-backed AST node that element.Element replaced, for comparison
+class DictElement:
+    def __init__(self, elem_type, **kwargs):
+        self.elem_type = elem_type
+        self.dict = {}
+        for key, value in kwargs.items():
+            self.dict[key] = value
+
+def to_dict_elements(node):
+    def convert(value):
+        if isinstance(value, list):
+            return [convert(item) for item in value]
+        if isinstance(value, Element):
+            return to_dict_elements(value)
+        return value
+    return DictElement(node.elem_type, **{ field: convert(getattr(node, field)) for field in node.fields })
+
+def copy_elements(node):
+    def convert(value):
+        if isinstance(value, list):
+            return [convert(item) for item in value]
+        if isinstance(value, Element):
+            return copy_elements(value)
+        return value
+    copy = object.__new__(type(node))
+    copy.elem_type = node.elem_type
+    for field in node.fields:
+        setattr(copy, field, convert(getattr(node, field)))
+    return copy
+
+def measure_allocation(build):
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+def bench_ast(args):
+    from brewparse import parse_program
+
+    rng = random.Random(args.seed)
+    program = "\n".join(generate_program(rng) for _ in range(args.programs))
+    ast = parse_program(program)
+
+    slotted_ast, slotted_size = measure_allocation(lambda: copy_elements(ast))
+    dict_ast, dict_size = measure_allocation(lambda: to_dict_elements(ast))
+    num_nodes = 0
+    binary_ops, dict_binary_ops = [], []
+    stack = [(slotted_ast, dict_ast)]
+    while stack:
+        node, dict_node = stack.pop()
+        num_nodes += 1
+        if isinstance(node, BinaryOperation):
+            binary_ops.append(node)
+            dict_binary_ops.append(dict_node)
+        for field in node.fields:
+            value, dict_value = getattr(node, field), dict_node.dict[field]
+            if isinstance(value, Element):
+                stack.append((value, dict_value))
+            elif isinstance(value, list):
+                stack.extend(zip(value, dict_value))
+
+    print(f"{len(program) / 1e6:.1f} MB of source, {num_nodes} nodes")
+    print(f"  dict-backed: {dict_size / 1e6:6.2f} MB ({dict_size / num_nodes:.0f} bytes/node)")
+    print(f"      slotted: {slotted_size / 1e6:6.2f} MB ({slotted_size / num_nodes:.0f} bytes/node)")
+
+    dict_time = min(timeit.repeat(lambda: [(n.dict['op1'], n.dict['op2']) for n in dict_binary_ops], number=10, repeat=5))
+    slotted_time = min(timeit.repeat(lambda: [(n.op1, n.op2) for n in binary_ops], number=10, repeat=5))
+    accesses = 2 * 10 * len(binary_ops)
+    print(f"Reading operands of {len(binary_ops)} binary operations:")
+    print(f"  dict-backed: {dict_time / accesses * 1e9:.1f} ns/access")
+    print(f"      slotted: {slotted_time / accesses * 1e9:.1f} ns/access")
+
+# Returns the program's AST (None if parsing failed) and its first syntax error
+def parse_outcome(program, backend):
+    from brewparse import parse_program
+
+    try:
+        ast = parse_program(program, backend)
+    except SyntaxError as error:
+        return None, str(error.diagnostics.first_syntax_error())
+    error = ast.diagnostics.first_syntax_error()
+    return str(ast), error and str(error)
+
+def bench_parse_equivalence(args):
+    programs = []
+    paths = args.files or sorted(glob.glob(os.path.join(ROOT, "autograder", "**", "*.br"), recursive=True))
+    for path in paths:
+        with open(path) as infile:
+            programs.append((path, infile.read()))
+    rng = random.Random(args.seed)
+    for i in range(args.generated):
+        program = generate_program(rng)
+        programs.append((f"generated program {i}", program))
+        # Also check that both parsers reject the same broken programs
+        cut = rng.randrange(len(program))
+        programs.append((f"generated program {i} with character {cut} removed", program[:cut] + program[cut + 1:]))
+
+    mismatches = 0
+    for name, program in programs:
+        ply_ast, ply_error = parse_outcome(program, "ply")
+        rd_ast, rd_error = parse_outcome(program, "rd")
+        # ply recovers from some syntax errors and returns a partial AST, while the
+        # recursive descent parser always rejects the program. Both should report
+        # the same first error.
+        if rd_error != ply_error or (ply_error is None and rd_ast != ply_ast):
+            mismatches += 1
+            print(f"Mismatch: {name}")
+    print(f"Compared {len(programs)} programs ({len(paths)} files), {mismatches} mismatches")
+    if mismatches:
+        exit(1)
+
+def bench_parse_speed(args):
+    import brewlex
+    from brewparse import PARSER_BACKENDS, parse_program
+
+    rng = random.Random(args.seed)
+    program = "\n".join(generate_program(rng) for _ in range(args.programs))
+    lexer = brewlex.lexer.clone()
+    lexer.input(program)
+    num_tokens = sum(1 for _ in iter(lexer.token, None))
+    print(f"{len(program) / 1e6:.1f} MB of source, {num_tokens} tokens")
+
+    def lex_only():
+        lexer = brewlex.lexer.clone()
+        lexer.input(program)
+        for _ in iter(lexer.token, None):
+            pass
+    elapsed = min(timeit.repeat(lex_only, number=1, repeat=args.runs))
+    print(f" lex: {elapsed:.2f} s, {num_tokens / elapsed / 1000:.0f}k tokens/s (lexing alone)")
+    for backend in PARSER_BACKENDS:
+        elapsed = min(timeit.repeat(lambda: parse_program(program, backend), number=1, repeat=args.runs))
+        print(f"{backend:>4}: {elapsed:.2f} s, {num_tokens / elapsed / 1000:.0f}k tokens/s")
+
+def generate_source(rng, megabytes):
+    parts = []
+    size = 0
+    while size < megabytes * 1e6:
+        part = f"/* program {len(parts)}\n */\n" + generate_program(rng)
+        parts.append(part)
+        size += len(part)
+    return "\n".join(parts)
+
+def bench_lex_speed(args):
+    import brewlex, brewscan
+
+    rng = random.Random(args.seed)
+    source = generate_source(rng, args.megabytes)
+
+    def ply_tokens():
+        lexer = brewlex.lexer.clone()
+        lexer.input(source)
+        return list(iter(lexer.token, None))
+    types, values, lines, _ = brewscan.scan(source)
+    scanned = [(brewscan.TOKEN_TYPES[t], value, line) for t, value, line in zip(types, values, lines)]
+    if scanned != [(token.type, token.value, token.lineno) for token in ply_tokens()]:
+        print("brewscan and ply produce different tokens")
+        exit(1)
+    print(f"{len(source) / 1e6:.1f} MB of source, {len(types)} tokens")
+
+    for name, lex in ("ply", ply_tokens), ("brewscan", lambda: brewscan.scan(source)):
+        elapsed = min(timeit.repeat(lex, number=1, repeat=args.runs))
+        print(f"{name:>8}: {elapsed:.2f} s, {len(source) / elapsed / 1e6:.1f} MB/s, "
+              f"{len(types) / elapsed / 1e6:.2f}M tokens/s")
+
+ADVERSARIAL_INPUTS = {
+    "unterminated comments": "/* ",
+    "one unterminated comment": None,
+    "unterminated strings": '"abc\n',
+    "illegal characters": "#$%^",
+    "trailing whitespace": None,
+}
+
+def adversarial_source(name, size):
+    match name:
+        case "one unterminated comment":
+            return "/*" + "x" * size
+        case "trailing whitespace":
+            return "func main() {}" + " " * size
+    unit = ADVERSARIAL_INPUTS[name]
+    return unit * (size // len(unit))
+
+def bench_lex_adversarial(args):
+    import brewlex, brewscan
+    from diagnostics import Diagnostics
+
+    def ply_lex(source):
+        lexer = brewlex.lexer.clone()
+        lexer.diagnostics = Diagnostics()
+        lexer.input(source)
+        return [(token.type, token.value, token.lineno) for token in iter(lexer.token, None)]
+    lexers = {"ply": ply_lex, "brewscan": brewscan.scan}
+
+    size = int(args.megabytes * 1e6)
+    nonlinear = 0
+    for name in ADVERSARIAL_INPUTS:
+        source = adversarial_source(name, 1000)
+        types, values, lines, _ = brewscan.scan(source)
+        if ply_lex(source) != [(brewscan.TOKEN_TYPES[t], v, l) for t, v, l in zip(types, values, lines)]:
+            print(f"brewscan and ply produce different tokens for {name}")
+            exit(1)
+        for lexer_name, lex in lexers.items():
+            times = []
+            for source in adversarial_source(name, size // 2), adversarial_source(name, size):
+                start = time.perf_counter()
+                lex(source)
+                times.append(time.perf_counter() - start)
+            # Doubling the input should roughly double the time
+            ratio = times[1] / max(times[0], 1e-6)
+            flag = ""
+            if ratio > args.max_ratio and times[1] > 0.05:
+                nonlinear += 1
+                flag = " (not linear)"
+            print(f"{name:>25} {lexer_name:>8}: {times[0]:.2f} s -> {times[1]:.2f} s, x{ratio:.1f}{flag}")
+    if nonlinear:
+        exit(1)
+
+def bench_brewc(args):
+    import brewc, tempfile
+    from brewparse import parse_program
+
+    rng = random.Random(args.seed)
+    source = "\n".join(generate_program(rng) for _ in range(args.programs))
+    ast = parse_program(source)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program" + brewc.EXTENSION)
+        brewc.dump(path, ast, source, 4)
+        if str(brewc.load(path, source, 4)) != str(ast):
+            print("Loaded AST differs from the parsed one")
+            exit(1)
+        if brewc.load(path, source + " ", 4) is not None or brewc.load(path, source, 3) is not None:
+            print("Stale .brewc file was loaded")
+            exit(1)
+        print(f"{len(source) / 1e6:.1f} MB of source, {os.path.getsize(path) / 1e6:.1f} MB .brewc file")
+        parse_time = min(timeit.repeat(lambda: parse_program(source), number=1, repeat=args.runs))
+        load_time = min(timeit.repeat(lambda: brewc.load(path, source, 4), number=1, repeat=args.runs))
+    print(f"parse: {parse_time * 1000:.0f} ms")
+    print(f" load: {load_time * 1000:.0f} ms ({parse_time / load_time:.1f}x faster)")
+
+# Brewin' v4 programs that exercise each engine's hot paths. {n} is the problem size.
+ENGINE_PROGRAMS = {
+    "loop": """
+func main() {
+  i = 0;
+  total = 0;
+  while (i < {n}) {
+    total = total + i * 3 - 1;
+    if (total > 1000000) {
+      total = total - 1000000;
+    }
+    i = i + 1;
+  }
+  print(total);
+}
+""",
+    "calls": """
+func fib(n) {
+  if (n < 2) {
+    return n;
+  }
+  return fib(n - 1) + fib(n - 2);
+}
+
+func main() {
+  print(fib({n} / 1000));
+}
+""",
+    "methods": """
+func main() {
+  counter = @;
+  counter.count = 0;
+  counter.add = lambda(k) { this.count = this.count + k; };
+  i = 0;
+  while (i < {n}) {
+    counter.add(i);
+    i = i + 1;
+  }
+  print(counter.count);
+}
+""",
+}
+
+def bench_engines(args):
+    from interpreterv4 import ENGINES, Interpreter, compile_program
+
+    engines = args.engines or ENGINES
+    for name, source in ENGINE_PROGRAMS.items():
+        program = compile_program(source.replace("{n}", str(args.size)))
+        times = {}
+        outputs = {}
+        for engine in engines:
+            def run():
+                interpreter = Interpreter(console_output=False, engine=engine)
+                interpreter.run_program(program)
+                outputs[engine] = interpreter.get_output()
+            times[engine] = min(timeit.repeat(run, number=1, repeat=args.runs))
+        if len(set(map(tuple, outputs.values()))) != 1:
+            print(f"{name}: engines disagree: {outputs}")
+            exit(1)
+        baseline = times[engines[0]]
+        print(f"{name:>8}: " + ", ".join(f"{engine} {elapsed * 1000:.0f} ms ({baseline / elapsed:.1f}x)"
+                                          for engine, elapsed in times.items()))
+
+def bench_transpile_cache(args):
+    import tempfile, transpilev4
+    from interpreterv4 import compile_program
+
+    rng = random.Random(args.seed)
+    source = "\n".join(generate_program(rng) for _ in range(args.programs))
+    program = compile_program(source)
+    with tempfile.TemporaryDirectory() as directory:
+        transpilev4.CACHE_DIR = directory
+
+        def compile_cold():
+            for path in glob.glob(os.path.join(directory, "*")):
+                os.unlink(path)
+            return transpilev4.compile_functions(program)
+
+        def compile_cached():
+            return transpilev4.compile_functions(program)
+
+        cold_time = min(timeit.repeat(compile_cold, number=1, repeat=args.runs))
+        if len(os.listdir(directory)) != 1:
+            print("Compiled code was not cached")
+            exit(1)
+        cached_time = min(timeit.repeat(compile_cached, number=1, repeat=args.runs))
+        if set(compile_cached()) != set(compile_cold()):
+            print("Cached code defines different functions")
+            exit(1)
+    print(f"{len(source) / 1e6:.1f} MB of source, {len(program.ast.functions)} functions")
+    print(f"transpile and compile: {cold_time * 1000:.0f} ms")
+    print(f"   load cached code: {cached_time * 1000:.0f} ms ({cold_time / cached_time:.1f}x faster)")
+
+def load_interpreter_at(revision, version):
+    import importlib.util
+
+    source = subprocess.run(["git", "show", f"{revision}:interpreterv{version}.py"],
+                            cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader(f"interpreterv{version}_{revision}", None))
+    exec(compile(source, f"{revision}:interpreterv{version}.py", "exec"), module.__dict__)
+    return module
+
+def bench_dispatch(args):
+    from element import Literal, NilLiteral, Variable
+    from interpreters import load_interpreter
+
+    # Nodes whose handlers do almost nothing, so the time is mostly dispatch: an
+    # expression statement is skipped, and a literal or variable is one allocation
+    # or lookup. Adding two variables times an operator's type checks too.
+    variable = Variable("x")
+    variable.symbol = 1  # the id symbols.intern_symbols gives the first name after 'this'
+    cases = {
+        "skipped statement": ("statements", [variable] * args.nodes),
+        "int literal": ("expressions", [Literal("int", 1)] * args.nodes),
+        "nil": ("expressions", [NilLiteral()] * args.nodes),
+        "variable": ("expressions", [variable] * args.nodes),
+        "int addition": ("expressions", [BinaryOperation("+", variable, variable)] * args.nodes),
+    }
+    modules = {}
+    for version in args.versions:
+        if args.baseline:
+            modules[f"v{version} {args.baseline}"] = load_interpreter_at(args.baseline, version)
+        modules[f"v{version}"] = load_interpreter(version)
+
+    for name, module in modules.items():
+        interpreter = module.Interpreter(console_output=False)
+        x = module.TypedValue("int", 1)
+        # Interpreters from before symbol interning keep variables by name
+        interpreter.variables = {"x": [x]}
+        interpreter.scopes = [set()]
+        interpreter.symbols = ("this", "x")
+        interpreter.stacks = [[], [x]]
+        interpreter.trail = []
+        interpreter.marks = [0]
+        results = []
+        for case, (kind, nodes) in cases.items():
+            if kind == "statements":
+                run = lambda: interpreter.run_statements(nodes)
+            else:
+                run = lambda: list(map(interpreter.evaluate_expression, nodes))
+            elapsed = min(timeit.repeat(run, number=1, repeat=args.runs))
+            results.append(f"{case} {elapsed / len(nodes) * 1e9:.0f} ns")
+        print(f"{name:>12}: " + ", ".join(results))
+
+# Brewin' programs that pass values to and return them from recursive functions,
+# with the interpreter versions that can run each. {n} is the number of calls at
+# the top level, each of which recurses 100 deep.
+COPY_PROGRAMS = {
+    "ints": ((2, 3, 4), """
+func count(n, acc) {
+  if (n == 0) {
+    return acc;
+  }
+  return count(n - 1, acc + 1);
+}
+
+func main() {
+  i = 0;
+  total = 0;
+  while (i < {n}) {
+    total = total + count(100, 0);
+    i = i + 1;
+  }
+  print(total);
+}
+"""),
+    "objects": ((4,), """
+func walk(o, n) {
+  if (n == 0) {
+    return o;
+  }
+  return walk(o, n - 1);
+}
+
+func main() {
+  o = @;
+  o.a = 1;
+  o.b = "two";
+  inner = @;
+  inner.x = 3;
+  o.inner = inner;
+  o.get = lambda() { return this.a; };
+  i = 0;
+  total = 0;
+  while (i < {n}) {
+    r = walk(o, 100);
+    total = total + r.get();
+    i = i + 1;
+  }
+  print(total);
+}
+"""),
+    "closures": ((3, 4), """
+func pass(f, n) {
+  if (n == 0) {
+    return f;
+  }
+  return pass(f, n - 1);
+}
+
+func main() {
+  a = 1; b = 2; c = 3; d = 4; e = 5; f = 6; g = 7; h = 8;
+  add = lambda(x) { return x + a + b + c + d + e + f + g + h; };
+  i = 0;
+  total = 0;
+  while (i < {n}) {
+    passed = pass(add, 100);
+    total = total + passed(i);
+    i = i + 1;
+  }
+  print(total);
+}
+"""),
+}
+
+def bench_copies(args):
+    from interpreters import load_interpreter
+
+    for name, (versions, source) in COPY_PROGRAMS.items():
+        source = source.replace("{n}", str(args.calls))
+        results = []
+        outputs = set()
+        for version in versions:
+            modules = {f"v{version}": load_interpreter(version)}
+            if args.baseline:
+                modules[f"v{version} {args.baseline}"] = load_interpreter_at(args.baseline, version)
+            for label, module in modules.items():
+                def run():
+                    interpreter = module.Interpreter(console_output=False)
+                    interpreter.run(source)
+                    outputs.add(tuple(interpreter.get_output()))
+                elapsed = min(timeit.repeat(run, number=1, repeat=args.runs))
+                results.append(f"{label} {elapsed * 1000:.0f} ms")
+        if len(outputs) != 1:
+            print(f"{name}: interpreters disagree: {outputs}")
+            exit(1)
+        print(f"{name:>8}: " + ", ".join(results))
+
+def bench_lambdas(args):
+    from interpreters import load_interpreter
+
+    def source(live, statement):
+        # live variables, then a loop that runs statement
+        return ("func main() {\n"
+                + "".join(f"  v{i} = {i};\n" for i in range(live))
+                + f"  f = nil;\n  i = 0;\n  while (i < {args.lambdas}) {{\n"
+                + f"    {statement}\n    i = i + 1;\n  }}\n  print(f);\n}}\n")
+
+    for version in args.versions:
+        modules = {f"v{version}": load_interpreter(version)}
+        if args.baseline:
+            modules[f"v{version} {args.baseline}"] = load_interpreter_at(args.baseline, version)
+        for live in args.live:
+            results = []
+            for label, module in modules.items():
+                def time_program(source):
+                    program = module.compile_program(source)
+
+                    def run():
+                        module.Interpreter(console_output=False).run_program(program)
+                    return min(timeit.repeat(run, number=1, repeat=args.runs))
+                # Less the same loop assigning an int, so the rest of the program
+                # doesn't count
+                elapsed = (time_program(source(live, "f = lambda(x) { return x + v0; };"))
+                           - time_program(source(live, "f = i;")))
+                results.append(f"{label} {elapsed / args.lambdas * 1e6:.1f} us")
+            print(f"{live:>5} live variables: " + ", ".join(results) + " per lambda")
+
+def bench_members(args):
+    import interpreterv4
+
+    def source(depth):
+        # A chain of depth objects below the one defining get, and a loop calling it
+        return ("func main() {\n  o = @;\n  o.x = 1;\n  o.get = lambda() { return this.x; };\n"
+                + "".join("  p = @;\n  p.proto = o;\n  o = p;\n" for _ in range(depth))
+                + f"  i = 0;\n  total = 0;\n  while (i < {args.calls}) {{\n"
+                + "    total = total + o.get();\n    i = i + 1;\n  }\n  print(total);\n}\n")
+
+    modules = {"v4": interpreterv4}
+    if args.baseline:
+        modules[f"v4 {args.baseline}"] = load_interpreter_at(args.baseline, 4)
+    for depth in args.depths:
+        results = []
+        for label, module in modules.items():
+            program = module.compile_program(source(depth))
+            engines = module.ENGINES if module is interpreterv4 else ("tree",)
+            for engine in engines:
+                def run():
+                    module.Interpreter(console_output=False, engine=engine).run_program(program)
+                elapsed = min(timeit.repeat(run, number=1, repeat=args.runs))
+                results.append(f"{label if engine == 'tree' else engine} {elapsed / args.calls * 1e6:.1f} us")
+        print(f"depth {depth:>3}: " + ", ".join(results) + " per call")
+
+# Counter loops, which the engines run with fused fast paths (see
+# interpreterv4.increment_of): {n} is the number of iterations
+LOOP_PROGRAMS = {
+    "count": """
+func main() {
+  i = 0;
+  n = {n};
+  while (i < n) {
+    i = i + 1;
+  }
+  print(i);
+}
+""",
+    "sum": """
+func main() {
+  i = {n};
+  total = 0;
+  while (i > 0) {
+    total = total + i;
+    i = i - 1;
+  }
+  print(total);
+}
+""",
+}
+
+def bench_loops(args):
+    import interpreterv4
+
+    modules = {"v4": interpreterv4}
+    if args.baseline:
+        modules[f"v4 {args.baseline}"] = load_interpreter_at(args.baseline, 4)
+    for name, source in LOOP_PROGRAMS.items():
+        results = []
+        for label, module in modules.items():
+            program = module.compile_program(source.replace("{n}", str(args.iterations)))
+            engines = module.ENGINES if module is interpreterv4 else ("tree",)
+            for engine in engines:
+                def run():
+                    module.Interpreter(console_output=False, engine=engine).run_program(program)
+                elapsed = min(timeit.repeat(run, number=1, repeat=args.runs))
+                results.append(f"{label if engine == 'tree' else engine} {elapsed / args.iterations * 1e9:.0f} ns")
+        print(f"{name:>6}: " + ", ".join(results) + " per iteration")
+
+# Object-heavy programs: {n} is the number of objects each builds and then walks
+OBJECT_PROGRAMS = {
+    "list": """
+func main() {
+  head = nil;
+  i = 0;
+  while (i < {n}) {
+    node = @;
+    node.val = i;
+    node.next = head;
+    head = node;
+    i = i + 1;
+  }
+  total = 0;
+  node = head;
+  while (node != nil) {
+    total = total + node.val;
+    node = node.next;
+  }
+  print(total);
+}
+""",
+    "tree": """
+func build(n, node) {
+  node.size = n;
+  if (n > 1) {
+    node.left = build(n / 2, @);
+    node.right = build(n - 1 - n / 2, @);
+  } else {
+    node.left = nil;
+    node.right = nil;
+  }
+  return node;
+}
+
+func size(node) {
+  if (node == nil) {
+    return 0;
+  }
+  return 1 + size(node.left) + size(node.right);
+}
+
+func main() {
+  print(size(build({n}, @)));
+}
+""",
+}
+
+def bench_objects(args):
+    import interpreterv4
+
+    modules = {"v4": interpreterv4}
+    if args.baseline:
+        modules[f"v4 {args.baseline}"] = load_interpreter_at(args.baseline, 4)
+    for name, source in OBJECT_PROGRAMS.items():
+        source = source.replace("{n}", str(args.objects))
+        results = []
+        outputs = set()
+        for label, module in modules.items():
+            program = module.compile_program(source)
+            engines = module.ENGINES if module is interpreterv4 else ("tree",)
+            for engine in engines:
+                def run():
+                    interpreter = module.Interpreter(console_output=False, engine=engine)
+                    interpreter.run_program(program)
+                    outputs.add(tuple(interpreter.get_output()))
+                elapsed = min(timeit.repeat(run, number=1, repeat=args.runs))
+                results.append(f"{label if engine == 'tree' else engine} {elapsed * 1000:.0f} ms")
+            tracemalloc.start()
+            module.Interpreter(console_output=False).run_program(program)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append(f"{label} peak {peak / args.objects:.0f} bytes per object")
+        if len(outputs) != 1:
+            print(f"{name}: interpreters disagree: {outputs}")
+            exit(1)
+        print(f"{name:>5}: " + ", ".join(results))
+
+# Counts the TypedValues created while running program (the shared ones made
+# when the module is imported aren't counted), and times the fastest of runs
+def count_values(module, program, runs, **options):
+    value_class = module.TypedValue
+    init = value_class.__init__
+    count = 0
+
+    def counting_init(self, *args):
+        nonlocal count
+        count += 1
+        init(self, *args)
+    interpreter = module.Interpreter(console_output=False, **options)
+    value_class.__init__ = counting_init
+    try:
+        interpreter.run_program(program)
+    finally:
+        value_class.__init__ = init
+
+    def run():
+        module.Interpreter(console_output=False, **options).run_program(program)
+    return count, min(timeit.repeat(run, number=1, repeat=runs)), interpreter.get_output()
+
+def bench_allocations(args):
+    from interpreters import load_interpreter
+
+    for name, source in ENGINE_PROGRAMS.items():
+        source = source.replace("{n}", str(args.size))
+        runs = []
+        for version in (4,) if name == "methods" else args.versions:
+            modules = {f"v{version}": load_interpreter(version)}
+            if args.baseline:
+                modules[f"v{version} {args.baseline}"] = load_interpreter_at(args.baseline, version)
+            for label, module in modules.items():
+                program = module.compile_program(source)
+                runs.append((label, *count_values(module, program, args.runs)))
+                if version == 4 and label == "v4":
+                    for engine in module.ENGINES[1:]:
+                        runs.append((f"v4 {engine}", *count_values(module, program, args.runs, engine=engine)))
+        if len({tuple(output) for *_, output in runs}) != 1:
+            print(f"{name}: interpreters disagree")
+            exit(1)
+        print(f"{name}:")
+        for label, count, elapsed, _ in runs:
+            print(f"  {label:>14}: {count:>9} values, {elapsed * 1000:.0f} ms")
+
+# Counts to {n} by tail recursion, which only runs if the calls don't nest
+TAIL_CALL_PROGRAM = """
+func count(i, n) {
+  if (i == n) {
+    return i;
+  }
+  return count(i + 1, n);
+}
+
+func main() {
+  print(count(0, {n}));
+}
+"""
+
+def bench_tail_calls(args):
+    import interpreterv2, interpreterv3, interpreterv4
+
+    interpreters = {
+        "v2": (interpreterv2, {}),
+        "v3": (interpreterv3, {}),
+        "v4": (interpreterv4, {}),
+        "closure": (interpreterv4, {"engine": "closure"}),
+        "vm": (interpreterv4, {"engine": "vm"}),
+    }
+    for label, (module, options) in interpreters.items():
+        def run(calls):
+            interpreter = module.Interpreter(console_output=False, **options)
+            interpreter.run(TAIL_CALL_PROGRAM.replace("{n}", str(calls)))
+            if interpreter.get_output() != [str(calls)]:
+                print(f"{label}: counted to {interpreter.get_output()} instead of {calls}")
+                exit(1)
+
+        elapsed = timeit.timeit(lambda: run(args.calls), number=1)
+        # The peak memory of a run shouldn't depend on how many calls it makes
+        peaks = []
+        for calls in (args.calls // 100, args.calls // 10):
+            tracemalloc.start()
+            run(calls)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        print(f"{label:>7}: {args.calls} calls in {elapsed:.1f} s ({elapsed / args.calls * 1e6:.1f} us per call), "
+              f"peak {peaks[0] / 1024:.0f} KB for {args.calls // 100} calls and {peaks[1] / 1024:.0f} KB for {args.calls // 10}")
+        if peaks[1] > 2 * peaks[0]:
+            print(f"{label}: memory grows with the number of tail calls")
+            exit(1)
+
+# Recurses {n} calls deep without tail calls, so every call stays open until the
+# deepest one returns
+CALL_DEPTH_PROGRAM = """
+func depth(n) {
+  if (n == 0) {
+    return 0;
+  }
+  return 1 + depth(n - 1);
+}
+
+func main() {
+  print(depth({n}));
+}
+"""
+
+def bench_call_depth(args):
+    import interpreterv4
+
+    bytes_per_call = []
+    for depth in args.depths:
+        program = interpreterv4.compile_program(CALL_DEPTH_PROGRAM.replace("{n}", str(depth - 1)))
+        results = []
+        for engine in ("vm", "tree"):
+            interpreter = interpreterv4.Interpreter(console_output=False, engine=engine, max_call_depth=depth)
+            try:
+                elapsed = timeit.timeit(lambda: interpreter.run_program(program), number=1)
+            except RecursionError:
+                results.append(f"{engine} RecursionError")
+                continue
+            if interpreter.get_output() != [str(depth - 1)]:
+                print(f"{engine}: returned {interpreter.get_output()} instead of {depth - 1}")
+                exit(1)
+            results.append(f"{engine} {elapsed * 1000:.0f} ms")
+        tracemalloc.start()
+        interpreterv4.Interpreter(console_output=False, engine="vm", max_call_depth=depth).run_program(program)
+        bytes_per_call.append(tracemalloc.get_traced_memory()[1] / depth)
+        tracemalloc.stop()
+        results.append(f"vm peak {bytes_per_call[-1]:.0f} bytes per call")
+        # main's call takes the only frame allowed, so each tail call has to reuse it
+        tail_program = interpreterv4.compile_program(TAIL_CALL_PROGRAM.replace("{n}", str(depth)))
+        interpreter = interpreterv4.Interpreter(console_output=False, engine="vm", max_call_depth=1)
+        try:
+            elapsed = timeit.timeit(lambda: interpreter.run_program(tail_program), number=1)
+        except Exception as error:
+            print(f"vm: tail calls took more than one frame: {error}")
+            exit(1)
+        if interpreter.get_output() != [str(depth)]:
+            print(f"vm: counted to {interpreter.get_output()} instead of {depth}")
+            exit(1)
+        results.append(f"vm {depth} tail calls in one frame {elapsed * 1000:.0f} ms")
+        print(f"depth {depth:>7}: " + ", ".join(results))
+    # Past the fixed costs, each call should take the same memory however deep it is
+    if len(bytes_per_call) > 1 and bytes_per_call[-1] > 1.5 * bytes_per_call[-2]:
+        print("the memory each call takes grows with the depth")
+        exit(1)
+
+def bench_deep_expressions(args):
+    import interpreterv1, interpreterv2, interpreterv3, interpreterv4
+
+    interpreters = {
+        "v1": (interpreterv1, {}),
+        "v2": (interpreterv2, {}),
+        "v3": (interpreterv3, {}),
+        "v4": (interpreterv4, {}),
+        "closure": (interpreterv4, {"engine": "closure"}),
+        "vm": (interpreterv4, {"engine": "vm"}),
+        "python": (interpreterv4, {"engine": "python"}),
+    }
+    # 1 + 1 + ... + 1 parses into a chain of additions as deep as it is long
+    sources = {n: "func main() {\n  x = " + " + ".join(["1"] * n) + ";\n  print(x);\n}\n" for n in args.operands}
+    for label, (module, options) in interpreters.items():
+        results = []
+        per_operand = []
+        for n, source in sources.items():
+            program = module.compile_program(source)
+            interpreter = module.Interpreter(console_output=False, **options)
+            try:
+                # Includes compiling the program for the closure, vm and python engines
+                elapsed = timeit.timeit(lambda: interpreter.run_program(program), number=1)
+            except RecursionError:
+                print(f"{label}: RecursionError evaluating {n} operands")
+                exit(1)
+            if interpreter.get_output() != [str(n)]:
+                print(f"{label}: evaluated {interpreter.get_output()} instead of {n}")
+                exit(1)
+            per_operand.append(elapsed / n)
+            results.append(f"{n} operands in {elapsed * 1000:.0f} ms")
+        print(f"{label:>7}: " + ", ".join(results))
+        # Linear time: each operand should cost about the same however many there are
+        if len(per_operand) > 1 and per_operand[-1] > 2 * per_operand[-2]:
+            print(f"{label}: time per operand grows with the length of the expression")
+            exit(1)
+
+def bench_parse_threads(args):
+    from brewparse import parse_program
+
+    rng = random.Random(args.seed)
+    programs = [generate_program(rng) for _ in range(args.programs)]
+    expected = [str(parse_program(program)) for program in programs]
+
+    jobs = list(range(len(programs))) * args.repeat
+    rng.shuffle(jobs)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(lambda i: str(parse_program(programs[i])), jobs))
+    elapsed = time.perf_counter() - start
+
+    # Every threaded parse has to dump to exactly the same AST as the serial one
+    mismatched = sorted({i for i, result in zip(jobs, results) if result != expected[i]})
+    print(f"Parsed {len(jobs)} programs on {args.threads} threads in {elapsed:.2f} s, "
+          f"{len(mismatched)} programs mismatched")
+    if mismatched:
+        print(f"threaded parses differ from the serial parse for programs {mismatched[:10]}", file=sys.stderr)
+        exit(1)
+
+def main():
+    parser = ArgumentParser(prog="Brewin' Benchmarks",
+                            description="Measure the performance of the Brewin' interpreters")
+    subparsers = parser.add_subparsers(required=True)
+
+    startup = subparsers.add_parser("startup", help="time importing an interpreter in default and optimized mode")
+    startup.add_argument("-m", "--module", default="interpreterv4", help="module to import")
+    startup.add_argument("-n", "--runs", type=int, default=10, help="number of imports to time")
+    startup.add_argument("-b", "--budget", type=float, default=60, help="maximum median optimized import time in ms")
+    startup.set_defaults(func=bench_startup)
+
+    ast = subparsers.add_parser("ast", help="compare memory use and field access of slotted and dict-backed AST nodes")
+    ast.add_argument("-p", "--programs", type=int, default=200, help="number of random programs to concatenate")
+    ast.add_argument("-s", "--seed", type=int, default=131, help="random seed")
+    ast.set_defaults(func=bench_ast)
+
+    parse_equivalence = subparsers.add_parser("parse-equivalence", help="check that the ply and recursive descent parsers agree")
+    parse_equivalence.add_argument("files", nargs="*", help="Brewin' sources to compare (default: the autograder's)")
+    parse_equivalence.add_argument("-g", "--generated", type=int, default=200, help="number of random programs to compare")
+    parse_equivalence.add_argument("-s", "--seed", type=int, default=131, help="random seed")
+    parse_equivalence.set_defaults(func=bench_parse_equivalence)
+
+    parse_speed = subparsers.add_parser("parse-speed", help="compare parsing throughput of each parser backend")
+    parse_speed.add_argument("-p", "--programs", type=int, default=100, help="number of random programs to concatenate")
+    parse_speed.add_argument("-n", "--runs", type=int, default=3, help="number of timed parses per backend")
+    parse_speed.add_argument("-s", "--seed", type=int, default=131, help="random seed")
+    parse_speed.set_defaults(func=bench_parse_speed)
+
+    lex_speed = subparsers.add_parser("lex-speed", help="compare ply's lexer with brewscan on a large generated source")
+    lex_speed.add_argument("-m", "--megabytes", type=float, default=4, help="size of the generated source")
+    lex_speed.add_argument("-n", "--runs", type=int, default=3, help="number of timed runs per lexer")
+    lex_speed.add_argument("-s", "--seed", type=int, default=131, help="random seed")
+    lex_speed.set_defaults(func=bench_lex_speed)
+
+    lex_adversarial = subparsers.add_parser("lex-adversarial", help="check that lexing time stays linear on hostile input")
+    lex_adversarial.add_argument("-m", "--megabytes", type=float, default=1, help="size of the larger input")
+    lex_adversarial.add_argument("-r", "--max-ratio", type=float, default=3,
+                                 help="largest allowed time ratio between the larger input and one half its size")
+    lex_adversarial.set_defaults(func=bench_lex_adversarial)
+
+    brewc = subparsers.add_parser("brewc", help="compare parsing a large program with loading its .brewc file")
+    brewc.add_argument("-p", "--programs", type=int, default=100, help="number of random programs to concatenate")
+    brewc.add_argument("-n", "--runs", type=int, default=3, help="number of timed runs")
+    brewc.add_argument("-s", "--seed", type=int, default=131, help="random seed")
+    brewc.set_defaults(func=bench_brewc)
+
+    engines = subparsers.add_parser("engines", help="compare interpreterv4's execution engines on loop- and call-heavy programs")
+    engines.add_argument("engines", nargs="*", help="engines to compare, the first being the baseline (default: all)")
+    engines.add_argument("-n", "--size", type=int, default=20000, help="loop iterations (fib is computed for size / 1000)")
+    engines.add_argument("-r", "--runs", type=int, default=3, help="number of timed runs per engine")
+    engines.set_defaults(func=bench_engines)
+
+    transpile_cache = subparsers.add_parser("transpile-cache", help="compare translating a large program to Python with loading the cached code")
+    transpile_cache.add_argument("-p", "--programs", type=int, default=100, help="number of random programs to concatenate")
+    transpile_cache.add_argument("-n", "--runs", type=int, default=3, help="number of timed runs")
+    transpile_cache.add_argument("-s", "--seed", type=int, default=131, help="random seed")
+    transpile_cache.set_defaults(func=bench_transpile_cache)
+
+    dispatch = subparsers.add_parser("dispatch", help="time dispatching trivial nodes in the tree-walking interpreters")
+    dispatch.add_argument("versions", nargs="*", type=int, default=[2, 3, 4], help="interpreter versions (default: 2-4)")
+    dispatch.add_argument("-b", "--baseline", help="git revision whose interpreters to compare against")
+    dispatch.add_argument("-n", "--nodes", type=int, default=100000, help="nodes per timed run")
+    dispatch.add_argument("-r", "--runs", type=int, default=5, help="number of timed runs")
+    dispatch.set_defaults(func=bench_dispatch)
+
+    copies = subparsers.add_parser("copies", help="time passing and returning values through recursive functions")
+    copies.add_argument("-b", "--baseline", help="git revision whose interpreters to compare against")
+    copies.add_argument("-n", "--calls", type=int, default=200, help="top-level calls per program")
+    copies.add_argument("-r", "--runs", type=int, default=3, help="number of timed runs")
+    copies.set_defaults(func=bench_copies)
+
+    lambdas = subparsers.add_parser("lambdas", help="time creating lambdas as the number of live variables grows")
+    lambdas.add_argument("versions", nargs="*", type=int, default=[3, 4], help="interpreter versions (default: 3-4)")
+    lambdas.add_argument("-b", "--baseline", help="git revision whose interpreters to compare against")
+    lambdas.add_argument("-l", "--live", type=int, nargs="+", default=[10, 100, 1000], help="numbers of live variables")
+    lambdas.add_argument("-n", "--lambdas", type=int, default=2000, help="lambdas created per run")
+    lambdas.add_argument("-r", "--runs", type=int, default=5, help="number of timed runs")
+    lambdas.set_defaults(func=bench_lambdas)
+
+    members = subparsers.add_parser("members", help="time calling a method inherited through a chain of prototypes")
+    members.add_argument("-b", "--baseline", help="git revision whose interpreter to compare against")
+    members.add_argument("-d", "--depths", type=int, nargs="+", default=[0, 5, 50], help="lengths of the proto chain")
+    members.add_argument("-n", "--calls", type=int, default=20000, help="method calls per run")
+    members.add_argument("-r", "--runs", type=int, default=3, help="number of timed runs")
+    members.set_defaults(func=bench_members)
+
+    loops = subparsers.add_parser("loops", help="time each iteration of counter loops in every engine")
+    loops.add_argument("-b", "--baseline", help="git revision whose interpreter to compare against")
+    loops.add_argument("-n", "--iterations", type=int, default=100000, help="iterations of each loop")
+    loops.add_argument("-r", "--runs", type=int, default=3, help="number of timed runs")
+    loops.set_defaults(func=bench_loops)
+
+    objects = subparsers.add_parser("objects", help="time building and walking a linked list and a tree of objects, and their memory use")
+    objects.add_argument("-b", "--baseline", help="git revision whose interpreter to compare against")
+    objects.add_argument("-n", "--objects", type=int, default=5000, help="objects per program")
+    objects.add_argument("-r", "--runs", type=int, default=3, help="number of timed runs")
+    objects.set_defaults(func=bench_objects)
+
+    allocations = subparsers.add_parser("allocations", help="count the values each interpreter creates running the engine programs")
+    allocations.add_argument("versions", nargs="*", type=int, default=[2, 3, 4], help="interpreter versions (default: 2-4)")
+    allocations.add_argument("-b", "--baseline", help="git revision whose interpreters to compare against")
+    allocations.add_argument("-n", "--size", type=int, default=20000, help="loop iterations (fib is computed for size / 1000)")
+    allocations.add_argument("-r", "--runs", type=int, default=3, help="number of timed runs")
+    allocations.set_defaults(func=bench_allocations)
+
+    tail_calls = subparsers.add_parser("tail-calls", help="check that a tail-recursive loop runs without growing the stack or memory in versions 2-4")
+    tail_calls.add_argument("-n", "--calls", type=int, default=1000000, help="tail calls the loop makes")
+    tail_calls.set_defaults(func=bench_tail_calls)
+
+    call_depth = subparsers.add_parser("call-depth", help="time deep non-tail recursion in the vm engine, which keeps calls on the heap, and its memory per call, and check tail calls reuse one frame")
+    call_depth.add_argument("-d", "--depths", type=int, nargs="+", default=[1000, 10000, 100000], help="numbers of nested calls")
+    call_depth.set_defaults(func=bench_call_depth)
+
+    deep_expressions = subparsers.add_parser("deep-expressions", help="time evaluating expressions with tens of thousands of operands in every interpreter and engine")
+    deep_expressions.add_argument("-n", "--operands", type=int, nargs="+", default=[10000, 100000], help="how many operands to add")
+    deep_expressions.set_defaults(func=bench_deep_expressions)
+
+    parse_threads = subparsers.add_parser("parse-threads", help="parse random programs concurrently and check the results")
+    parse_threads.add_argument("-p", "--programs", type=int, default=1000, help="number of distinct programs")
+    parse_threads.add_argument("-r", "--repeat", type=int, default=5, help="times to parse each program")
+    parse_threads.add_argument("-t", "--threads", type=int, default=16, help="number of threads")
+    parse_threads.add_argument("-s", "--seed", type=int, default=131, help="random seed")
+    parse_threads.set_defaults(func=bench_parse_threads)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+from element import (
+    ProgramDef, FuncDef, LambdaDef, ArgDef, Assignment, IfStatement, WhileStatement,
+    ReturnStatement, BinaryOperation, UnaryOperation, Literal, NilLiteral, ObjectLiteral,
+    Variable, FuncCall, MethodCall,
+)
+from brewparse import parse_program
+from symbols import intern_symbols
+from hashlib import sha256
+import marshal, mmap, os, struct
+
+# Precompiled Brewin' programs (.brewc files). A .brewc file holds the parsed AST
+# of one source file so later runs can skip lexing and parsing. It starts with a
+# fixed-size header:
+#   magic, format version, interpreter version,
+#   grammar signature (hash of the modules that determine the AST),
+#   sha256 of the source, payload length
+# followed by a marshalled node table. The table lists the nodes children first,
+# each as (node type, *constructor arguments), where arguments that are nodes
+# refer to earlier entries by index, so the AST is written and rebuilt without
+# recursion.
+# Any mismatch in the header means the file is stale and the source gets parsed.
+
+MAGIC = b"BREWC\0"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<6sHB32s32sQ")
+EXTENSION = ".brewc"
+
+NODE_TYPES = (
+    ProgramDef, FuncDef, LambdaDef, ArgDef, Assignment, IfStatement, WhileStatement,
+    ReturnStatement, BinaryOperation, UnaryOperation, Literal, NilLiteral, ObjectLiteral,
+    Variable, FuncCall, MethodCall,
+)
+NODE_TYPE_INDEX = {node_type: i for i, node_type in enumerate(NODE_TYPES)}
+# Node types whose constructors take the elem_type before the fields
+TYPED_NODES = frozenset((ArgDef, BinaryOperation, UnaryOperation, Literal))
+# Fields that hold plain values; every other field holds a node, a list of nodes or None
+VALUE_FIELDS = frozenset(("name", "objref", "val"))
+GRAMMAR_MODULES = (
+    "intbase.py", "diagnostics.py", "element.py", "symbols.py", "brewlex.py", "brewscan.py", "brewparse.py",
+    "brewrdparse.py",
+)
+
+_grammar_signature = None
+
+
+def grammar_signature():
+    global _grammar_signature
+    if _grammar_signature is None:
+        digest = sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for module in GRAMMAR_MODULES:
+            with open(os.path.join(directory, module), "rb") as infile:
+                digest.update(infile.read())
+        _grammar_signature = digest.digest()
+    return _grammar_signature
+
+
+def source_digest(source):
+    return sha256(source.encode()).digest()
+
+
+def compiled_path(source_path):
+    return os.path.splitext(source_path)[0] + EXTENSION
+
+
+def flatten(ast):
+    table = []
+    index = {}
+    stack = [(ast, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if id(node) in index:
+            continue
+        values = [getattr(node, field) for field in node.fields]
+        if not children_done:
+            stack.append((node, True))
+            for field, value in zip(node.fields, values):
+                if field in VALUE_FIELDS or value is None:
+                    continue
+                if isinstance(value, list):
+                    stack.extend((child, False) for child in value)
+                else:
+                    stack.append((value, False))
+            continue
+        row = [NODE_TYPE_INDEX[type(node)]]
+        if type(node) in TYPED_NODES:
+            row.append(node.elem_type)
+        for field, value in zip(node.fields, values):
+            if field in VALUE_FIELDS or value is None:
+                row.append(value)
+            elif isinstance(value, list):
+                row.append(tuple(index[id(child)] for child in value))
+            else:
+                row.append(index[id(value)])
+        index[id(node)] = len(table)
+        table.append(tuple(row))
+    return table
+
+
+def unflatten(table):
+    nodes = []
+
+    def node(i):
+        return None if i is None else nodes[i]
+
+    def node_list(indexes):
+        return None if indexes is None else [nodes[i] for i in indexes]
+
+    # In the order of NODE_TYPES
+    builders = (
+        lambda functions: ProgramDef(node_list(functions)),
+        lambda name, args, statements: FuncDef(name, node_list(args), node_list(statements)),
+        lambda args, statements: LambdaDef(node_list(args), node_list(statements)),
+        ArgDef,
+        lambda name, expression: Assignment(name, nodes[expression]),
+        lambda condition, statements, else_statements: IfStatement(
+            nodes[condition], node_list(statements), node_list(else_statements)),
+        lambda condition, statements: WhileStatement(nodes[condition], node_list(statements)),
+        lambda expression: ReturnStatement(node(expression)),
+        lambda operator, op1, op2: BinaryOperation(operator, nodes[op1], nodes[op2]),
+        lambda operator, op1: UnaryOperation(operator, nodes[op1]),
+        Literal,
+        NilLiteral,
+        ObjectLiteral,
+        Variable,
+        lambda name, args: FuncCall(name, node_list(args)),
+        lambda objref, name, args: MethodCall(objref, name, node_list(args)),
+    )
+    add_node = nodes.append
+    for node_type, *args in table:
+        add_node(builders[node_type](*args))
+    if type(nodes[-1]) is not ProgramDef:
+        raise ValueError("Not a program")
+    return nodes[-1]
+
+
+# Writes to a temporary file and renames it, so a concurrent run never reads a
+# half-written file. The file is created with the mode open() would give it (the
+# kernel applies the umask), under a random name that's retried if taken.
+def write_atomically(path, *chunks):
+    base, extension = os.path.splitext(os.path.abspath(path))
+    while True:
+        temp_path = f"{base}.{os.urandom(8).hex()}.tmp{extension}"
+        try:
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+            break
+        except FileExistsError:
+            pass
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            for chunk in chunks:
+                outfile.write(chunk)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def dump(path, ast, source, interpreter_version):
+    payload = marshal.dumps(flatten(ast))
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, interpreter_version, grammar_signature(),
+                         source_digest(source), len(payload))
+    write_atomically(path, header, payload)
+
+
+# Only version 4 has objects; earlier versions intern "var.member" as one name
+def splits_members(interpreter_version):
+    return interpreter_version >= 4
+
+
+# Returns the AST stored in path, or None if there is no usable .brewc file for
+# this source and interpreter version
+def load(path, source, interpreter_version):
+    try:
+        with open(path, "rb") as infile, mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if len(data) < HEADER.size:
+                return None
+            magic, format_version, version, grammar, digest, length = HEADER.unpack_from(data)
+            if (magic != MAGIC or format_version != FORMAT_VERSION or version != interpreter_version
+                    or length != len(data) - HEADER.size or grammar != grammar_signature()
+                    or digest != source_digest(source)):
+                return None
+            with memoryview(data)[HEADER.size:] as payload:
+                table = marshal.loads(payload)
+        return intern_symbols(unflatten(table), splits_members(interpreter_version))
+    except (OSError, ValueError, EOFError, TypeError, IndexError, AttributeError):
+        return None
+
+
+# Parses source, reusing the .brewc file next to source_path when it is up to
+# date and writing a new one when it isn't. Programs with syntax errors (which
+# ply may have recovered from) are never written, so their errors get reported
+# on every run.
+def parse_file(source_path, source, interpreter_version):
+    path = compiled_path(source_path)
+    ast = load(path, source, interpreter_version)
+    if ast is None:
+        ast = parse_program(source, members=splits_members(interpreter_version))
+        if not ast.diagnostics:
+            try:
+                dump(path, ast, source, interpreter_version)
+            except OSError:
+                pass
+    return ast
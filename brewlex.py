@@ -1,4 +1,11 @@
+from diagnostics import Diagnostics
 from ply import lex
+from os import environ
+
+# In optimized mode (BREWIN_OPTIMIZE=1), ply skips validating the rules below and
+# loads the prebuilt lextab module instead of building the master regex. The
+# table is written on the first optimized import if it doesn't exist yet.
+OPTIMIZE = environ.get("BREWIN_OPTIMIZE") == "1"
 
 reserved = (
     "FUNC",
@@ -110,9 +117,26 @@ def t_newline(t):
     t.lexer.lineno += t.value.count("\n")
 
 
+# Finds the end of the comment with str.find rather than in the regex, which
+# would rescan the rest of the input for every unterminated "/*". Once a search
+# fails, no comment after that point can be terminated either, so the lexer
+# remembers where that is.
 def t_comment(t):
-    r"/\*(.|\n)*?\*/"
-    t.lexer.lineno += t.value.count("\n")
+    r"/\*"
+    lexer = t.lexer
+    end = -1
+    searched = lexer.no_comment_end
+    if searched is None or searched[0] is not lexer.lexdata or lexer.lexpos < searched[1]:
+        end = lexer.lexdata.find("*/", lexer.lexpos)
+    if end == -1:
+        # Not a comment: lex the "/" on its own and carry on from the "*"
+        lexer.no_comment_end = (lexer.lexdata, lexer.lexpos)
+        lexer.lexpos = t.lexpos + 1
+        t.type = "DIVIDE"
+        t.value = "/"
+        return t
+    lexer.lineno += lexer.lexdata.count("\n", lexer.lexpos, end)
+    lexer.lexpos = end + 2
 
 
 def t_STRING(t):
@@ -121,10 +145,23 @@ def t_STRING(t):
     return t
 
 
+# Catches every character no other rule can start with, a run at a time. Without
+# it ply would call t_error, which copies the rest of the input for every
+# illegal character. Function rules are tried before the operator rules, so it
+# mustn't match anything they can (including "&&" and "||").
+def t_illegal(t):
+    r'[^A-Za-z_\d \t\n(){},.;@+\-*/=!<>&|"]+|&(?!&)|\|(?!\|)'
+    t.lexer.diagnostics.illegal_characters(t.value, t.lineno)
+
+
 def t_error(t):
-    print(f"Illegal character {t.value[0]}")
+    t.lexer.diagnostics.illegal_characters(t.value[0], t.lineno)
     t.lexer.skip(1)
 
 
-# Build the lexer
-lex.lex()
+# Build the lexer. Use a clone of it for each input, since lexers keep their
+# position and line number as they go. Errors are recorded in the lexer's
+# diagnostics, which clones share unless they are given their own.
+lexer = lex.lex(optimize=OPTIMIZE, lextab="lextab")
+lexer.diagnostics = Diagnostics()
+lexer.no_comment_end = None
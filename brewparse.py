@@ -1,10 +1,23 @@
-from element import Element
-from brewlex import *
+from element import (
+    ProgramDef, FuncDef, LambdaDef, ArgDef, Assignment, IfStatement, WhileStatement,
+    ReturnStatement, BinaryOperation, UnaryOperation, Literal, NilLiteral, ObjectLiteral,
+    Variable, FuncCall, MethodCall,
+)
+from brewlex import OPTIMIZE, lexer
+from diagnostics import Diagnostics
 from intbase import InterpreterBase
+from os import environ
 from ply import yacc
+from symbols import intern_symbols
+import brewlex
+import brewrdparse
+import copy
 
 # Parsing rules
 
+# yacc reads the grammar's terminals from this module's tokens
+tokens = brewlex.tokens
+
 precedence = (
     ("left", "OR"),
     ("left", "AND"),
@@ -25,7 +38,7 @@ def collapse_items(p, group_index, singleton_index):
 
 def p_program(p):
     "program : funcs"
-    p[0] = Element(InterpreterBase.PROGRAM_DEF, functions=p[1])
+    p[0] = ProgramDef(p[1])
 
 
 def p_funcs(p):
@@ -38,18 +51,18 @@ def p_func(p):
     """func : FUNC NAME LPAREN formal_args RPAREN LBRACE statements RBRACE
     | FUNC NAME LPAREN RPAREN LBRACE statements RBRACE"""
     if len(p) == 9:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.FUNC_DEF, name=p[2], args=p[4], statements=p[7])
+        p[0] = FuncDef(p[2], p[4], p[7])
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.FUNC_DEF, name=p[2], args=[], statements=p[6])
+        p[0] = FuncDef(p[2], [], p[6])
 
 
 def p_lambda(p):
     """lambda : LAMBDA LPAREN formal_args RPAREN LBRACE statements RBRACE
     | LAMBDA LPAREN RPAREN LBRACE statements RBRACE"""
     if len(p) == 8:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.LAMBDA_DEF, args=p[3], statements=p[6])
+        p[0] = LambdaDef(p[3], p[6])
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.LAMBDA_DEF, args=[], statements=p[5])
+        p[0] = LambdaDef([], p[5])
 
 
 def p_formal_args(p):
@@ -60,12 +73,12 @@ def p_formal_args(p):
 
 def p_formal_arg(p):
     "formal_arg : NAME"
-    p[0] = Element(InterpreterBase.ARG_DEF, name=p[1])
+    p[0] = ArgDef(InterpreterBase.ARG_DEF, p[1])
 
 
 def p_formal_ref_arg(p):
     "formal_arg : REF NAME"
-    p[0] = Element(InterpreterBase.REFARG_DEF, name=p[2])
+    p[0] = ArgDef(InterpreterBase.REFARG_DEF, p[2])
 
 
 def p_statements(p):
@@ -76,7 +89,7 @@ def p_statements(p):
 
 def p_statement___assign(p):
     "statement : variable ASSIGN expression SEMI"
-    p[0] = Element("=", name=p[1], expression=p[3])
+    p[0] = Assignment(p[1], p[3])
 
 
 def p_variable(p):
@@ -93,24 +106,14 @@ def p_statement_if(p):
     | IF LPAREN expression RPAREN LBRACE statements RBRACE ELSE LBRACE statements RBRACE
     """
     if len(p) == 8:
-        p[0] = Element(
-            InterpreterBase.IF_DEF,
-            condition=p[3],
-            statements=p[6],
-            else_statements=None,
-        )
+        p[0] = IfStatement(p[3], p[6], None)
     else:
-        p[0] = Element(
-            InterpreterBase.IF_DEF,
-            condition=p[3],
-            statements=p[6],
-            else_statements=p[10],
-        )
+        p[0] = IfStatement(p[3], p[6], p[10])
 
 
 def p_statement_while(p):
     "statement : WHILE LPAREN expression RPAREN LBRACE statements RBRACE"
-    p[0] = Element(InterpreterBase.WHILE_DEF, condition=p[3], statements=p[6])
+    p[0] = WhileStatement(p[3], p[6])
 
 
 def p_statement_expr(p):
@@ -125,17 +128,17 @@ def p_statement_return(p):
         expr = p[2]
     else:
         expr = None
-    p[0] = Element(InterpreterBase.RETURN_DEF, expression=expr)
+    p[0] = ReturnStatement(expr)
 
 
 def p_expression_not(p):
     "expression : NOT expression"
-    p[0] = Element(InterpreterBase.NOT_DEF, op1=p[2])
+    p[0] = UnaryOperation(InterpreterBase.NOT_DEF, p[2])
 
 
 def p_expression_uminus(p):
     "expression : MINUS expression %prec UMINUS"
-    p[0] = Element(InterpreterBase.NEG_DEF, op1=p[2])
+    p[0] = UnaryOperation(InterpreterBase.NEG_DEF, p[2])
 
 
 def p_arith_expression_binop(p):
@@ -149,7 +152,7 @@ def p_arith_expression_binop(p):
     | expression MINUS expression
     | expression MULTIPLY expression
     | expression DIVIDE expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinaryOperation(p[2], p[1], p[3])
 
 
 def p_expression_group(p):
@@ -160,12 +163,12 @@ def p_expression_group(p):
 def p_expression_and_or(p):
     """expression : expression OR expression
     | expression AND expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinaryOperation(p[2], p[1], p[3])
 
 
 def p_expression_number(p):
     "expression : NUMBER"
-    p[0] = Element(InterpreterBase.INT_DEF, val=p[1])
+    p[0] = Literal(InterpreterBase.INT_DEF, p[1])
 
 
 def p_expression_lambda(p):
@@ -177,47 +180,47 @@ def p_expression_bool(p):
     """expression : TRUE
     | FALSE"""
     bool_val = p[1] == InterpreterBase.TRUE_DEF
-    p[0] = Element(InterpreterBase.BOOL_DEF, val=bool_val)
+    p[0] = Literal(InterpreterBase.BOOL_DEF, bool_val)
 
 
 def p_expression_nil(p):
     "expression : NIL"
-    p[0] = Element(InterpreterBase.NIL_DEF)
+    p[0] = NilLiteral()
 
 
 def p_expression_obj(
     p,
 ):  # e.g. a = @;   ### creates a new dictionary/object and stores in a
     "expression : AT"
-    p[0] = Element(InterpreterBase.OBJ_DEF)
+    p[0] = ObjectLiteral()
 
 
 def p_expression_string(p):
     "expression : STRING"
-    p[0] = Element(InterpreterBase.STRING_DEF, val=p[1])
+    p[0] = Literal(InterpreterBase.STRING_DEF, p[1])
 
 
 def p_expression_variable(p):
     "expression : variable"
-    p[0] = Element(InterpreterBase.VAR_DEF, name=p[1])
+    p[0] = Variable(p[1])
 
 
 def p_func_call(p):
     """expression : NAME LPAREN args RPAREN
     | NAME LPAREN RPAREN"""
     if len(p) == 5:
-        p[0] = Element(InterpreterBase.FCALL_DEF, name=p[1], args=p[3])
+        p[0] = FuncCall(p[1], p[3])
     else:
-        p[0] = Element(InterpreterBase.FCALL_DEF, name=p[1], args=[])
+        p[0] = FuncCall(p[1], [])
 
 
 def p_method_call(p):
     """expression : NAME DOT NAME LPAREN args RPAREN
     | NAME DOT NAME LPAREN RPAREN"""
     if len(p) == 7:
-        p[0] = Element(InterpreterBase.MCALL_DEF, objref=p[1], name=p[3], args=p[5])
+        p[0] = MethodCall(p[1], p[3], p[5])
     else:
-        p[0] = Element(InterpreterBase.MCALL_DEF, objref=p[1], name=p[3], args=[])
+        p[0] = MethodCall(p[1], p[3], [])
 
 
 def p_expression_args(p):
@@ -226,20 +229,48 @@ def p_expression_args(p):
     collapse_items(p, 1, 3)
 
 
+# parse_program replaces this with a function that records the error in the
+# program's diagnostics
 def p_error(p):
-    if p:
-        print(f"Syntax error at '{p.value}'")
-    else:
-        print("Syntax error at EOF")
-
-
-# exported function
-def parse_program(program):
-    ast = yacc.parse(program)
+    pass
+
+
+# Which parser parse_program uses by default: "ply" (this module's LALR parser) or
+# "rd" (the hand-written recursive descent parser in brewrdparse)
+PARSER_BACKENDS = ("ply", "rd")
+DEFAULT_PARSER_BACKEND = environ.get("BREWIN_PARSER", "ply")
+
+
+# exported function. Lexing and parsing errors don't print anything; they are
+# collected in the diagnostics of the returned program (ply can recover from some
+# syntax errors) or of the SyntaxError raised when parsing fails. The returned
+# program's identifiers are interned (see symbols.py), with "var.member" names
+# split unless members is False.
+def parse_program(program, backend=None, members=True):
+    if (backend or DEFAULT_PARSER_BACKEND) == "rd":
+        return brewrdparse.parse_program(program, members)
+    # ply parsers and lexers hold the state of the parse in progress, so each call
+    # gets its own copies (which share the underlying tables) and can run
+    # concurrently with other calls
+    parser = copy.copy(base_parser)
+    program_lexer = lexer.clone()
+    diagnostics = program_lexer.diagnostics = Diagnostics()
+
+    def record_error(p):
+        if p:
+            diagnostics.syntax_error(p.value, p.lineno)
+        else:
+            diagnostics.syntax_error(None, program_lexer.lineno)
+
+    parser.errorfunc = record_error
+    ast = parser.parse(program, lexer=program_lexer)
     if ast is None:
-        raise SyntaxError("Syntax error")
-    return ast
+        error = SyntaxError("Syntax error")
+        error.diagnostics = diagnostics
+        raise error
+    ast.diagnostics = diagnostics
+    return intern_symbols(ast, members)
 
 
-# generate our parser
-yacc.yacc()
+# generate our parser (or, in optimized mode, load parsetab without checking its signature)
+base_parser = yacc.yacc(optimize=OPTIMIZE, debug=False)
@@ -0,0 +1,242 @@
+from element import (
+    ProgramDef, FuncDef, LambdaDef, ArgDef, Assignment, IfStatement, WhileStatement,
+    ReturnStatement, BinaryOperation, UnaryOperation, Literal, NilLiteral, ObjectLiteral,
+    Variable, FuncCall, MethodCall,
+)
+from diagnostics import Diagnostics
+from intbase import InterpreterBase
+from symbols import intern_symbols
+from brewscan import (
+    END, FUNC, ELSE, LAMBDA, REF, LPAREN, RPAREN, LBRACE, RBRACE, COMMA, DOT, SEMI,
+    EQ, NOT_EQ, GREATER_EQ, GREATER, LESS_EQ, LESS, ASSIGN,
+    PLUS, MINUS, MULTIPLY, DIVIDE, NAME, AND, OR, NOT,
+)
+import brewscan
+
+# Hand-written recursive descent parser for the grammar in brewparse.py. Binary
+# operators are parsed by precedence climbing, with the same precedence and
+# associativity as brewparse's precedence table, so it builds the same AST as
+# the ply parser for every valid program. Unlike ply it does not attempt error
+# recovery: any syntax error fails the whole parse. Tokens come from brewscan as
+# parallel arrays of type codes and values (match statements refer to the codes
+# as brewscan.X, since a bare name in a case pattern is a capture).
+
+# Binding power of each binary operator (all are left associative)
+BINARY_PRECEDENCE = {
+    OR: 1,
+    AND: 2,
+    EQ: 3,
+    NOT_EQ: 3,
+    GREATER_EQ: 3,
+    GREATER: 3,
+    LESS_EQ: 3,
+    LESS: 3,
+    PLUS: 4,
+    MINUS: 4,
+    MULTIPLY: 5,
+    DIVIDE: 5,
+}
+# Unary minus and not bind tighter than any binary operator
+UNARY_OPERATORS = {
+    MINUS: InterpreterBase.NEG_DEF,
+    NOT: InterpreterBase.NOT_DEF,
+}
+
+
+class ParseError(Exception):
+    pass
+
+
+class Parser:
+    def __init__(self, types, values, lines, diagnostics):
+        self.types = types
+        self.types.append(END)
+        self.values = values
+        self.values.append(None)
+        self.lines = lines
+        self.lines.append(lines[-1] if lines else 1)
+        self.diagnostics = diagnostics
+        self.pos = 0
+
+    def peek(self, offset=0):
+        return self.types[min(self.pos + offset, len(self.types) - 1)]
+
+    def error(self):
+        # The value of the END token is None, which reports the error at EOF
+        self.diagnostics.syntax_error(self.values[self.pos], self.lines[self.pos])
+        raise ParseError()
+
+    def expect(self, token_type):
+        if self.types[self.pos] != token_type:
+            self.error()
+        value = self.values[self.pos]
+        self.pos += 1
+        return value
+
+    def accept(self, token_type):
+        if self.types[self.pos] == token_type:
+            self.pos += 1
+            return True
+        return False
+
+    def parse_program(self):
+        functions = [self.parse_func()]
+        while self.peek() != END:
+            functions.append(self.parse_func())
+        return ProgramDef(functions)
+
+    def parse_func(self):
+        self.expect(FUNC)
+        name = self.expect(NAME)
+        args = self.parse_formal_args()
+        return FuncDef(name, args, self.parse_block())
+
+    def parse_lambda(self):
+        self.expect(LAMBDA)
+        args = self.parse_formal_args()
+        return LambdaDef(args, self.parse_block())
+
+    def parse_formal_args(self):
+        self.expect(LPAREN)
+        args = []
+        if self.accept(RPAREN):
+            return args
+        while True:
+            if self.accept(REF):
+                args.append(ArgDef(InterpreterBase.REFARG_DEF, self.expect(NAME)))
+            else:
+                args.append(ArgDef(InterpreterBase.ARG_DEF, self.expect(NAME)))
+            if self.accept(RPAREN):
+                return args
+            self.expect(COMMA)
+
+    # A block holds one or more statements
+    def parse_block(self):
+        self.expect(LBRACE)
+        statements = [self.parse_statement()]
+        while not self.accept(RBRACE):
+            statements.append(self.parse_statement())
+        return statements
+
+    def parse_statement(self):
+        match self.peek():
+            case brewscan.IF:
+                self.pos += 1
+                condition = self.parse_condition()
+                statements = self.parse_block()
+                else_statements = None
+                if self.accept(ELSE):
+                    else_statements = self.parse_block()
+                return IfStatement(condition, statements, else_statements)
+            case brewscan.WHILE:
+                self.pos += 1
+                condition = self.parse_condition()
+                return WhileStatement(condition, self.parse_block())
+            case brewscan.RETURN:
+                self.pos += 1
+                if self.accept(SEMI):
+                    return ReturnStatement(None)
+                expression = self.parse_expression()
+                self.expect(SEMI)
+                return ReturnStatement(expression)
+            case brewscan.NAME if self.peek(1) == ASSIGN:
+                name = self.values[self.pos]
+                self.pos += 2
+                return self.parse_assignment(name)
+            case brewscan.NAME if self.peek(1) == DOT and self.peek(2) == NAME and self.peek(3) == ASSIGN:
+                name = self.values[self.pos] + "." + self.values[self.pos + 2]
+                self.pos += 4
+                return self.parse_assignment(name)
+        expression = self.parse_expression()
+        self.expect(SEMI)
+        return expression
+
+    def parse_assignment(self, name):
+        expression = self.parse_expression()
+        self.expect(SEMI)
+        return Assignment(name, expression)
+
+    def parse_condition(self):
+        self.expect(LPAREN)
+        condition = self.parse_expression()
+        self.expect(RPAREN)
+        return condition
+
+    def parse_expression(self, min_precedence=1):
+        left = self.parse_unary()
+        while True:
+            precedence = BINARY_PRECEDENCE.get(self.types[self.pos])
+            if precedence is None or precedence < min_precedence:
+                return left
+            operator = self.values[self.pos]
+            self.pos += 1
+            left = BinaryOperation(operator, left, self.parse_expression(precedence + 1))
+
+    def parse_unary(self):
+        operator = UNARY_OPERATORS.get(self.types[self.pos])
+        if operator is not None:
+            self.pos += 1
+            return UnaryOperation(operator, self.parse_unary())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token_type = self.types[self.pos]
+        value = self.values[self.pos]
+        match token_type:
+            case brewscan.NUMBER:
+                self.pos += 1
+                return Literal(InterpreterBase.INT_DEF, value)
+            case brewscan.STRING:
+                self.pos += 1
+                return Literal(InterpreterBase.STRING_DEF, value)
+            case brewscan.TRUE | brewscan.FALSE:
+                self.pos += 1
+                return Literal(InterpreterBase.BOOL_DEF, value == InterpreterBase.TRUE_DEF)
+            case brewscan.NIL:
+                self.pos += 1
+                return NilLiteral()
+            case brewscan.AT:
+                self.pos += 1
+                return ObjectLiteral()
+            case brewscan.LAMBDA:
+                return self.parse_lambda()
+            case brewscan.LPAREN:
+                self.pos += 1
+                expression = self.parse_expression()
+                self.expect(RPAREN)
+                return expression
+            case brewscan.NAME:
+                self.pos += 1
+                if self.accept(DOT):
+                    member = self.expect(NAME)
+                    if self.accept(LPAREN):
+                        return MethodCall(value, member, self.parse_args())
+                    return Variable(value + "." + member)
+                if self.accept(LPAREN):
+                    return FuncCall(value, self.parse_args())
+                return Variable(value)
+        self.error()
+
+    # Parses call arguments after the opening parenthesis
+    def parse_args(self):
+        args = []
+        if self.accept(RPAREN):
+            return args
+        while True:
+            args.append(self.parse_expression())
+            if self.accept(RPAREN):
+                return args
+            self.expect(COMMA)
+
+
+def parse_program(program, members=True):
+    diagnostics = Diagnostics()
+    types, values, lines, _ = brewscan.scan(program, diagnostics)
+    try:
+        ast = Parser(types, values, lines, diagnostics).parse_program()
+    except ParseError:
+        error = SyntaxError("Syntax error")
+        error.diagnostics = diagnostics
+        raise error from None
+    ast.diagnostics = diagnostics
+    return intern_symbols(ast, members)
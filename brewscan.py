@@ -0,0 +1,154 @@
+from array import array
+from diagnostics import Diagnostics
+import re
+
+# Scanner that produces the same tokens as brewlex's ply lexer, but stores them in
+# three parallel arrays instead of allocating a LexToken per token:
+#   types:  array of token type codes (indexes into TOKEN_TYPES)
+#   values: list of token values (int for NUMBER, the text between the quotes for
+#           STRING, the matched text for everything else)
+#   lines:  array of line numbers
+# along with the diagnostics for any illegal characters that were skipped.
+
+TOKEN_TYPES = (
+    "$end",
+    # reserved words
+    "FUNC", "IF", "ELSE", "WHILE", "RETURN", "TRUE", "FALSE", "NIL", "LAMBDA", "REF",
+    "LPAREN", "RPAREN", "LBRACE", "RBRACE", "COMMA", "DOT", "AT", "SEMI",
+    "EQ", "NOT_EQ", "GREATER_EQ", "GREATER", "LESS_EQ", "LESS", "ASSIGN",
+    "PLUS", "MINUS", "MULTIPLY", "DIVIDE", "NUMBER", "NAME", "STRING", "AND", "OR", "NOT",
+    # a quote that doesn't start a string (ply lexes it as a literal)
+    '"',
+)
+(
+    END,
+    FUNC, IF, ELSE, WHILE, RETURN, TRUE, FALSE, NIL, LAMBDA, REF,
+    LPAREN, RPAREN, LBRACE, RBRACE, COMMA, DOT, AT, SEMI,
+    EQ, NOT_EQ, GREATER_EQ, GREATER, LESS_EQ, LESS, ASSIGN,
+    PLUS, MINUS, MULTIPLY, DIVIDE, NUMBER, NAME, STRING, AND, OR, NOT,
+    QUOTE,
+) = range(len(TOKEN_TYPES))
+
+RESERVED = {
+    "func": FUNC,
+    "if": IF,
+    "else": ELSE,
+    "while": WHILE,
+    "return": RETURN,
+    "true": TRUE,
+    "false": FALSE,
+    "nil": NIL,
+    "lambda": LAMBDA,
+    "ref": REF,
+}
+
+OPERATORS = {
+    "(": LPAREN,
+    ")": RPAREN,
+    "{": LBRACE,
+    "}": RBRACE,
+    ",": COMMA,
+    ".": DOT,
+    "@": AT,
+    ";": SEMI,
+    "==": EQ,
+    "!=": NOT_EQ,
+    ">=": GREATER_EQ,
+    ">": GREATER,
+    "<=": LESS_EQ,
+    "<": LESS,
+    "=": ASSIGN,
+    "+": PLUS,
+    "-": MINUS,
+    "*": MULTIPLY,
+    "/": DIVIDE,
+    "&&": AND,
+    "||": OR,
+    "!": NOT,
+}
+
+# Strings and comments are found first, and the code between them is split into
+# lexemes by CODE_LEXEME. Every step either consumes input or is bounded by the
+# end of the line, so scanning takes time linear in the length of the source
+# (even for unterminated comments and strings, or long runs of illegal
+# characters).
+STRING_OR_COMMENT = re.compile(r'"|/\*')
+STRING_END = re.compile(r'[^"\n]*"')
+# Spaces and tabs are skipped and every other lexeme is captured (trailing spaces
+# give an empty capture). Alternatives that can start with the same character
+# are ordered the way ply orders brewlex's rules ("==" before "="); the rest are
+# ordered by how common they are. Runs of illegal characters are captured
+# together, and the last alternative catches a lone "&" or "|".
+CODE_LEXEME = re.compile(
+    r'''[ \t]*([A-Za-z_]\w*|[(){},.;@+\-*/\n]|\d+|[=!<>]=?|&&|\|\||[^A-Za-z_\d \t\n(){},.;@+\-*/=!<>&|"]+|[^ \t])?'''
+)
+
+NEWLINE = len(TOKEN_TYPES)
+FIXED = {**RESERVED, **OPERATORS, "\n": NEWLINE}
+NAME_START = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_")
+
+
+def scan(source, diagnostics=None):
+    if diagnostics is None:
+        diagnostics = Diagnostics()
+    types = array("B")
+    values = []
+    lines = array("I")
+    add_type, add_value, add_line = types.append, values.append, lines.append
+    fixed_get = FIXED.get
+    lineno = 1
+    pos = 0
+    # No comment can end at or after this position
+    no_comment_end = len(source) + 2
+    while True:
+        special = STRING_OR_COMMENT.search(source, pos)
+        code_end = special.start() if special else len(source)
+        for text in CODE_LEXEME.findall(source, pos, code_end):
+            code = fixed_get(text)
+            if code is None:
+                if not text:
+                    continue
+                first = text[0]
+                if first in NAME_START:
+                    code = NAME
+                elif text.isdecimal():
+                    code = NUMBER
+                    text = int(text)
+                else:
+                    diagnostics.illegal_characters(text, lineno)
+                    continue
+            elif code == NEWLINE:
+                lineno += 1
+                continue
+            add_type(code)
+            add_value(text)
+            add_line(lineno)
+        if special is None:
+            return types, values, lines, diagnostics
+
+        if source[code_end] == '"':
+            string_end = STRING_END.match(source, code_end + 1)
+            if string_end:
+                add_type(STRING)
+                add_value(source[code_end + 1:string_end.end() - 1])
+                pos = string_end.end()
+            else:
+                # ply lexes a quote that doesn't start a string as a literal
+                add_type(QUOTE)
+                add_value('"')
+                pos = code_end + 1
+            add_line(lineno)
+        else:
+            comment_end = -1
+            if code_end + 2 < no_comment_end:
+                comment_end = source.find("*/", code_end + 2)
+            if comment_end == -1:
+                # An unterminated comment is lexed as "/" followed by "*"
+                no_comment_end = code_end + 2
+                add_type(DIVIDE)
+                add_value("/")
+                add_line(lineno)
+                pos = code_end + 1
+            else:
+                lineno += source.count("\n", code_end, comment_end)
+                pos = comment_end + 2
@@ -0,0 +1,602 @@
+from __future__ import annotations
+from array import array
+from closurev4 import INT_OR_BOOL, incompatible, values_equal
+from copyonwrite import copy_pending
+from intbase import ErrorType
+from interpreterv4 import (TypedValue, Constant, NIL, TRUE, FALSE, INT_COMPARISONS, compared_variable, increment_of,
+                           int_value, bool_value)
+from shapes import Members
+from symbols import THIS
+import operator
+
+# Bytecode engine for interpreterv4 (Interpreter(engine='vm')). Each function and
+# lambda body is compiled once per Program into a CodeObject: a flat array of
+# (opcode, argument) pairs, plus a constant table and a name table that the
+# arguments index into; a variable is referred to by its symbol id (see
+# symbols.py). execute() runs a CodeObject with a dispatch loop over a value
+# stack. A Brewin' function call doesn't call execute() again: the caller's place
+# is saved on a list of frames and the loop carries on in the callee, so the
+# depth of Brewin' recursion isn't limited by Python's, but by the Interpreter's
+# max_call_depth; a tail call that can replace its caller reuses the caller's
+# frame and doesn't count towards it. As in closurev4,
+# variables and their scopes live in the Interpreter, and errors are reported by the
+# Interpreter's own methods, so the output matches the tree walker's.
+# disassemble() lists a CodeObject's instructions.
+
+OPCODES = (
+    "LOAD_CONST",     # push the literal consts[arg], a Constant
+    "LOAD_NIL",
+    "NEW_OBJECT",
+    "LOAD_VAR",       # push the variable whose symbol id is arg
+    "LOAD_MEMBER",    # push the member read by the variable node consts[arg]
+    "STORE_VAR",      # pop a value and assign it to the variable whose symbol id is arg
+    "STORE_MEMBER",   # pop a value and assign it to the member names[arg]
+    "MAKE_LAMBDA",    # push a closure of the lambda definition consts[arg]
+    "LOAD_FUNCTION",  # push the function called by the call node consts[arg]
+    "LOAD_METHOD",    # push the method (and its object) called by the call node consts[arg]
+    "CALL",           # call the function below the top arg values with them
+    "POP_TOP",
+    "ADD", "SUB", "MUL", "DIV", "EQ", "NE", "LT", "LE", "GT", "GE", "AND", "OR",
+    "NEG", "NOT",
+    "JUMP",           # continue at arg
+    "TEST_IF",        # pop an 'if' condition and continue at arg if it is false
+    "TEST_WHILE",     # pop a 'while' condition and continue at arg if it is false
+    "PUSH_SCOPE",
+    "POP_SCOPE",
+    "RETURN_VALUE",
+    "RETURN_NIL",
+    "INCREMENT_VAR",  # add to an int variable, names[arg] a (symbol id, int) pair (see below)
+    "COMPARE_VAR",    # test a condition comparing a variable, names[arg] (see below)
+)
+(
+    LOAD_CONST, LOAD_NIL, NEW_OBJECT, LOAD_VAR, LOAD_MEMBER, STORE_VAR, STORE_MEMBER,
+    MAKE_LAMBDA, LOAD_FUNCTION, LOAD_METHOD, CALL, POP_TOP,
+    ADD, SUB, MUL, DIV, EQ, NE, LT, LE, GT, GE, AND, OR,
+    NEG, NOT,
+    JUMP, TEST_IF, TEST_WHILE, PUSH_SCOPE, POP_SCOPE, RETURN_VALUE, RETURN_NIL,
+    INCREMENT_VAR, COMPARE_VAR,
+) = range(len(OPCODES))
+
+# INCREMENT_VAR and COMPARE_VAR are superinstructions for the statements of counter
+# loops (see interpreterv4.increment_of and compared_variable). Each is followed by
+# the instructions it stands for, which it skips when the variables involved hold
+# ints and otherwise leaves to run:
+#   INCREMENT_VAR (x, d)            COMPARE_VAR (x, <, y or None, k)
+#   LOAD_VAR x                      LOAD_VAR x
+#   LOAD_CONST d                    LOAD_VAR y or LOAD_CONST k
+#   ADD or SUB                      LT (or another comparison)
+#   STORE_VAR x                     TEST_IF or TEST_WHILE
+# COMPARE_VAR is only used when y is a variable or k an int literal, whose value
+# doesn't depend on when it's read, and jumps where the TEST does when the
+# comparison is false.
+FUSED_LENGTH = 8
+
+BINARY_OPCODES = {
+    '+': ADD, '-': SUB, '*': MUL, '/': DIV, '==': EQ, '!=': NE,
+    '<': LT, '<=': LE, '>': GT, '>=': GE, '&&': AND, '||': OR,
+}
+OPERATOR_NAMES = {opcode: operator_name for operator_name, opcode in BINARY_OPCODES.items()}
+ARITHMETIC = {ADD: operator.add, SUB: operator.sub, MUL: operator.mul, DIV: operator.floordiv}
+COMPARISONS = {LT: operator.lt, LE: operator.le, GT: operator.gt, GE: operator.ge}
+# Opcodes whose argument is an instruction offset
+JUMPS = frozenset((JUMP, TEST_IF, TEST_WHILE))
+
+
+class CodeObject:
+    __slots__ = ('name', 'code', 'consts', 'names', 'symbols', 'arg_symbols', 'arg_scope', 'by_ref', 'arity')
+
+    # symbols is the program's names by symbol id
+    def __init__(self, name, code, consts, names, symbols, definition):
+        self.name = name
+        self.code = code
+        self.consts = consts
+        self.names = names
+        self.symbols = symbols
+        self.arg_symbols = tuple(arg.symbol for arg in definition.args)
+        # The scope a call binds, when the function captures nothing
+        self.arg_scope = frozenset(self.arg_symbols)
+        self.by_ref = tuple(arg.elem_type == 'refarg' for arg in definition.args)
+        self.arity = len(definition.args)
+
+
+def run_main(interpreter, program):
+    functions = compile_program_code(program)
+    execute(interpreter, functions, functions[program.main_func_node])
+
+
+def compile_program_code(program):
+    functions = program.compiled.get('vm')
+    if functions is None:
+        functions = program.compiled.setdefault('vm', Compiler().compile_program(program.ast))
+    return functions
+
+
+# Builds the code for one function body
+class CodeBuilder:
+    def __init__(self):
+        self.code = array('i')
+        self.consts = []
+        self.names = []
+        self.indexes = {}
+
+    def emit(self, opcode, arg=0):
+        self.code.append(opcode)
+        self.code.append(arg)
+
+    # Emits a jump whose target is filled in by patch() and returns its position
+    def emit_jump(self, opcode):
+        self.emit(opcode)
+        return len(self.code) - 1
+
+    def patch(self, position):
+        self.code[position] = len(self.code)
+
+    def offset(self):
+        return len(self.code)
+
+    def index(self, table, value):
+        # Member pairs, literal pairs and nodes (which hash by identity) are all keys
+        key = (table is self.names, type(value), value)
+        if key not in self.indexes:
+            self.indexes[key] = len(table)
+            table.append(value)
+        return self.indexes[key]
+
+    def const(self, value):
+        return self.index(self.consts, value)
+
+    def name(self, value):
+        return self.index(self.names, value)
+
+
+class Compiler:
+    def __init__(self):
+        # Maps each function and lambda definition node to its CodeObject
+        self.functions = {}
+        self.lambda_count = 0
+        self.symbols = ()
+
+    def compile_program(self, ast):
+        self.symbols = ast.symbols
+        for func_node in ast.functions:
+            self.compile_function(func_node, func_node.name)
+        return self.functions
+
+    def compile_function(self, definition, name):
+        # Reserve the function's place first, so functions are listed before the
+        # lambdas inside them
+        self.functions[definition] = None
+        builder = CodeBuilder()
+        self.compile_block(builder, definition.statements, name)
+        builder.emit(RETURN_NIL)
+        # Literals are indexed by their (type, value) pair, and become the Constant
+        # that LOAD_CONST pushes
+        consts = tuple(Constant(*const) if type(const) is tuple else const for const in builder.consts)
+        self.functions[definition] = CodeObject(
+            name, builder.code, consts, tuple(builder.names), self.symbols, definition)
+
+    def compile_block(self, builder, statements, function_name):
+        for statement in statements:
+            self.compile_statement(builder, statement, function_name)
+
+    # Expression statements other than calls are skipped: the tree walker doesn't
+    # evaluate them
+    def compile_statement(self, builder, node, function_name):
+        match node.elem_type:
+            case '=':
+                delta = increment_of(node)
+                if delta is not None:
+                    builder.emit(INCREMENT_VAR, builder.name((node.symbol, delta)))
+                self.compile_expression(builder, node.expression, function_name)
+                if node.member is not None:
+                    builder.emit(STORE_MEMBER, builder.name((node.symbol, node.member)))
+                else:
+                    builder.emit(STORE_VAR, node.symbol)
+            case 'fcall' | 'mcall':
+                self.compile_expression(builder, node, function_name)
+                builder.emit(POP_TOP)
+            case 'if':
+                self.compile_condition(builder, node.condition, function_name)
+                to_else = builder.emit_jump(TEST_IF)
+                self.compile_scope(builder, node.statements, function_name)
+                if node.else_statements is None:
+                    builder.patch(to_else)
+                else:
+                    to_end = builder.emit_jump(JUMP)
+                    builder.patch(to_else)
+                    self.compile_scope(builder, node.else_statements, function_name)
+                    builder.patch(to_end)
+            case 'while':
+                # One scope for the whole loop, like the tree walker
+                builder.emit(PUSH_SCOPE)
+                loop_start = builder.offset()
+                self.compile_condition(builder, node.condition, function_name)
+                to_end = builder.emit_jump(TEST_WHILE)
+                self.compile_block(builder, node.statements, function_name)
+                builder.emit(JUMP, loop_start)
+                builder.patch(to_end)
+                builder.emit(POP_SCOPE)
+            case 'return':
+                if node.expression is None:
+                    builder.emit(RETURN_NIL)
+                else:
+                    self.compile_expression(builder, node.expression, function_name)
+                    builder.emit(RETURN_VALUE)
+
+    # Compiles a condition, up to the TEST that follows it
+    def compile_condition(self, builder, node, function_name):
+        comparison = compared_variable(node)
+        if comparison is not None:
+            operator_name, symbol, op2_node = comparison
+            if op2_node.elem_type == 'var' and op2_node.member is None:
+                builder.emit(COMPARE_VAR, builder.name((symbol, operator_name, op2_node.symbol, None)))
+            elif op2_node.elem_type == 'int':
+                builder.emit(COMPARE_VAR, builder.name((symbol, operator_name, None, op2_node.val)))
+        self.compile_expression(builder, node, function_name)
+
+    def compile_scope(self, builder, statements, function_name):
+        builder.emit(PUSH_SCOPE)
+        self.compile_block(builder, statements, function_name)
+        builder.emit(POP_SCOPE)
+
+    def compile_expression(self, builder, node, function_name):
+        match node.elem_type:
+            case 'fcall':
+                builder.emit(LOAD_FUNCTION, builder.const(node))
+                self.compile_args(builder, node, function_name)
+            case 'mcall':
+                builder.emit(LOAD_METHOD, builder.const(node))
+                self.compile_args(builder, node, function_name)
+            case 'var':
+                if node.member is not None:
+                    builder.emit(LOAD_MEMBER, builder.const(node))
+                else:
+                    builder.emit(LOAD_VAR, node.symbol)
+            case 'lambda':
+                self.lambda_count += 1
+                self.compile_function(node, f"{function_name}.<lambda {self.lambda_count}>")
+                builder.emit(MAKE_LAMBDA, builder.const(node))
+            case 'nil':
+                builder.emit(LOAD_NIL)
+            case '@':
+                builder.emit(NEW_OBJECT)
+            case 'int' | 'string' | 'bool':
+                builder.emit(LOAD_CONST, builder.const((node.elem_type, node.val)))
+            case 'neg' | '!':
+                self.compile_expression(builder, node.op1, function_name)
+                builder.emit(NEG if node.elem_type == 'neg' else NOT)
+            case _:
+                # Operations nested in the left operand (1 + 2 + 3 + ...) are
+                # compiled in a loop, so a long chain of them doesn't recurse
+                chain = []
+                while node.elem_type in BINARY_OPCODES:
+                    chain.append(node)
+                    node = node.op1
+                self.compile_expression(builder, node, function_name)
+                for node in reversed(chain):
+                    self.compile_expression(builder, node.op2, function_name)
+                    builder.emit(BINARY_OPCODES[node.elem_type])
+
+    def compile_args(self, builder, node, function_name):
+        for arg in node.args:
+            self.compile_expression(builder, arg, function_name)
+        builder.emit(CALL, len(node.args))
+
+
+# Returns what LOAD_FUNCTION and LOAD_METHOD push for a callable value: the
+# function's code, its captured variables and the object it's called on
+def resolve_function(interpreter, functions, func_object, call_node, debug_func_name, method_this):
+    num_args = len(call_node.args)
+    if func_object.type == 'func':
+        code = functions[func_object.value.definition]
+        if code.arity == num_args:
+            return code, func_object.value.free_vars, method_this
+    elif func_object.type == 'overloaded_func' and num_args in func_object.value:
+        return functions[func_object.value[num_args]], {}, method_this
+    # Reports why the function can't be called
+    interpreter.run_function(func_object, call_node.args, debug_func_name, method_this)
+
+
+def binary_operation(interpreter, opcode, op1, op2):
+    ints_or_bools = op1.type in INT_OR_BOOL and op2.type in INT_OR_BOOL
+    if opcode in ARITHMETIC:
+        # Integer arithmetic, with bools coerced to 0 or 1
+        if ints_or_bools:
+            return int_value(ARITHMETIC[opcode](int(op1.value), int(op2.value)))
+        if opcode == ADD and op1.type == 'string' and op2.type == 'string':
+            return TypedValue('string', op1.value + op2.value)
+    elif opcode in COMPARISONS:
+        if op1.type == 'int' and op2.type == 'int':
+            return bool_value(COMPARISONS[opcode](op1.value, op2.value))
+    elif opcode == EQ:
+        # ints are coerced when compared with a bool
+        if ints_or_bools and op1.type != op2.type:
+            return bool_value(bool(op1.value) == bool(op2.value))
+        return bool_value(values_equal(op1, op2))
+    elif opcode == NE:
+        return bool_value(not values_equal(op1, op2))
+    elif ints_or_bools:
+        # && and || evaluate both operands and coerce ints to bools
+        if opcode == AND:
+            return bool_value(op1.value and op2.value)
+        return bool_value(op1.value or op2.value)
+    incompatible(interpreter, OPERATOR_NAMES[opcode], op1, op2)
+
+
+def test_condition(interpreter, value, statement_name):
+    if value.type == 'bool':
+        return value.value
+    if value.type == 'int':
+        return value.value != 0
+    interpreter.error(
+        ErrorType.TYPE_ERROR,
+        f"Expected bool inside '{statement_name}' condition but got {value}"
+    )
+
+
+def execute(interpreter, functions, code_object):
+    code = code_object.code
+    consts = code_object.consts
+    names = code_object.names
+    stacks = interpreter.stacks
+    trail = interpreter.trail
+    marks = interpreter.marks
+    max_call_depth = interpreter.max_call_depth
+    # One value stack for every call: a call's arguments are popped before its
+    # body runs, which leaves only its return value behind
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    # The calls that haven't returned, as (caller's CodeObject, pc to continue at
+    # in it, number of marks when the call was made)
+    frames = []
+    pc = 0
+    while True:
+        opcode = code[pc]
+        arg = code[pc + 1]
+        pc += 2
+        if opcode == LOAD_VAR:
+            values = stacks[arg]
+            if values and values[-1].type != 'overloaded_func':
+                push(values[-1])
+            else:
+                push(interpreter.get_symbol_value(arg))
+        elif opcode == LOAD_CONST:
+            push(consts[arg])
+        elif opcode == STORE_VAR:
+            value = pop()
+            values = stacks[arg]
+            if values:
+                variable = values[-1]
+                if variable.shared:
+                    interpreter.member_version += 1
+                    if interpreter.lazy_copies:
+                        copy_pending(interpreter.lazy_copies)
+                variable.type = value.type
+                variable.value = value.value
+            else:
+                trail.append(arg)
+                values.append(TypedValue(value.type, value.value))
+        elif opcode == INCREMENT_VAR:
+            symbol, delta = names[arg]
+            values = stacks[symbol]
+            if values:
+                variable = values[-1]
+                if variable.type == 'int' and not variable.shared:
+                    variable.value += delta
+                    pc += FUSED_LENGTH
+        elif opcode == COMPARE_VAR:
+            symbol, operator_name, bound_symbol, bound = names[arg]
+            values = stacks[symbol]
+            if values and values[-1].type == 'int':
+                if bound_symbol is not None:
+                    bounds = stacks[bound_symbol]
+                    bound = bounds[-1].value if bounds and bounds[-1].type == 'int' else None
+                if bound is not None:
+                    if INT_COMPARISONS[operator_name](values[-1].value, bound):
+                        pc += FUSED_LENGTH
+                    else:
+                        pc = code[pc + FUSED_LENGTH - 1]
+        elif opcode <= OR and opcode >= ADD:
+            op2 = pop()
+            op1 = stack[-1]
+            if op1.type == 'int' and op2.type == 'int':
+                if opcode == ADD:
+                    stack[-1] = int_value(op1.value + op2.value)
+                elif opcode == SUB:
+                    stack[-1] = int_value(op1.value - op2.value)
+                elif opcode == LT:
+                    stack[-1] = TRUE if op1.value < op2.value else FALSE
+                else:
+                    stack[-1] = binary_operation(interpreter, opcode, op1, op2)
+            else:
+                stack[-1] = binary_operation(interpreter, opcode, op1, op2)
+        elif opcode == TEST_WHILE or opcode == TEST_IF:
+            value = pop()
+            if value.type == 'bool':
+                if not value.value:
+                    pc = arg
+            elif not test_condition(interpreter, value, 'if' if opcode == TEST_IF else 'while'):
+                pc = arg
+        elif opcode == JUMP:
+            pc = arg
+        elif opcode == LOAD_FUNCTION:
+            call_node = consts[arg]
+            name = call_node.name
+            values = stacks[call_node.symbol]
+            if values:
+                push(resolve_function(interpreter, functions, values[-1], call_node, name, None))
+            else:
+                # A builtin, which is hidden by any variable with the same name
+                match name:
+                    case 'print':
+                        pass
+                    case 'inputi' | 'inputs':
+                        interpreter.check_input_args(name, call_node.args)
+                    case _:
+                        interpreter.error(
+                            ErrorType.NAME_ERROR,
+                            f"Function {name} that takes {len(call_node.args)} parameters has not been defined",
+                        )
+                push(name)
+        elif opcode == LOAD_METHOD:
+            call_node = consts[arg]
+            symbol = call_node.symbol
+            method = interpreter.get_member_value(symbol, call_node.name, call_node)
+            push(resolve_function(interpreter, functions, method, call_node,
+                                  f"{call_node.objref}.{call_node.name}", stacks[symbol][-1]))
+        elif opcode == CALL:
+            if arg:
+                arg_values = stack[-arg:]
+                del stack[-arg:]
+            else:
+                arg_values = []
+            function = pop()
+            if type(function) is str:
+                match function:
+                    case 'print':
+                        interpreter.run_print(arg_values)
+                        push(NIL)
+                    case 'inputi':
+                        push(interpreter.run_inputi(arg_values))
+                    case 'inputs':
+                        push(interpreter.run_inputs(arg_values))
+                continue
+
+            callee, free_vars, method_this = function
+            arg_symbols = callee.arg_symbols
+            if free_vars or method_this is not None:
+                scope = set(arg_symbols).union(free_vars)
+                if method_this is not None:
+                    scope.add(THIS)
+            else:
+                scope = callee.arg_scope
+            if frames and code[pc] == RETURN_VALUE and scope.issuperset(trail[marks[frames[-1][2]]:]):
+                # A returned call replaces the function making it, as in
+                # Interpreter.can_replace_frame (the function's scope starts at the
+                # mark its frame saved): its scopes are closed and the callee runs
+                # in its frame, returning to its caller
+                base = frames[-1][2]
+                while len(marks) > base:
+                    interpreter.pop_scope()
+            elif len(frames) == max_call_depth:
+                interpreter.error(
+                    ErrorType.FAULT_ERROR,
+                    f"Calling {callee.name} would nest more than {max_call_depth} calls",
+                )
+            else:
+                frames.append((code_object, pc, len(marks)))
+            for symbol, value, by_ref in zip(arg_symbols, arg_values, callee.by_ref):
+                if not by_ref:
+                    value = interpreter.copy_value(value)
+                elif type(value) is Constant:
+                    value = TypedValue(value.type, value.value)
+                stacks[symbol].append(value)
+            for symbol, value in free_vars.items():
+                if symbol not in arg_symbols:
+                    stacks[symbol].append(value)
+            if method_this is not None:
+                stacks[THIS].append(method_this)
+            interpreter.push_scope(scope)
+
+            code_object = callee
+            code = callee.code
+            consts = callee.consts
+            names = callee.names
+            pc = 0
+        elif opcode == RETURN_VALUE or opcode == RETURN_NIL:
+            return_val = interpreter.copy_value(pop()) if opcode == RETURN_VALUE else NIL
+            if not frames:
+                return return_val
+            code_object, pc, base = frames.pop()
+            code = code_object.code
+            consts = code_object.consts
+            names = code_object.names
+            # A return inside an if or while leaves their scopes open too
+            while len(marks) > base:
+                interpreter.pop_scope()
+            push(return_val)
+        elif opcode == POP_TOP:
+            pop()
+        elif opcode == PUSH_SCOPE:
+            marks.append(len(trail))
+        elif opcode == POP_SCOPE:
+            interpreter.pop_scope()
+        elif opcode == LOAD_MEMBER:
+            # Each read has its own inline cache, keyed by its node
+            node = consts[arg]
+            push(interpreter.get_member_value(node.symbol, node.member, node))
+        elif opcode == STORE_MEMBER:
+            symbol, member_name = names[arg]
+            interpreter.do_member_assignment(symbol, member_name, pop())
+        elif opcode == NEG:
+            value = stack[-1]
+            if value.type != 'int':
+                incompatible(interpreter, 'neg', value)
+            stack[-1] = int_value(-value.value)
+        elif opcode == NOT:
+            value = stack[-1]
+            if value.type not in INT_OR_BOOL:
+                incompatible(interpreter, '!', value)
+            stack[-1] = FALSE if value.value else TRUE
+        elif opcode == LOAD_NIL:
+            push(NIL)
+        elif opcode == NEW_OBJECT:
+            push(TypedValue('object', Members(interpreter.empty_shape)))
+        elif opcode == MAKE_LAMBDA:
+            push(interpreter.evaluate_lambda_definition(consts[arg]))
+        else:
+            raise ValueError(f"Bad opcode {opcode} at {pc - 2} in {code_object.name}")
+
+
+def describe_argument(code_object, opcode, arg):
+    if opcode == LOAD_CONST:
+        const = code_object.consts[arg]
+        return f"{const.type} {const.value!r}"
+    if opcode in (LOAD_VAR, STORE_VAR):
+        return code_object.symbols[arg]
+    if opcode == LOAD_MEMBER:
+        return code_object.consts[arg].name
+    if opcode == STORE_MEMBER:
+        symbol, member_name = code_object.names[arg]
+        return f"{code_object.symbols[symbol]}.{member_name}"
+    if opcode in (LOAD_FUNCTION, LOAD_METHOD):
+        call_node = code_object.consts[arg]
+        name = call_node.name if opcode == LOAD_FUNCTION else f"{call_node.objref}.{call_node.name}"
+        return f"{name}/{len(call_node.args)}"
+    if opcode == MAKE_LAMBDA:
+        return f"lambda({', '.join(arg.name for arg in code_object.consts[arg].args)})"
+    if opcode in JUMPS:
+        return f"to {arg}"
+    if opcode == INCREMENT_VAR:
+        symbol, delta = code_object.names[arg]
+        return f"{code_object.symbols[symbol]} by {delta}"
+    if opcode == COMPARE_VAR:
+        symbol, operator_name, bound_symbol, bound = code_object.names[arg]
+        bound = code_object.symbols[bound_symbol] if bound_symbol is not None else bound
+        return f"{code_object.symbols[symbol]} {operator_name} {bound}"
+    return None
+
+
+# Lists the instructions of a CodeObject, one per line: offset, opcode, argument
+# and what the argument refers to
+def disassemble(code_object):
+    params = ", ".join(("ref " if by_ref else "") + code_object.symbols[symbol]
+                       for symbol, by_ref in zip(code_object.arg_symbols, code_object.by_ref))
+    lines = [f"{code_object.name}({params}):"]
+    code = code_object.code
+    for pc in range(0, len(code), 2):
+        opcode, arg = code[pc], code[pc + 1]
+        line = f"{pc:>6} {OPCODES[opcode]:<14}"
+        description = describe_argument(code_object, opcode, arg)
+        if description is not None:
+            line += f" {arg:>4} ({description})"
+        elif opcode == CALL:
+            line += f" {arg:>4}"
+        lines.append(line.rstrip())
+    return "\n".join(lines)
+
+
+def disassemble_program(program):
+    return "\n\n".join(disassemble(code_object) for code_object in compile_program_code(program).values())
+
@@ -0,0 +1,475 @@
+from __future__ import annotations
+from intbase import ErrorType
+from copyonwrite import copy_pending
+from dispatch import TailCall
+from interpreterv4 import (TypedValue, Constant, NIL, TRUE, FALSE, BINARY_OPERATORS, INT_COMPARISONS, OPERATIONS,
+                           compared_variable, increment_of, int_value, bool_value)
+from shapes import Members
+from symbols import THIS
+import operator
+
+# Closure-compiling engine for interpreterv4 (Interpreter(engine='closure')).
+# Each function and lambda body is compiled once per Program into nested Python
+# closures that take the Interpreter as their only argument: children are
+# compiled ahead of time and each operator gets its own handler, so running a
+# node doesn't dispatch on elem_type again. Statements return a TypedValue when
+# they return from the function and None otherwise, like Interpreter.run_statement.
+# All state lives in the Interpreter (stacks, trail and marks), and anything rare or
+# that reports an error is handed to the Interpreter's own methods, so both
+# engines behave the same.
+
+INT_OR_BOOL = ('int', 'bool')
+# Binary operations nested in their left operands more deeply than this, as in
+# 1 + 2 + 3 + ..., are compiled into one closure that applies them in a loop
+# (see Compiler.compile_operation_chain)
+MAX_NESTED_OPERATIONS = 32
+
+
+class CompiledFunction:
+    __slots__ = ('body', 'arg_symbols', 'by_ref', 'arity')
+
+    def __init__(self, body, definition):
+        self.body = body
+        self.arg_symbols = tuple(arg.symbol for arg in definition.args)
+        self.by_ref = tuple(arg.elem_type == 'refarg' for arg in definition.args)
+        self.arity = len(definition.args)
+
+
+def run_main(interpreter, program):
+    functions = program.compiled.get('closure')
+    if functions is None:
+        functions = program.compiled.setdefault('closure', Compiler().compile_program(program.ast))
+    functions[program.main_func_node].body(interpreter)
+
+
+def incompatible(interpreter, operator_name, *operands):
+    interpreter.error(
+        ErrorType.TYPE_ERROR,
+        f"Incompatible types {', '.join([op.type for op in operands])} for operation {operator_name}"
+    )
+
+
+def values_equal(op1, op2):
+    if op1.type != op2.type:
+        return False
+    if op1.type == 'object':
+        return op1.value is op2.value
+    return op1.value == op2.value
+
+
+class Compiler:
+    def __init__(self):
+        # Maps each function and lambda definition node to its CompiledFunction
+        self.functions = {}
+
+    def compile_program(self, ast):
+        for func_node in ast.functions:
+            self.compile_function(func_node)
+        return self.functions
+
+    def compile_function(self, definition):
+        self.functions[definition] = CompiledFunction(self.compile_block(definition.statements), definition)
+
+    def compile_block(self, statements):
+        compiled = [self.compile_statement(statement) for statement in statements]
+        compiled = tuple(statement for statement in compiled if statement is not None)
+        if len(compiled) == 1:
+            return compiled[0]
+
+        def run_block(interpreter):
+            for statement in compiled:
+                return_val = statement(interpreter)
+                if return_val is not None:
+                    return return_val
+            return None
+        return run_block
+
+    # Returns None for statements that do nothing: the tree walker ignores
+    # expression statements other than calls without evaluating them
+    def compile_statement(self, node):
+        match node.elem_type:
+            case '=':
+                return self.compile_assignment(node)
+            case 'fcall' | 'mcall':
+                call = self.compile_expression(node)
+
+                def run_call(interpreter):
+                    call(interpreter)
+                return run_call
+            case 'if':
+                return self.compile_if(node)
+            case 'while':
+                return self.compile_while(node)
+            case 'return':
+                if node.expression is None:
+                    return lambda interpreter: NIL
+                match node.expression.elem_type:
+                    case 'fcall':
+                        call = self.compile_func_call(node.expression, tail=True)
+                    case 'mcall':
+                        call = self.compile_method_call(node.expression, tail=True)
+                    case _:
+                        expression = self.compile_expression(node.expression)
+                        return lambda interpreter: interpreter.copy_value(expression(interpreter))
+
+                def return_call(interpreter):
+                    return_val = call(interpreter)
+                    if type(return_val) is TailCall:
+                        return return_val
+                    return interpreter.copy_value(return_val)
+                return return_call
+        return None
+
+    def compile_assignment(self, node):
+        expression = self.compile_expression(node.expression)
+        symbol, member_name = node.symbol, node.member
+        if member_name is not None:
+            def assign_member(interpreter):
+                interpreter.do_member_assignment(symbol, member_name, expression(interpreter))
+            return assign_member
+
+        def assign(interpreter):
+            value = expression(interpreter)
+            values = interpreter.stacks[symbol]
+            if values:
+                variable = values[-1]
+                if variable.shared:
+                    interpreter.member_version += 1
+                    if interpreter.lazy_copies:
+                        copy_pending(interpreter.lazy_copies)
+                variable.type = value.type
+                variable.value = value.value
+            else:
+                interpreter.trail.append(symbol)
+                values.append(TypedValue(value.type, value.value))
+
+        delta = increment_of(node)
+        if delta is None:
+            return assign
+
+        # x = x + d adds to an unshared int in place
+        def increment(interpreter):
+            values = interpreter.stacks[symbol]
+            if values:
+                variable = values[-1]
+                if variable.type == 'int' and not variable.shared:
+                    variable.value += delta
+                    return
+            assign(interpreter)
+        return increment
+
+    def compile_condition(self, node, statement_name):
+        comparison = compared_variable(node.condition)
+        if comparison is not None:
+            return self.compile_variable_comparison(*comparison)
+        condition = self.compile_expression(node.condition)
+
+        def evaluate_condition(interpreter):
+            value = condition(interpreter)
+            if value.type == 'bool':
+                return value.value
+            if value.type == 'int':
+                return value.value != 0
+            interpreter.error(
+                ErrorType.TYPE_ERROR,
+                f"Expected bool inside '{statement_name}' condition but got {value}"
+            )
+        return evaluate_condition
+
+    # A condition comparing a variable with an expression, which compares ints
+    # without making a bool for the result
+    def compile_variable_comparison(self, operator_name, symbol, op2_node):
+        compare = INT_COMPARISONS[operator_name]
+        right = self.compile_expression(op2_node)
+
+        def compare_variable(interpreter):
+            values = interpreter.stacks[symbol]
+            op1 = values[-1] if values and values[-1].type == 'int' else interpreter.get_symbol_value(symbol)
+            op2 = right(interpreter)
+            if op1.type == 'int' and op2.type == 'int':
+                return compare(op1.value, op2.value)
+            operation = OPERATIONS.get((operator_name, op1.type, op2.type))
+            if operation is None:
+                incompatible(interpreter, operator_name, op1, op2)
+            return operation(op1, op2).value
+        return compare_variable
+
+    def compile_if(self, node):
+        condition = self.compile_condition(node, 'if')
+        statements = self.compile_block(node.statements)
+        else_statements = None if node.else_statements is None else self.compile_block(node.else_statements)
+
+        def run_if(interpreter):
+            block = statements if condition(interpreter) else else_statements
+            if block is None:
+                return None
+            interpreter.push_scope()
+            return_val = block(interpreter)
+            interpreter.pop_scope()
+            return return_val
+        return run_if
+
+    def compile_while(self, node):
+        condition = self.compile_condition(node, 'while')
+        statements = self.compile_block(node.statements)
+
+        def run_while(interpreter):
+            interpreter.push_scope()
+            return_val = None
+            while condition(interpreter):
+                return_val = statements(interpreter)
+                if return_val is not None:
+                    break
+            interpreter.pop_scope()
+            return return_val
+        return run_while
+
+    def compile_expression(self, node):
+        match node.elem_type:
+            case 'fcall':
+                return self.compile_func_call(node)
+            case 'mcall':
+                return self.compile_method_call(node)
+            case 'var':
+                return self.compile_variable(node)
+            case 'lambda':
+                self.compile_function(node)
+                return lambda interpreter: interpreter.evaluate_lambda_definition(node)
+            case 'nil':
+                return lambda interpreter: NIL
+            case '@':
+                return lambda interpreter: TypedValue('object', Members(interpreter.empty_shape))
+            case 'int' | 'string' | 'bool':
+                constant = Constant(node.elem_type, node.val)
+                return lambda interpreter: constant
+            case 'neg' | '!':
+                return self.compile_unary_operation(node)
+        return self.compile_binary_operation(node)
+
+    def compile_variable(self, node):
+        symbol, member_name = node.symbol, node.member
+        if member_name is not None:
+            return lambda interpreter: interpreter.get_member_value(symbol, member_name, node)
+
+        def get_variable(interpreter):
+            values = interpreter.stacks[symbol]
+            if values and values[-1].type != 'overloaded_func':
+                return values[-1]
+            return interpreter.get_symbol_value(symbol)
+        return get_variable
+
+    def compile_unary_operation(self, node):
+        operand = self.compile_expression(node.op1)
+        if node.elem_type == 'neg':
+            def negate(interpreter):
+                value = operand(interpreter)
+                if value.type != 'int':
+                    incompatible(interpreter, 'neg', value)
+                return int_value(-value.value)
+            return negate
+
+        def logical_not(interpreter):
+            value = operand(interpreter)
+            if value.type not in INT_OR_BOOL:
+                incompatible(interpreter, '!', value)
+            return FALSE if value.value else TRUE
+        return logical_not
+
+    def compile_operation_chain(self, node):
+        steps = []
+        while node.elem_type in BINARY_OPERATORS:
+            steps.append((node.elem_type, self.compile_expression(node.op2)))
+            node = node.op1
+        steps.reverse()
+        first = self.compile_expression(node)
+
+        def operation_chain(interpreter):
+            op1 = first(interpreter)
+            for operator_name, right in steps:
+                op2 = right(interpreter)
+                operation = OPERATIONS.get((operator_name, op1.type, op2.type))
+                if operation is None:
+                    incompatible(interpreter, operator_name, op1, op2)
+                op1 = operation(op1, op2)
+            return op1
+        return operation_chain
+
+    def compile_binary_operation(self, node):
+        depth = 0
+        op1_node = node.op1
+        while op1_node.elem_type in BINARY_OPERATORS:
+            depth += 1
+            if depth > MAX_NESTED_OPERATIONS:
+                return self.compile_operation_chain(node)
+            op1_node = op1_node.op1
+        operator_name = node.elem_type
+        left = self.compile_expression(node.op1)
+        right = self.compile_expression(node.op2)
+        match operator_name:
+            case '+':
+                def add(interpreter):
+                    op1 = left(interpreter)
+                    op2 = right(interpreter)
+                    if op1.type == 'int' and op2.type == 'int':
+                        return int_value(op1.value + op2.value)
+                    if op1.type in INT_OR_BOOL and op2.type in INT_OR_BOOL:
+                        return int_value(int(op1.value) + int(op2.value))
+                    if op1.type == 'string' and op2.type == 'string':
+                        return TypedValue('string', op1.value + op2.value)
+                    incompatible(interpreter, '+', op1, op2)
+                return add
+            case '-' | '*' | '/':
+                # Integer arithmetic, with bools coerced to 0 or 1
+                apply = {'-': operator.sub, '*': operator.mul, '/': operator.floordiv}[operator_name]
+
+                def arithmetic(interpreter):
+                    op1 = left(interpreter)
+                    op2 = right(interpreter)
+                    if op1.type == 'int' and op2.type == 'int':
+                        return int_value(apply(op1.value, op2.value))
+                    if op1.type in INT_OR_BOOL and op2.type in INT_OR_BOOL:
+                        return int_value(apply(int(op1.value), int(op2.value)))
+                    incompatible(interpreter, operator_name, op1, op2)
+                return arithmetic
+            case '<' | '<=' | '>' | '>=':
+                apply = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}[operator_name]
+
+                def compare(interpreter):
+                    op1 = left(interpreter)
+                    op2 = right(interpreter)
+                    if op1.type != 'int' or op2.type != 'int':
+                        incompatible(interpreter, operator_name, op1, op2)
+                    return bool_value(apply(op1.value, op2.value))
+                return compare
+            case '==':
+                def equal(interpreter):
+                    op1 = left(interpreter)
+                    op2 = right(interpreter)
+                    # ints compare as ints, and are coerced when compared with a bool
+                    if op1.type in INT_OR_BOOL and op2.type in INT_OR_BOOL and op1.type != op2.type:
+                        return bool_value(bool(op1.value) == bool(op2.value))
+                    return bool_value(values_equal(op1, op2))
+                return equal
+            case '!=':
+                return lambda interpreter: bool_value(not values_equal(left(interpreter), right(interpreter)))
+            case '&&' | '||':
+                # Both operands are always evaluated; ints are coerced to bools
+                is_and = operator_name == '&&'
+
+                def logical(interpreter):
+                    op1 = left(interpreter)
+                    op2 = right(interpreter)
+                    if op1.type not in INT_OR_BOOL or op2.type not in INT_OR_BOOL:
+                        incompatible(interpreter, operator_name, op1, op2)
+                    if is_and:
+                        return bool_value(op1.value and op2.value)
+                    return bool_value(op1.value or op2.value)
+                return logical
+
+    def compile_func_call(self, node, tail=False):
+        name, symbol = node.name, node.symbol
+        args = tuple(self.compile_expression(arg) for arg in node.args)
+        call_function = self.compile_call(args, name, tail)
+        match name:
+            case 'print':
+                def builtin(interpreter):
+                    interpreter.run_print([arg(interpreter) for arg in args])
+                    return NIL
+            case 'inputi' | 'inputs':
+                run_input = 'run_inputi' if name == 'inputi' else 'run_inputs'
+
+                def builtin(interpreter):
+                    interpreter.check_input_args(name, args)
+                    return getattr(interpreter, run_input)([arg(interpreter) for arg in args])
+            case _:
+                def builtin(interpreter):
+                    interpreter.error(
+                        ErrorType.NAME_ERROR,
+                        f"Function {name} that takes {len(args)} parameters has not been defined",
+                    )
+
+        # A variable with the same name as a builtin hides it
+        def func_call(interpreter):
+            values = interpreter.stacks[symbol]
+            if values:
+                return call_function(interpreter, values[-1], None)
+            return builtin(interpreter)
+        return func_call
+
+    def compile_method_call(self, node, tail=False):
+        symbol = node.symbol
+        method_name = node.name
+        args = tuple(self.compile_expression(arg) for arg in node.args)
+        call_function = self.compile_call(args, f"{node.objref}.{method_name}", tail)
+
+        def method_call(interpreter):
+            values = interpreter.stacks[symbol]
+            method = interpreter.get_member_value(symbol, method_name, node)
+            return call_function(interpreter, method, values[-1])
+        return method_call
+
+    # Returns a function that calls a function value with the compiled arguments,
+    # binding them like Interpreter.run_function does. A tail call returns a
+    # TailCall instead when it can replace the function being run.
+    def compile_call(self, args, debug_func_name, tail=False):
+        functions = self.functions
+        num_args = len(args)
+
+        def call_function(interpreter, func_object, method_this):
+            if func_object.type == 'func':
+                function = functions[func_object.value.definition]
+                free_vars = func_object.value.free_vars
+                if function.arity != num_args:
+                    function = None
+            elif func_object.type == 'overloaded_func' and num_args in func_object.value:
+                function = functions[func_object.value[num_args]]
+                free_vars = {}
+            else:
+                function = None
+            if function is None:
+                # Reports why the function can't be called
+                interpreter.run_function(func_object, args, debug_func_name, method_this)
+
+            if tail:
+                scope = set(function.arg_symbols) | free_vars.keys()
+                if method_this is not None:
+                    scope.add(THIS)
+                if interpreter.can_replace_frame(scope):
+                    return TailCall(function, [arg(interpreter) for arg in args], free_vars, method_this)
+
+            arg_values = [arg(interpreter) for arg in args]
+            stacks = interpreter.stacks
+            frame_start = interpreter.frame_start
+            while True:
+                arg_symbols = function.arg_symbols
+                for symbol, value, by_ref in zip(arg_symbols, arg_values, function.by_ref):
+                    if not by_ref:
+                        value = interpreter.copy_value(value)
+                    elif type(value) is Constant:
+                        value = TypedValue(value.type, value.value)
+                    stacks[symbol].append(value)
+
+                scope = set(arg_symbols)
+                for symbol, value in free_vars.items():
+                    if symbol not in arg_symbols:
+                        stacks[symbol].append(value)
+                        scope.add(symbol)
+                if method_this is not None:
+                    stacks[THIS].append(method_this)
+                    scope.add(THIS)
+                interpreter.frame_start = len(interpreter.trail)
+                interpreter.push_scope(scope)
+
+                return_val = function.body(interpreter)
+
+                interpreter.pop_scope()
+                if type(return_val) is not TailCall:
+                    break
+                function, arg_values = return_val.function, return_val.args
+                free_vars, method_this = return_val.free_vars, return_val.this
+            interpreter.frame_start = frame_start
+
+            if return_val is None:
+                return NIL
+            return return_val
+        return call_function
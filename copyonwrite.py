@@ -0,0 +1,179 @@
+import copy, weakref
+from shapes import Members
+
+# Copy-on-write for the cells (TypedValues) that objects and closures are made of:
+# an object's Members (see shapes.py), and the dict of variables a closure
+# captured. Passing them by value or returning them is meant to deep copy them,
+# but most copies are dropped without being used, so copy_members() and
+# copy_cells() return an empty LazyMembers or LazyCells instead, which copies its
+# source the first time anything looks inside it and from then on is a plain
+# Members or Cells. Until then, passing or returning the value is O(1).
+#
+# A lazy copy is only right while everything reachable from its source is
+# unchanged. The interpreters keep the lazy copies that haven't been made yet in a
+# dict, `pending`, and call copy_pending() before a write could change such a
+# graph: before assigning an object's member, and before assigning to a cell
+# marked `shared`. Every cell in an object or closure is marked, which is done
+# where it's put there.
+
+
+# Adds lazy to pending until it's made or no longer used
+def track(lazy, pending):
+    key = id(lazy)
+
+    def forget(ref):
+        if pending.get(key) is ref:
+            del pending[key]
+    pending[key] = weakref.ref(lazy, forget)
+
+
+class Cells(dict):
+    __slots__ = ('source', 'cell', 'pending', '__weakref__')
+
+    def __deepcopy__(self, memo):
+        copied = {}
+        memo[id(self)] = copied
+        for key, value in self.items():
+            copied[key] = copy.deepcopy(value, memo)
+        return copied
+
+
+class LazyCells(Cells):
+    __slots__ = ()
+
+    def __init__(self, source, cell, pending):
+        self.source = source
+        # A deep copy of the cell holding source maps that cell to its copy, which
+        # the copy of source holds too if source can reach the cell. If so, cell is
+        # (the cell, a weak reference to its copy), so copying later keeps that up.
+        self.cell = cell
+        self.pending = pending
+        track(self, pending)
+
+    def materialize(self):
+        source, cell, pending = self.source, self.cell, self.pending
+        self.__class__ = Cells
+        self.source = self.cell = self.pending = None
+        pending.pop(id(self), None)
+        memo = {id(source): self}
+        if cell is not None and (copied_cell := cell[1]()) is not None:
+            memo[id(cell[0])] = copied_cell
+        for key, value in source.items():
+            self[key] = copy.deepcopy(value, memo)
+
+    # A copy of a copy that hasn't been made yet is another lazy copy of the same
+    # source
+    def __deepcopy__(self, memo):
+        copied = LazyCells.__new__(LazyCells)
+        memo[id(self)] = copied
+        cell = None
+        if self.cell is not None and (copied_cell := self.cell[1]()) is not None:
+            cell = (self.cell[0], weakref.ref(copy.deepcopy(copied_cell, memo)))
+        copied.__init__(self.source, cell, self.pending)
+        return copied
+
+    # After materialize() self is a Cells, so these call dict's own methods
+    def __contains__(self, key):
+        self.materialize()
+        return key in self
+
+    def __getitem__(self, key):
+        self.materialize()
+        return self[key]
+
+    def __setitem__(self, key, value):
+        self.materialize()
+        self[key] = value
+
+    def __iter__(self):
+        self.materialize()
+        return iter(self)
+
+    def __len__(self):
+        self.materialize()
+        return len(self)
+
+    def __repr__(self):
+        self.materialize()
+        return repr(self)
+
+    def get(self, key, default=None):
+        self.materialize()
+        return self.get(key, default)
+
+    def items(self):
+        self.materialize()
+        return self.items()
+
+    def keys(self):
+        self.materialize()
+        return self.keys()
+
+    def values(self):
+        self.materialize()
+        return self.values()
+
+
+# shape and cells aren't set until the copy is made, so reading either makes it.
+# lazy is (source, cell, pending), as for LazyCells.
+class LazyMembers(Members):
+    __slots__ = ()
+
+    def __init__(self, source, cell, pending):
+        self.lazy = (source, cell, pending)
+        track(self, pending)
+
+    def __getattr__(self, name):
+        self.materialize()
+        return getattr(self, name)
+
+    def materialize(self):
+        source, cell, pending = self.lazy
+        self.__class__ = Members
+        self.lazy = None
+        pending.pop(id(self), None)
+        memo = {id(source): self}
+        if cell is not None and (copied_cell := cell[1]()) is not None:
+            memo[id(cell[0])] = copied_cell
+        self.shape = source.shape
+        self.cells = cells = []
+        for value in source.cells:
+            cells.append(copy.deepcopy(value, memo))
+
+    def __deepcopy__(self, memo):
+        source, cell, pending = self.lazy
+        copied = LazyMembers.__new__(LazyMembers)
+        memo[id(self)] = copied
+        if cell is not None and (copied_cell := cell[1]()) is not None:
+            cell = (cell[0], weakref.ref(copy.deepcopy(copied_cell, memo)))
+        else:
+            cell = None
+        copied.__init__(source, cell, pending)
+        return copied
+
+
+# The same as the members of copy.deepcopy(cell), where members are those of the
+# object in cell and copied_cell is the cell's copy
+def copy_members(members, cell, copied_cell, pending):
+    if type(members) is LazyMembers:
+        return copy.deepcopy(members, {id(cell): copied_cell})
+    if not members.cells:
+        return Members(members.shape)
+    return LazyMembers(members, (cell, weakref.ref(copied_cell)) if cell.shared else None, pending)
+
+
+# The same as the cells of copy.deepcopy(cell), where cells is the dict of the
+# closure in cell and copied_cell is the cell's copy
+def copy_cells(cells, cell, copied_cell, pending):
+    if type(cells) is LazyCells:
+        return copy.deepcopy(cells, {id(cell): copied_cell})
+    if not cells:
+        return {}
+    return LazyCells(cells, (cell, weakref.ref(copied_cell)) if cell.shared else None, pending)
+
+
+def copy_pending(pending):
+    while pending:
+        lazy = pending.popitem()[1]()
+        if lazy is not None:
+            lazy.materialize()
@@ -0,0 +1,61 @@
+MAX_DIAGNOSTICS = 100
+
+ILLEGAL_CHARACTER = "illegal character"
+SYNTAX_ERROR = "syntax error"
+
+
+class Diagnostic:
+    __slots__ = ("kind", "line", "message")
+
+    def __init__(self, kind, line, message):
+        self.kind = kind
+        self.line = line
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+    def to_dict(self):
+        return {"kind": self.kind, "line": self.line, "message": self.message}
+
+
+# The errors reported while lexing and parsing one program. Only the first
+# `limit` are kept, so a flood of bad input costs memory for at most that many;
+# `count` is the total number reported.
+class Diagnostics:
+    __slots__ = ("items", "count", "limit")
+
+    def __init__(self, limit=MAX_DIAGNOSTICS):
+        self.items = []
+        self.count = 0
+        self.limit = limit
+
+    def __len__(self):
+        return self.count
+
+    def __str__(self):
+        lines = [str(diagnostic) for diagnostic in self.items]
+        if self.count > len(self.items):
+            lines.append(f"({self.count - len(self.items)} more errors not shown)")
+        return "\n".join(lines)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def illegal_characters(self, chars, line):
+        for char in chars[:self.limit - len(self.items)]:
+            self.items.append(Diagnostic(ILLEGAL_CHARACTER, line, f"Illegal character {char}"))
+        self.count += len(chars)
+
+    # value is None for an error at the end of the input
+    def syntax_error(self, value, line):
+        if len(self.items) < self.limit:
+            message = "Syntax error at EOF" if value is None else f"Syntax error at '{value}'"
+            self.items.append(Diagnostic(SYNTAX_ERROR, line, message))
+        self.count += 1
+
+    def first_syntax_error(self):
+        return next((diagnostic for diagnostic in self.items if diagnostic.kind == SYNTAX_ERROR), None)
+
+    def to_list(self):
+        return [diagnostic.to_dict() for diagnostic in self.items]
@@ -0,0 +1,50 @@
+from intbase import InterpreterBase
+
+# Table-driven dispatch on the kind (elem_type) of AST nodes, shared by the
+# interpreters. An interpreter class maps each kind of statement or expression it
+# runs to the name of the method that runs it, and handler_table() binds those
+# methods once per interpreter, so running a node costs one dict lookup instead
+# of a chain of match cases. Every kind the parser can produce has an entry:
+# the ones the class doesn't list get `default`.
+
+OPERATOR_KINDS = (
+    '+', '-', '*', '/', '==', '!=', '<', '<=', '>', '>=', '&&', '||',
+    InterpreterBase.NEG_DEF, InterpreterBase.NOT_DEF,
+)
+NODE_KINDS = OPERATOR_KINDS + (
+    '=', InterpreterBase.IF_DEF, InterpreterBase.WHILE_DEF, InterpreterBase.RETURN_DEF,
+    InterpreterBase.FCALL_DEF, InterpreterBase.MCALL_DEF, InterpreterBase.VAR_DEF,
+    InterpreterBase.LAMBDA_DEF, InterpreterBase.NIL_DEF, InterpreterBase.OBJ_DEF,
+    InterpreterBase.INT_DEF, InterpreterBase.STRING_DEF, InterpreterBase.BOOL_DEF,
+)
+
+# What a return statement gives run_statements when its expression is of a kind
+# the interpreter ignores, so has no value: it ends the innermost block only, and
+# the if or while around it carries on.
+LEAVE_BLOCK = object()
+
+
+# What a return statement gives run_statements when the call it returns can take
+# the place of the function making it: the callee, its evaluated arguments, the
+# variables it captured and `this`. The function that called the one returning it
+# makes the call instead, so a loop written as tail recursion runs in constant
+# stack space.
+class TailCall:
+    __slots__ = ('function', 'args', 'free_vars', 'this')
+
+    def __init__(self, function, args, free_vars=None, this=None):
+        self.function = function
+        self.args = args
+        self.free_vars = free_vars
+        self.this = this
+
+
+def ignore(node):
+    return None
+
+
+def handler_table(interpreter, method_names, default=ignore):
+    table = dict.fromkeys(NODE_KINDS, default)
+    for kind, method_name in method_names.items():
+        table[kind] = getattr(interpreter, method_name)
+    return table
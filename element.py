@@ -1,14 +1,28 @@
+from diagnostics import Diagnostics
+from intbase import InterpreterBase
+import copy
+
+
+# Base class for AST nodes. Each kind of node keeps its fields in __slots__ and is
+# read through attributes (node.name); `dict` and `get` give the original
+# dictionary view of the same fields.
 class Element:
-    def __init__(self, elem_type, **kwargs):
-        self.elem_type = elem_type
-        self.dict = {}
-        for key, value in kwargs.items():
-            self.dict[key] = value
+    __slots__ = ("elem_type",)
+    fields = ()
+
+    @property
+    def dict(self):
+        return {field: getattr(self, field) for field in self.fields}
 
     def get(self, key):
-        if key not in self.dict:
+        if key not in self.fields:
             return None
-        return self.dict[key]
+        return getattr(self, key)
+
+    # Nodes are never modified once parsed, so a deep copy of a value holding
+    # one (an overloaded function) can share it
+    def __deepcopy__(self, memo):
+        return self
 
     def __str__(self):
         s = f"{self.elem_type}: "
@@ -27,3 +41,207 @@ class Element:
                 return "[" + s[0:-2] + "]"
             return "[" + s + "]"
         return str(v)
+
+
+# Walks the tree rooted at node in preorder, without recursion
+def walk(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        children = []
+        for field in node.fields:
+            value = getattr(node, field)
+            if isinstance(value, Element):
+                children.append(value)
+            elif isinstance(value, list):
+                children.extend(value)
+        stack.extend(reversed(children))
+
+
+# Copies the tree rooted at node, without recursion (nodes deep copy as
+# themselves, so copy.deepcopy would share them). Each node is copied after its
+# children, which reversed preorder guarantees.
+def copy_tree(node):
+    copies = {}
+    for original in reversed(list(walk(node))):
+        duplicate = copy.copy(original)
+        for field in original.fields:
+            value = getattr(original, field)
+            if isinstance(value, Element):
+                setattr(duplicate, field, copies[id(value)])
+            elif isinstance(value, list):
+                setattr(duplicate, field, [copies[id(child)] for child in value])
+        copies[id(original)] = duplicate
+    return copies[id(node)]
+
+
+# Nodes that name a variable or function also have a `symbol` slot (and
+# variables and assignments a `member` slot) that aren't fields: they hold the
+# name's interned id, filled in by symbols.intern_symbols. So is a lambda's
+# `free_symbols`, the ids of the variables it captures (None for all).
+
+# diagnostics holds the errors the lexer and parser reported (and recovered from)
+# while building this program, symbols the names interned in it (indexed by id)
+# and members whether "var.member" names were split when they were interned; none
+# is one of the node's fields
+class ProgramDef(Element):
+    fields = ("functions",)
+    __slots__ = ("functions", "diagnostics", "symbols", "members")
+
+    def __init__(self, functions):
+        self.elem_type = InterpreterBase.PROGRAM_DEF
+        self.functions = functions
+        self.diagnostics = Diagnostics()
+        self.symbols = None
+        self.members = None
+
+
+class FuncDef(Element):
+    fields = ("name", "args", "statements")
+    __slots__ = fields + ("symbol",)
+
+    def __init__(self, name, args, statements):
+        self.elem_type = InterpreterBase.FUNC_DEF
+        self.name = name
+        self.symbol = None
+        self.args = args
+        self.statements = statements
+
+
+class LambdaDef(Element):
+    fields = ("args", "statements")
+    __slots__ = fields + ("free_symbols",)
+
+    def __init__(self, args, statements):
+        self.elem_type = InterpreterBase.LAMBDA_DEF
+        self.args = args
+        self.statements = statements
+        self.free_symbols = None
+
+
+# elem_type is InterpreterBase.ARG_DEF or InterpreterBase.REFARG_DEF
+class ArgDef(Element):
+    fields = ("name",)
+    __slots__ = fields + ("symbol",)
+
+    def __init__(self, elem_type, name):
+        self.elem_type = elem_type
+        self.name = name
+        self.symbol = None
+
+
+# name is either "var" or "var.member"
+class Assignment(Element):
+    fields = ("name", "expression")
+    __slots__ = fields + ("symbol", "member")
+
+    def __init__(self, name, expression):
+        self.elem_type = "="
+        self.name = name
+        self.symbol = self.member = None
+        self.expression = expression
+
+
+class IfStatement(Element):
+    __slots__ = fields = ("condition", "statements", "else_statements")
+
+    def __init__(self, condition, statements, else_statements):
+        self.elem_type = InterpreterBase.IF_DEF
+        self.condition = condition
+        self.statements = statements
+        self.else_statements = else_statements
+
+
+class WhileStatement(Element):
+    __slots__ = fields = ("condition", "statements")
+
+    def __init__(self, condition, statements):
+        self.elem_type = InterpreterBase.WHILE_DEF
+        self.condition = condition
+        self.statements = statements
+
+
+class ReturnStatement(Element):
+    __slots__ = fields = ("expression",)
+
+    def __init__(self, expression):
+        self.elem_type = InterpreterBase.RETURN_DEF
+        self.expression = expression
+
+
+# elem_type is the operator, e.g. "+" or "&&"
+class BinaryOperation(Element):
+    __slots__ = fields = ("op1", "op2")
+
+    def __init__(self, operator, op1, op2):
+        self.elem_type = operator
+        self.op1 = op1
+        self.op2 = op2
+
+
+# elem_type is InterpreterBase.NEG_DEF or InterpreterBase.NOT_DEF
+class UnaryOperation(Element):
+    __slots__ = fields = ("op1",)
+
+    def __init__(self, operator, op1):
+        self.elem_type = operator
+        self.op1 = op1
+
+
+# elem_type is InterpreterBase.INT_DEF, InterpreterBase.STRING_DEF or InterpreterBase.BOOL_DEF
+class Literal(Element):
+    __slots__ = fields = ("val",)
+
+    def __init__(self, elem_type, val):
+        self.elem_type = elem_type
+        self.val = val
+
+
+class NilLiteral(Element):
+    __slots__ = ()
+
+    def __init__(self):
+        self.elem_type = InterpreterBase.NIL_DEF
+
+
+class ObjectLiteral(Element):
+    __slots__ = ()
+
+    def __init__(self):
+        self.elem_type = InterpreterBase.OBJ_DEF
+
+
+# name is either "var" or "var.member"
+class Variable(Element):
+    fields = ("name",)
+    __slots__ = fields + ("symbol", "member")
+
+    def __init__(self, name):
+        self.elem_type = InterpreterBase.VAR_DEF
+        self.name = name
+        self.symbol = self.member = None
+
+
+class FuncCall(Element):
+    fields = ("name", "args")
+    __slots__ = fields + ("symbol",)
+
+    def __init__(self, name, args):
+        self.elem_type = InterpreterBase.FCALL_DEF
+        self.name = name
+        self.symbol = None
+        self.args = args
+
+
+# symbol is the id of objref
+class MethodCall(Element):
+    fields = ("objref", "name", "args")
+    __slots__ = fields + ("symbol",)
+
+    def __init__(self, objref, name, args):
+        self.elem_type = InterpreterBase.MCALL_DEF
+        self.objref = objref
+        self.symbol = None
+        self.name = name
+        self.args = args
@@ -0,0 +1,10 @@
+import importlib
+
+VERSIONS = (1, 2, 3, 4)
+
+# Interpreter modules are imported on first use, so starting up only pays for
+# the versions that actually get run
+def load_interpreter(version):
+    if version not in VERSIONS:
+        raise ValueError(f"Invalid interpreter version {version}. Must be from 1-4")
+    return importlib.import_module(f"interpreterv{version}")
@@ -6,24 +6,42 @@ class TypedValue:
         self.type = type
         self.value = value
 
+class Program:
+    # A parsed program that can be run many times, from any thread. Nothing here is
+    # modified after construction; all per-run state lives in the Interpreter.
+    __slots__ = ('ast', 'main_func_node')
+
+    def __init__(self, ast):
+        self.ast = ast
+        self.main_func_node = next((func for func in ast.functions if func.name == 'main'), None)
+
+    def run(self, console_output=True, inp=None, trace_output=False):
+        interpreter = Interpreter(console_output, inp, trace_output)
+        interpreter.run_program(self)
+        return interpreter
+
+def compile_program(program: str) -> Program:
+    return Program(parse_program(program))
+
 class Interpreter(InterpreterBase):
     def __init__(self, console_output=True, inp=None, trace_output=False):
         super().__init__(console_output, inp)
 
     def run(self, program):
-        ast = parse_program(program)
+        self.run_program(compile_program(program))
+
+    def run_program(self, program: Program):
         self.variable_name_to_value: dict[str, TypedValue] = {}
 
-        main_func_node = next((func for func in ast.dict['functions'] if func.dict['name'] == 'main'), None)
-        if main_func_node is None:
+        if program.main_func_node is None:
             super().error(
                 ErrorType.NAME_ERROR,
                 "No main() function was found",
             )
-        self.run_func(main_func_node)
+        self.run_func(program.main_func_node)
 
     def run_func(self, func_node):
-        for statement_node in func_node.dict['statements']:
+        for statement_node in func_node.statements:
             self.run_statement(statement_node)
 
     def run_statement(self, statement_node):
@@ -34,13 +52,13 @@ class Interpreter(InterpreterBase):
                 self.do_func_call(statement_node)
 
     def do_assignment(self, statement_node):
-        target_var_name = statement_node.dict['name']
-        expression_value = self.evaluate_expression(statement_node.dict['expression'])
+        target_var_name = statement_node.name
+        expression_value = self.evaluate_expression(statement_node.expression)
         self.variable_name_to_value[target_var_name] = expression_value
     
     def do_func_call(self, func_node):
-        args = list(map(self.evaluate_expression, func_node.dict['args']))
-        match func_node.dict['name']:
+        args = list(map(self.evaluate_expression, func_node.args))
+        match func_node.name:
             case 'print':
                 self.run_print(args)
             case 'inputi':
@@ -60,10 +78,10 @@ class Interpreter(InterpreterBase):
             case 'var':
                 return self.get_variable_value(expression_node)
             case 'int' | 'string':
-                return TypedValue(expression_node.elem_type, expression_node.dict['val'])
+                return TypedValue(expression_node.elem_type, expression_node.val)
 
     def get_variable_value(self, variable_node):
-        var_name = variable_node.dict['name']
+        var_name = variable_node.name
         if not var_name in self.variable_name_to_value:
             super().error(
                 ErrorType.NAME_ERROR,
@@ -71,19 +89,27 @@ class Interpreter(InterpreterBase):
             )
         return self.variable_name_to_value[var_name]
 
+    # Operations nested in the left operand, as in 1 + 2 + 3 + ..., are applied in a
+    # loop rather than by recursing once per operation
     def evaluate_binary_operator(self, expression_node) -> TypedValue:
-        op1 = self.evaluate_expression(expression_node.dict['op1'])
-        op2 = self.evaluate_expression(expression_node.dict['op2'])
-        if op1.type != 'int' or op2.type != 'int':
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible types {op1.type} and {op2.type} for arithmetic operation",
-            )
-        match expression_node.elem_type:
-            case '+':
-                return TypedValue('int', op1.value + op2.value)
-            case '-':
-                return TypedValue('int', op1.value - op2.value)
+        chain = []
+        while expression_node.elem_type in ('+', '-'):
+            chain.append(expression_node)
+            expression_node = expression_node.op1
+        op1 = self.evaluate_expression(expression_node)
+        for node in reversed(chain):
+            op2 = self.evaluate_expression(node.op2)
+            if op1.type != 'int' or op2.type != 'int':
+                super().error(
+                    ErrorType.TYPE_ERROR,
+                    f"Incompatible types {op1.type} and {op2.type} for arithmetic operation",
+                )
+            match node.elem_type:
+                case '+':
+                    op1 = TypedValue('int', op1.value + op2.value)
+                case '-':
+                    op1 = TypedValue('int', op1.value - op2.value)
+        return op1
     
     def run_print(self, args):
         string_to_output = "".join([str(x.value) for x in args])
@@ -1,6 +1,10 @@
 from intbase import InterpreterBase, ErrorType
 from brewparse import parse_program
-import copy, sys
+from dispatch import LEAVE_BLOCK, TailCall, handler_table
+from element import copy_tree
+from symbols import intern_symbols
+from types import MappingProxyType
+import sys
 
 BINARY_OPERATORS = set(['+', '-', '*', '/', '==', '<', '<=', '>', '>=', '!=', '&&', '||'])
 UNARY_OPERATORS = set(['neg', '!'])
@@ -22,7 +26,11 @@ VALID_OPERAND_TYPES = {
     '!': [['bool']],
 }
 
+# Never modified once made (assigning to a variable replaces its value), so values
+# are passed to and returned from functions without copying them
 class TypedValue:
+    __slots__ = ('type', 'value')
+
     def __init__(self, type: str, value: int | str | bool | None):
         self.type = type
         self.value = value
@@ -30,77 +38,159 @@ class TypedValue:
     def __repr__(self):
         return f"({self.type} {self.value})"
 
+# For the same reason, the values operators produce most often are made once
+NIL = TypedValue('nil', None)
+TRUE = TypedValue('bool', True)
+FALSE = TypedValue('bool', False)
+SMALL_INTS = tuple(TypedValue('int', n) for n in range(1024))
+
+def int_value(n: int) -> TypedValue:
+    return SMALL_INTS[n] if 0 <= n < 1024 else TypedValue('int', n)
+
+def bool_value(b: bool) -> TypedValue:
+    return TRUE if b else FALSE
+
+class Program:
+    # A parsed program that can be run many times, from any thread. Nothing here is
+    # modified after construction; all per-run state lives in the Interpreter.
+    __slots__ = ('ast', 'functions', 'main_func_node')
+
+    def __init__(self, ast):
+        # There are no objects yet, so "a.b" is just the name of a variable. An AST
+        # interned for version 4, which other programs may share, is interned again
+        # as a copy, never in place.
+        if ast.members is not False:
+            ast = intern_symbols(copy_tree(ast), members=False)
+        self.ast = ast
+        functions = {} # Maps (function name, parameter count) to function nodes
+        self.main_func_node = None
+        for func_node in ast.functions:
+            name = func_node.name
+            functions[(name, len(func_node.args))] = func_node
+            if name == 'main':
+                self.main_func_node = func_node
+        self.functions = MappingProxyType(functions)
+
+    def run(self, console_output=True, inp=None, trace_output=False):
+        interpreter = Interpreter(console_output, inp, trace_output)
+        interpreter.run_program(self)
+        return interpreter
+
+def compile_program(program: str) -> Program:
+    return Program(parse_program(program, members=False))
+
 class Interpreter(InterpreterBase):
+    # Methods that run each kind of node (see dispatch.py). Statement handlers
+    # return a value only when the statement returns from the function.
+    STATEMENT_HANDLERS = {
+        '=': 'do_assignment',
+        'fcall': 'do_call_statement',
+        'if': 'do_if_statement',
+        'while': 'do_while_statement',
+        'return': 'do_return_statement',
+    }
+    EXPRESSION_HANDLERS = {
+        **dict.fromkeys(OPERATORS, 'evaluate_operation'),
+        'fcall': 'do_func_call',
+        'var': 'get_variable_value',
+        'nil': 'evaluate_nil',
+        'int': 'evaluate_literal',
+        'string': 'evaluate_literal',
+        'bool': 'evaluate_literal',
+    }
+
     def __init__(self, console_output=True, inp=None, trace_output=False):
         super().__init__(console_output, inp)
         self.trace_output = trace_output
+        self.statement_handlers = handler_table(self, self.STATEMENT_HANDLERS)
+        self.expression_handlers = handler_table(self, self.EXPRESSION_HANDLERS)
+        # The value each literal node evaluates to
+        self.literals = {}
 
     def print_if_trace(self, *args, **kwargs):
         if self.trace_output:
             print(*args, **kwargs, file=sys.stderr)
 
     def run(self, program):
-        ast = parse_program(program)
-        self.variables: dict[str, list[TypedValue]] = {} # Maps variable names to a list of shadowed scopes
-        self.functions = {} # Maps function names to function nodes
-        self.scopes = [set()]
-
-        main_func_node = None
-        for func_node in ast.dict['functions']:
-            name = func_node.dict['name']
-            self.functions[(name, len(func_node.dict['args']))] = func_node
-            if name == 'main':
-                main_func_node = func_node
-        
-        if main_func_node is None:
+        self.run_program(compile_program(program))
+
+    def run_program(self, program: Program):
+        # Maps symbol ids (see symbols.py) to a list of the variable's shadowed
+        # values. trail lists the ids of the variables defined in each open scope,
+        # which starts at the index in trail given by marks.
+        self.symbols: tuple[str, ...] = program.ast.symbols
+        self.stacks: list[list[TypedValue]] = [[] for _ in self.symbols]
+        self.trail: list[int] = []
+        self.marks: list[int] = [0]
+        # Where in trail the scope of the function being run starts (None in main)
+        self.frame_start: int | None = None
+        self.functions = program.functions # Maps function names to function nodes
+
+        if program.main_func_node is None:
             super().error(
                 ErrorType.NAME_ERROR,
                 "No main() function was found",
             )
-        self.run_statements(main_func_node.dict['statements'])
+        self.run_statements(program.main_func_node.statements)
 
     def run_statements(self, statement_list):
+        handlers = self.statement_handlers
         for statement_node in statement_list:
-            return_val = self.run_statement(statement_node)
-            if statement_node.elem_type == 'return' or (statement_node.elem_type in ['if', 'while'] and return_val is not None):
-                return return_val
+            return_val = handlers[statement_node.elem_type](statement_node)
+            if return_val is not None:
+                return None if return_val is LEAVE_BLOCK else return_val
         return None
 
     def run_statement(self, statement_node):
-        match statement_node.elem_type:
-            case '=':
-                self.do_assignment(statement_node)
-                return None
-            case 'fcall':
-                return self.do_func_call(statement_node)
-            case 'if':
-                return self.do_if_statement(statement_node)
-            case 'while':
-                return self.do_while_statement(statement_node)
-            case 'return':
-                if statement_node.dict['expression'] is None:
-                    return TypedValue('nil', None)
-                return copy.deepcopy(self.evaluate_expression(statement_node.dict['expression']))
-
-    def is_variable_defined(self, varname):
-        return varname in self.variables and len(self.variables[varname]) > 0
+        return self.statement_handlers[statement_node.elem_type](statement_node)
+
+    def do_call_statement(self, call_node):
+        self.evaluate_expression(call_node)
+
+    def do_return_statement(self, statement_node):
+        expression = statement_node.expression
+        if expression is None:
+            return NIL
+        if expression.elem_type == InterpreterBase.FCALL_DEF:
+            return_val = self.do_func_call(expression, tail=True)
+        else:
+            return_val = self.evaluate_expression(expression)
+        if return_val is None:
+            return LEAVE_BLOCK
+        return return_val
+
+    def push_scope(self, symbols=()):
+        self.marks.append(len(self.trail))
+        self.trail.extend(symbols)
+
+    def pop_scope(self):
+        mark = self.marks.pop()
+        for symbol in self.trail[mark:]:
+            self.stacks[symbol].pop()
+        del self.trail[mark:]
+
+    # A call being returned can replace the function that makes it, rather than
+    # run inside it, if everything that function's scope defines would be hidden
+    # by the parameters of the one it calls anyway
+    def can_replace_frame(self, scope) -> bool:
+        return self.frame_start is not None and scope.issuperset(self.trail[self.frame_start:])
 
     def do_assignment(self, statement_node):
-        target_var_name = statement_node.dict['name']
-        expression_value = self.evaluate_expression(statement_node.dict['expression'])
-        if not self.is_variable_defined(target_var_name):
-            self.scopes[-1].add(target_var_name)
-            self.variables[target_var_name] = [expression_value]
+        expression_value = self.evaluate_expression(statement_node.expression)
+        values = self.stacks[statement_node.symbol]
+        if not values:
+            self.trail.append(statement_node.symbol)
+            values.append(expression_value)
         else:
-            self.variables[target_var_name][-1] = expression_value
+            values[-1] = expression_value
     
-    def do_func_call(self, func_call_node):
-        args = list(map(self.evaluate_expression, func_call_node.dict['args']))
-        func_name = func_call_node.dict['name']
-        match func_call_node.dict['name']:
+    def do_func_call(self, func_call_node, tail=False):
+        args = list(map(self.evaluate_expression, func_call_node.args))
+        func_name = func_call_node.name
+        match func_call_node.name:
             case 'print':
                 self.run_print(args)
-                return TypedValue('nil', None)
+                return NIL
             case 'inputi':
                 return self.run_inputi(args)
             case 'inputs':
@@ -112,47 +202,52 @@ class Interpreter(InterpreterBase):
             )
         
         func_decl_node = self.functions[func_name, len(args)]
-        arg_names = [arg_node.dict['name'] for arg_node in func_decl_node.dict['args']]
-        self.scopes.append(set(arg_names))
-        for arg_name, value in zip(arg_names, args):
-            if not self.is_variable_defined(arg_name):
-                self.variables[arg_name] = [copy.deepcopy(value)]
-            else:
-                self.variables[arg_name].append(copy.deepcopy(value))
+        if tail and self.can_replace_frame({arg_node.symbol for arg_node in func_decl_node.args}):
+            return TailCall(func_decl_node, args)
+
+        frame_start = self.frame_start
+        while True:
+            arg_symbols = [arg_node.symbol for arg_node in func_decl_node.args]
+            self.frame_start = len(self.trail)
+            # Each argument is in the scope once, even if two have the same name
+            self.push_scope(set(arg_symbols))
+            for symbol, value in zip(arg_symbols, args):
+                self.stacks[symbol].append(value)
 
-        return_val = self.run_statements(func_decl_node.dict['statements'])
+            return_val = self.run_statements(func_decl_node.statements)
+
+            self.pop_scope()
+            if type(return_val) is not TailCall:
+                break
+            # The call returned replaces this one
+            func_decl_node, args = return_val.function, return_val.args
+        self.frame_start = frame_start
 
-        for varname in self.scopes[-1]:
-            self.variables[varname].pop()
-        self.scopes.pop()
-        
         if return_val is None:
-            return TypedValue('nil', None)
+            return NIL
         return return_val
     
     def do_if_statement(self, if_statement_node):
-        condition = self.evaluate_expression(if_statement_node.dict['condition'])
+        condition = self.evaluate_expression(if_statement_node.condition)
         if condition.type != 'bool':
             super().error(
                 ErrorType.TYPE_ERROR,
                 f"Expected bool inside 'if' condition but got {condition}"
             )
-        statements = if_statement_node.dict['statements'] if condition.value else if_statement_node.dict['else_statements']
+        statements = if_statement_node.statements if condition.value else if_statement_node.else_statements
         if statements is None:
             return None
-        self.scopes.append(set())
+        self.push_scope()
         return_val = self.run_statements(statements)
-        for var_name in self.scopes[-1]:
-            self.variables[var_name].pop()
-        self.scopes.pop()
+        self.pop_scope()
         return return_val
 
     def do_while_statement(self, while_statement_node):
-        self.scopes.append(set())
+        self.push_scope()
 
         return_val = None
         while True:
-            condition = self.evaluate_expression(while_statement_node.dict['condition'])
+            condition = self.evaluate_expression(while_statement_node.condition)
             if condition.type != 'bool':
                 super().error(
                     ErrorType.TYPE_ERROR,
@@ -160,36 +255,33 @@ class Interpreter(InterpreterBase):
                 )
             if not condition.value:
                 break
-            return_val = self.run_statements(while_statement_node.dict['statements'])
+            return_val = self.run_statements(while_statement_node.statements)
             if return_val is not None:
                 break
-        
-        for var_name in self.scopes[-1]:
-            self.variables[var_name].pop()
-        self.scopes.pop()
+
+        self.pop_scope()
         return return_val
 
     def evaluate_expression(self, expression_node) -> TypedValue:
-        if expression_node.elem_type in OPERATORS:
-            return self.evaluate_operation(expression_node)
-        match expression_node.elem_type:
-            case 'fcall':
-                return self.do_func_call(expression_node)
-            case 'var':
-                return self.get_variable_value(expression_node)
-            case 'nil':
-                return TypedValue('nil', None)
-            case 'int' | 'string' | 'bool':
-                return TypedValue(expression_node.elem_type, expression_node.dict['val'])
+        return self.expression_handlers[expression_node.elem_type](expression_node)
+
+    def evaluate_nil(self, nil_node):
+        return NIL
+
+    def evaluate_literal(self, literal_node):
+        value = self.literals.get(literal_node)
+        if value is None:
+            value = self.literals[literal_node] = TypedValue(literal_node.elem_type, literal_node.val)
+        return value
 
     def get_variable_value(self, variable_node):
-        var_name = variable_node.dict['name']
-        if not self.is_variable_defined(var_name):
+        values = self.stacks[variable_node.symbol]
+        if not values:
             super().error(
                 ErrorType.NAME_ERROR,
-                f"Variable {var_name} has not been defined",
+                f"Variable {variable_node.name} has not been defined",
             )
-        return self.variables[var_name][-1]
+        return values[-1]
 
     def do_operand_types_match(self, operands, operator):
         for types in VALID_OPERAND_TYPES[operator]:
@@ -204,13 +296,30 @@ class Interpreter(InterpreterBase):
 
     def evaluate_operation(self, expression_node) -> TypedValue:
         operator = expression_node.elem_type
-        op1 = self.evaluate_expression(expression_node.dict['op1'])
-        if operator in BINARY_OPERATORS:
-            op2 = self.evaluate_expression(expression_node.dict['op2'])
-            operands = [op1, op2]
+        op1_node = expression_node.op1
+        if op1_node.elem_type in BINARY_OPERATORS:
+            op1 = self.evaluate_operation_chain(op1_node)
         else:
-            operands = [op1]
+            op1 = self.evaluate_expression(op1_node)
+        if operator in BINARY_OPERATORS:
+            return self.apply_operation(operator, [op1, self.evaluate_expression(expression_node.op2)])
+        return self.apply_operation(operator, [op1])
+
+    # A left-associative chain like 1 + 2 + 3 + ... is as deep as it is long, so
+    # it's walked down to its first operand and then applied back up in a loop
+    def evaluate_operation_chain(self, expression_node) -> TypedValue:
+        chain = []
+        while expression_node.elem_type in BINARY_OPERATORS:
+            chain.append(expression_node)
+            expression_node = expression_node.op1
+        value = self.evaluate_expression(expression_node)
+        for node in reversed(chain):
+            value = self.apply_operation(node.elem_type, [value, self.evaluate_expression(node.op2)])
+        return value
 
+    def apply_operation(self, operator, operands) -> TypedValue:
+        op1 = operands[0]
+        op2 = operands[-1]
         if not self.do_operand_types_match(operands, operator):
             super().error(
                 ErrorType.TYPE_ERROR,
@@ -218,35 +327,37 @@ class Interpreter(InterpreterBase):
             )
         match operator:
             case '+':
+                if op1.type == 'int':
+                    return int_value(op1.value + op2.value)
                 return TypedValue(op1.type, op1.value + op2.value)
             case '-':
-                return TypedValue('int', op1.value - op2.value)
+                return int_value(op1.value - op2.value)
             case '*':
-                return TypedValue('int', op1.value * op2.value)
+                return int_value(op1.value * op2.value)
             case '*':
-                return TypedValue('int', op1.value * op2.value)
+                return int_value(op1.value * op2.value)
             case '/':
-                return TypedValue('int', op1.value // op2.value)
+                return int_value(op1.value // op2.value)
             case '==':
-                return TypedValue('bool', op1.type == op2.type and op1.value == op2.value)
+                return bool_value(op1.type == op2.type and op1.value == op2.value)
             case '!=':
-                return TypedValue('bool', op1.type != op2.type or op1.value != op2.value)
+                return bool_value(op1.type != op2.type or op1.value != op2.value)
             case '<':
-                return TypedValue('bool', op1.value < op2.value)
+                return bool_value(op1.value < op2.value)
             case '<=':
-                return TypedValue('bool', op1.value <= op2.value)
+                return bool_value(op1.value <= op2.value)
             case '>':
-                return TypedValue('bool', op1.value > op2.value)
+                return bool_value(op1.value > op2.value)
             case '>=':
-                return TypedValue('bool', op1.value >= op2.value)
+                return bool_value(op1.value >= op2.value)
             case '&&':
-                return TypedValue('bool', op1.value and op2.value)
+                return bool_value(op1.value and op2.value)
             case '||':
-                return TypedValue('bool', op1.value or op2.value)
+                return bool_value(op1.value or op2.value)
             case 'neg':
-                return TypedValue('int', -op1.value)
+                return int_value(-op1.value)
             case '!':
-                return TypedValue('bool', not op1.value)
+                return bool_value(not op1.value)
 
     def run_print(self, args):
         output_strs = []
@@ -1,6 +1,11 @@
 from intbase import InterpreterBase, ErrorType
 from brewparse import parse_program
-import copy, sys
+from copyonwrite import copy_cells, copy_pending
+from dispatch import LEAVE_BLOCK, TailCall, handler_table
+from element import copy_tree
+from symbols import intern_symbols
+from types import MappingProxyType
+import copy, operator, sys
 
 BINARY_OPERATORS = set(['+', '-', '*', '/', '==', '<', '<=', '>', '>=', '!=', '&&', '||'])
 UNARY_OPERATORS = set(['neg', '!'])
@@ -29,8 +34,8 @@ VALID_OPERAND_TYPES = {
     '!': [(['bool'], ('int', 'bool'))],
 }
 COERCIONS = {
-    ('int', 'bool'): lambda x: TypedValue('bool', x.value != 0),
-    ('bool', 'int'): lambda x: TypedValue('int', 1 if x.value else 0),
+    ('int', 'bool'): lambda x: bool_value(x.value != 0),
+    ('bool', 'int'): lambda x: int_value(1 if x.value else 0),
 }
 
 class Closure:
@@ -44,106 +49,318 @@ class Closure:
         return Closure(self.definition, copy.deepcopy(self.free_vars, memo))
 
 class TypedValue:
+    # shared is set on the variables closures captured, which have to be copied
+    # before they change (see copyonwrite.py)
+    __slots__ = ('type', 'value', 'shared', '__weakref__')
+
     def __init__(self, type: str, value: int | str | bool | Closure | dict[int, any] | None):
         self.type = type
         self.value = value
+        self.shared = False
     
     def __repr__(self):
         return f"({self.type} {self.value})"
 
+class Constant(TypedValue):
+    # A value evaluated without allocating it each time (nil, bools, small ints
+    # and literals). Variables are assigned in place, so one never becomes a
+    # variable: copying it gives a TypedValue, as does passing it by reference.
+    __slots__ = ()
+
+    def __copy__(self):
+        return TypedValue(self.type, self.value)
+
+    def __deepcopy__(self, memo):
+        return TypedValue(self.type, self.value)
+
+NIL = Constant('nil', None)
+TRUE = Constant('bool', True)
+FALSE = Constant('bool', False)
+SMALL_INTS = tuple(Constant('int', n) for n in range(1024))
+
+def int_value(n: int) -> TypedValue:
+    return SMALL_INTS[n] if 0 <= n < 1024 else TypedValue('int', n)
+
+def bool_value(b: bool) -> TypedValue:
+    return TRUE if b else FALSE
+
+VALUE_TYPES = ('int', 'string', 'bool', 'nil', 'func', 'overloaded_func')
+ARITHMETIC = {'+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.floordiv}
+COMPARISONS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+# Computes operator_name on operands of these types, once they're coerced
+def compute(operator_name, types):
+    match operator_name:
+        case '==' | '!=' if types[0] != types[1]:
+            return lambda op1, op2: FALSE if operator_name == '==' else TRUE
+        case '==':
+            return lambda op1, op2: TRUE if op1.value == op2.value else FALSE
+        case '!=':
+            return lambda op1, op2: FALSE if op1.value == op2.value else TRUE
+        case '+' if types[0] == 'string':
+            return lambda op1, op2: TypedValue('string', op1.value + op2.value)
+        case '+' | '-' | '*' | '/':
+            apply = ARITHMETIC[operator_name]
+            return lambda op1, op2: int_value(apply(op1.value, op2.value))
+        case '<' | '<=' | '>' | '>=':
+            apply = COMPARISONS[operator_name]
+            return lambda op1, op2: TRUE if apply(op1.value, op2.value) else FALSE
+        case '&&':
+            return lambda op1, op2: TRUE if op1.value and op2.value else FALSE
+        case '||':
+            return lambda op1, op2: TRUE if op1.value or op2.value else FALSE
+        case 'neg':
+            return lambda op1: int_value(-op1.value)
+        case '!':
+            return lambda op1: FALSE if op1.value else TRUE
+
+# The function that coerces and computes operator_name on operands of these types,
+# from the first of its VALID_OPERAND_TYPES rules they match, or None if they
+# match none
+def fuse_operation(operator_name, types):
+    for expected_types, valid_coercion in VALID_OPERAND_TYPES[operator_name]:
+        coercions = []
+        coerced_types = []
+        for operand_type, expected_type in zip(types, expected_types):
+            if expected_type == 'any' or operand_type == expected_type:
+                coercions.append(None)
+                coerced_types.append(operand_type)
+            elif valid_coercion == (operand_type, expected_type):
+                coercions.append(COERCIONS[valid_coercion])
+                coerced_types.append(expected_type)
+            else:
+                break
+        else:
+            operation = compute(operator_name, coerced_types)
+            if not any(coercions):
+                return operation
+            coerce = [coercion or (lambda x: x) for coercion in coercions]
+            if len(coerce) == 1:
+                return lambda op1: operation(coerce[0](op1))
+            return lambda op1, op2: operation(coerce[0](op1), coerce[1](op2))
+    return None
+
+# Maps (operator, type) for unary operators and (operator, type1, type2) for
+# binary ones to the fused operation, for every combination of operand types the
+# operator accepts
+def build_operations():
+    operations = {}
+    for operator_name in OPERATORS:
+        if operator_name in UNARY_OPERATORS:
+            combinations = [(t,) for t in VALUE_TYPES]
+        else:
+            combinations = [(t1, t2) for t1 in VALUE_TYPES for t2 in VALUE_TYPES]
+        for types in combinations:
+            operation = fuse_operation(operator_name, types)
+            if operation is not None:
+                operations[(operator_name, *types)] = operation
+    return operations
+
+OPERATIONS = build_operations()
+
+class Program:
+    # A parsed program that can be run many times, from any thread. Nothing here is
+    # modified after construction; all per-run state lives in the Interpreter.
+    __slots__ = ('ast', 'functions', 'main_func_node')
+
+    def __init__(self, ast):
+        # There are no objects yet, so "a.b" is just the name of a variable. An AST
+        # interned for version 4, which other programs may share, is interned again
+        # as a copy, never in place.
+        if ast.members is not False:
+            ast = intern_symbols(copy_tree(ast), members=False)
+        self.ast = ast
+        # Maps function names to their node, or to a map from parameter count
+        # to node if the function is overloaded
+        functions = {}
+        self.main_func_node = None
+        for func_node in ast.functions:
+            name = func_node.name
+            if name not in functions:
+                functions[name] = func_node
+            elif isinstance(functions[name], dict):
+                functions[name][len(func_node.args)] = func_node
+            else:
+                first_overload_node = functions[name]
+                functions[name] = {
+                    len(first_overload_node.args): first_overload_node,
+                    len(func_node.args): func_node,
+                }
+            if name == 'main':
+                self.main_func_node = func_node
+        self.functions = MappingProxyType({
+            name: MappingProxyType(func) if isinstance(func, dict) else func
+            for name, func in functions.items()
+        })
+
+    def run(self, console_output=True, inp=None, trace_output=False):
+        interpreter = Interpreter(console_output, inp, trace_output)
+        interpreter.run_program(self)
+        return interpreter
+
+def compile_program(program: str) -> Program:
+    return Program(parse_program(program, members=False))
+
 class Interpreter(InterpreterBase):
+    # Methods that run each kind of node (see dispatch.py). Statement handlers
+    # return a value only when the statement returns from the function.
+    STATEMENT_HANDLERS = {
+        '=': 'do_assignment',
+        'fcall': 'do_call_statement',
+        'if': 'do_if_statement',
+        'while': 'do_while_statement',
+        'return': 'do_return_statement',
+    }
+    EXPRESSION_HANDLERS = {
+        **dict.fromkeys(BINARY_OPERATORS, 'evaluate_binary_operation'),
+        **dict.fromkeys(UNARY_OPERATORS, 'evaluate_unary_operation'),
+        'fcall': 'do_func_call',
+        'var': 'get_variable_value',
+        'lambda': 'evaluate_lambda',
+        'nil': 'evaluate_nil',
+        'int': 'evaluate_literal',
+        'string': 'evaluate_literal',
+        'bool': 'evaluate_literal',
+    }
+
     def __init__(self, console_output=True, inp=None, trace_output=False):
         super().__init__(console_output, inp)
         self.trace_output = trace_output
+        self.statement_handlers = handler_table(self, self.STATEMENT_HANDLERS)
+        self.expression_handlers = handler_table(self, self.EXPRESSION_HANDLERS)
+        # Lazy copies of closures that haven't been made yet
+        self.lazy_copies = {}
+        # The Constant each literal node evaluates to
+        self.literals = {}
 
     def print_if_trace(self, *args, **kwargs):
         if self.trace_output:
             print(*args, **kwargs, file=sys.stderr)
 
     def run(self, program):
-        ast = parse_program(program)
-        self.variables: dict[str, list[TypedValue]] = {} # Maps variable names to a list of shadowed scopes
-        self.scopes: list[set[str]] = [set()]
-
-        main_func_node = None
-        for func_node in ast.dict['functions']:
-            name = func_node.dict['name']
-            if self.is_variable_defined(name):
-                if self.variables[name][-1].type == 'overloaded_func':
-                    self.variables[name][-1].value[len(func_node.dict['args'])] = func_node
-                else:
-                    first_overload_node = self.variables[name][-1].value.definition
-                    self.variables[name][-1] = TypedValue('overloaded_func', {
-                        len(first_overload_node.dict['args']): first_overload_node,
-                        len(func_node.dict['args']): func_node,
-                    })
+        self.run_program(compile_program(program))
+
+    def run_program(self, program: Program):
+        # Maps symbol ids (see symbols.py) to a list of the variable's shadowed
+        # values. trail lists the ids of the variables defined in each open scope,
+        # which starts at the index in trail given by marks.
+        self.symbols: tuple[str, ...] = program.ast.symbols
+        self.stacks: list[list[TypedValue]] = [[] for _ in self.symbols]
+        self.trail: list[int] = []
+        self.marks: list[int] = [0]
+        # Where in trail the scope of the function being run starts (None in main)
+        self.frame_start: int | None = None
+
+        for func in program.functions.values():
+            if isinstance(func, MappingProxyType):
+                symbol = next(iter(func.values())).symbol
+                self.stacks[symbol].append(TypedValue('overloaded_func', dict(func)))
             else:
-                self.scopes[-1].add(name)
-                self.variables[name] = [TypedValue('func', Closure(func_node, {}))]
-            if name == 'main':
-                main_func_node = func_node
-        
-        if main_func_node is None:
+                symbol = func.symbol
+                self.stacks[symbol].append(TypedValue('func', Closure(func, {})))
+            self.trail.append(symbol)
+
+        if program.main_func_node is None:
             super().error(
                 ErrorType.NAME_ERROR,
                 "No main() function was found",
             )
-        self.run_statements(main_func_node.dict['statements'])
+        self.run_statements(program.main_func_node.statements)
 
     def run_statements(self, statement_list):
+        handlers = self.statement_handlers
         for statement_node in statement_list:
-            return_val = self.run_statement(statement_node)
-            if statement_node.elem_type == 'return' or (statement_node.elem_type in ['if', 'while'] and return_val is not None):
-                return return_val
+            return_val = handlers[statement_node.elem_type](statement_node)
+            if return_val is not None:
+                return None if return_val is LEAVE_BLOCK else return_val
         return None
 
     def run_statement(self, statement_node):
-        match statement_node.elem_type:
-            case '=':
-                self.do_assignment(statement_node)
-                return None
-            case 'fcall':
-                return self.do_func_call(statement_node)
-            case 'if':
-                return self.do_if_statement(statement_node)
-            case 'while':
-                return self.do_while_statement(statement_node)
-            case 'return':
-                if statement_node.dict['expression'] is None:
-                    return TypedValue('nil', None)
-                return copy.deepcopy(self.evaluate_expression(statement_node.dict['expression']))
-
-    def is_variable_defined(self, varname):
-        return varname in self.variables and len(self.variables[varname]) > 0
+        return self.statement_handlers[statement_node.elem_type](statement_node)
+
+    def do_call_statement(self, call_node):
+        self.evaluate_expression(call_node)
+
+    def do_return_statement(self, statement_node):
+        expression = statement_node.expression
+        if expression is None:
+            return NIL
+        if expression.elem_type == InterpreterBase.FCALL_DEF:
+            return_val = self.do_func_call(expression, tail=True)
+            if type(return_val) is TailCall:
+                return return_val
+        else:
+            return_val = self.evaluate_expression(expression)
+        if return_val is None:
+            return LEAVE_BLOCK
+        return self.copy_value(return_val)
+
+    # The same as copy.deepcopy(value), but a closure's captured variables are only
+    # copied once it's called
+    def copy_value(self, value):
+        # Expressions of a kind this version ignores evaluate to None, which can
+        # still be assigned and passed around
+        if value is None:
+            return None
+        match value.type:
+            case 'func':
+                copied = TypedValue('func', None)
+                closure = value.value
+                copied.value = Closure(closure.definition, copy_cells(closure.free_vars, value, copied, self.lazy_copies))
+                if value.shared:
+                    copied.shared = True
+                return copied
+            case 'overloaded_func':
+                return TypedValue('overloaded_func', dict(value.value))
+        return TypedValue(value.type, value.value)
+
+    def push_scope(self, symbols=()):
+        self.marks.append(len(self.trail))
+        self.trail.extend(symbols)
+
+    def pop_scope(self):
+        mark = self.marks.pop()
+        for symbol in self.trail[mark:]:
+            self.stacks[symbol].pop()
+        del self.trail[mark:]
+
+    # A call being returned can replace the function that makes it, rather than
+    # run inside it, if everything that function's scope defines would be hidden
+    # by what the one it calls binds anyway
+    def can_replace_frame(self, scope) -> bool:
+        return self.frame_start is not None and scope.issuperset(self.trail[self.frame_start:])
 
     def do_assignment(self, statement_node):
-        target_var_name = statement_node.dict['name']
-        expression_value = self.evaluate_expression(statement_node.dict['expression'])
-        if not self.is_variable_defined(target_var_name):
-            self.scopes[-1].add(target_var_name)
-            self.variables[target_var_name] = [copy.copy(expression_value)]
+        expression_value = self.evaluate_expression(statement_node.expression)
+        values = self.stacks[statement_node.symbol]
+        if not values:
+            self.trail.append(statement_node.symbol)
+            values.append(copy.copy(expression_value))
         else:
-            self.variables[target_var_name][-1].type = expression_value.type
-            self.variables[target_var_name][-1].value = expression_value.value
+            if self.lazy_copies and values[-1].shared:
+                copy_pending(self.lazy_copies)
+            values[-1].type = expression_value.type
+            values[-1].value = expression_value.value
     
-    def do_func_call(self, func_call_node):
-        args = list(map(self.evaluate_expression, func_call_node.dict['args']))
-        func_name = func_call_node.dict['name']
-        match func_call_node.dict['name']:
+    def do_func_call(self, func_call_node, tail=False):
+        args = list(map(self.evaluate_expression, func_call_node.args))
+        func_name = func_call_node.name
+        match func_call_node.name:
             case 'print':
                 self.run_print(args)
-                return TypedValue('nil', None)
+                return NIL
             case 'inputi':
                 return self.run_inputi(args)
             case 'inputs':
                 return self.run_inputs(args)
-        if not self.is_variable_defined(func_name):
+        values = self.stacks[func_call_node.symbol]
+        if not values:
             super().error(
                 ErrorType.NAME_ERROR,
                 f"Function {func_name} that takes {len(args)} parameters has not been defined",
             )
 
-        func_object = self.variables[func_name][-1]
+        func_object = values[-1]
         if func_object.type == 'overloaded_func':
             if len(args) not in func_object.value:
                 super().error(
@@ -155,10 +372,10 @@ class Interpreter(InterpreterBase):
         elif func_object.type == 'func':
             func_decl_node = func_object.value.definition
             free_vars = func_object.value.free_vars
-            if len(args) != len(func_decl_node.dict['args']):
+            if len(args) != len(func_decl_node.args):
                 super().error(
                     ErrorType.TYPE_ERROR,
-                    f"Function {func_name} takes {len(func_decl_node.dict['args'])} parameters but {len(args)} were given",
+                    f"Function {func_name} takes {len(func_decl_node.args)} parameters but {len(args)} were given",
                 )
         else:
             super().error(
@@ -166,56 +383,62 @@ class Interpreter(InterpreterBase):
                 f"Trying to call {func_name} as a function, but it is of type {func_object.type}",
             )
 
-        arg_names = [arg_node.dict['name'] for arg_node in func_decl_node.dict['args']]
-        arg_types = [arg_node.elem_type for arg_node in func_decl_node.dict['args']]
-        for arg_name, value, arg_type in zip(arg_names, args, arg_types):
-            value_to_pass = value if arg_type == 'refarg' else copy.deepcopy(value)
-            if not self.is_variable_defined(arg_name):
-                self.variables[arg_name] = [value_to_pass]
-            else:
-                self.variables[arg_name].append(value_to_pass)
-        
-        arg_names_set = set(arg_names)
-        unshadowed_free_vars = [(k, v) for k, v in free_vars.items() if k not in arg_names_set]
-        for var_name, value in unshadowed_free_vars:
-            # The variable is guaranteed to have been defined at some point,
-            # so no need to check
-            self.variables[var_name].append(value)
-        self.scopes.append(arg_names_set | { k for k, _ in unshadowed_free_vars })
-
-        return_val = self.run_statements(func_decl_node.dict['statements'])
-
-        for varname in self.scopes[-1]:
-            self.variables[varname].pop()
-        self.scopes.pop()
-        
+        if tail and self.can_replace_frame({arg_node.symbol for arg_node in func_decl_node.args} | free_vars.keys()):
+            return TailCall(func_decl_node, args, free_vars)
+
+        frame_start = self.frame_start
+        while True:
+            arg_symbols = [arg_node.symbol for arg_node in func_decl_node.args]
+            arg_types = [arg_node.elem_type for arg_node in func_decl_node.args]
+            for symbol, value, arg_type in zip(arg_symbols, args, arg_types):
+                if arg_type != 'refarg':
+                    value = self.copy_value(value)
+                elif type(value) is Constant:
+                    value = TypedValue(value.type, value.value)
+                self.stacks[symbol].append(value)
+
+            arg_symbols_set = set(arg_symbols)
+            unshadowed_free_vars = [(k, v) for k, v in free_vars.items() if k not in arg_symbols_set]
+            for symbol, value in unshadowed_free_vars:
+                self.stacks[symbol].append(value)
+            self.frame_start = len(self.trail)
+            # Each variable is in the scope once, even if it was pushed twice
+            self.push_scope(arg_symbols_set | { k for k, _ in unshadowed_free_vars })
+
+            return_val = self.run_statements(func_decl_node.statements)
+
+            self.pop_scope()
+            if type(return_val) is not TailCall:
+                break
+            # The call returned replaces this one
+            func_decl_node, args, free_vars = return_val.function, return_val.args, return_val.free_vars
+        self.frame_start = frame_start
+
         if return_val is None:
-            return TypedValue('nil', None)
+            return NIL
         return return_val
     
     def do_if_statement(self, if_statement_node):
-        condition = self.try_coerce_to_bool(self.evaluate_expression(if_statement_node.dict['condition']))
+        condition = self.try_coerce_to_bool(self.evaluate_expression(if_statement_node.condition))
         if condition.type != 'bool':
             super().error(
                 ErrorType.TYPE_ERROR,
                 f"Expected bool inside 'if' condition but got {condition}"
             )
-        statements = if_statement_node.dict['statements'] if condition.value else if_statement_node.dict['else_statements']
+        statements = if_statement_node.statements if condition.value else if_statement_node.else_statements
         if statements is None:
             return None
-        self.scopes.append(set())
+        self.push_scope()
         return_val = self.run_statements(statements)
-        for var_name in self.scopes[-1]:
-            self.variables[var_name].pop()
-        self.scopes.pop()
+        self.pop_scope()
         return return_val
 
     def do_while_statement(self, while_statement_node):
-        self.scopes.append(set())
+        self.push_scope()
 
         return_val = None
         while True:
-            condition = self.try_coerce_to_bool(self.evaluate_expression(while_statement_node.dict['condition']))
+            condition = self.try_coerce_to_bool(self.evaluate_expression(while_statement_node.condition))
             if condition.type != 'bool':
                 super().error(
                     ErrorType.TYPE_ERROR,
@@ -223,38 +446,34 @@ class Interpreter(InterpreterBase):
                 )
             if not condition.value:
                 break
-            return_val = self.run_statements(while_statement_node.dict['statements'])
+            return_val = self.run_statements(while_statement_node.statements)
             if return_val is not None:
                 break
-        
-        for var_name in self.scopes[-1]:
-            self.variables[var_name].pop()
-        self.scopes.pop()
+
+        self.pop_scope()
         return return_val
 
     def evaluate_expression(self, expression_node) -> TypedValue:
-        if expression_node.elem_type in OPERATORS:
-            return self.evaluate_operation(expression_node)
-        match expression_node.elem_type:
-            case 'fcall':
-                return self.do_func_call(expression_node)
-            case 'var':
-                return self.get_variable_value(expression_node)
-            case 'lambda':
-                return self.evaluate_lambda(expression_node)
-            case 'nil':
-                return TypedValue('nil', None)
-            case 'int' | 'string' | 'bool':
-                return TypedValue(expression_node.elem_type, expression_node.dict['val'])
+        return self.expression_handlers[expression_node.elem_type](expression_node)
+
+    def evaluate_nil(self, nil_node):
+        return NIL
+
+    def evaluate_literal(self, literal_node):
+        constant = self.literals.get(literal_node)
+        if constant is None:
+            constant = self.literals[literal_node] = Constant(literal_node.elem_type, literal_node.val)
+        return constant
 
     def get_variable_value(self, variable_node):
-        var_name = variable_node.dict['name']
-        if not self.is_variable_defined(var_name):
+        var_name = variable_node.name
+        values = self.stacks[variable_node.symbol]
+        if not values:
             super().error(
                 ErrorType.NAME_ERROR,
                 f"Variable {var_name} has not been defined",
             )
-        typed_value = self.variables[var_name][-1]
+        typed_value = values[-1]
         if typed_value.type == 'overloaded_func':
             super().error(
                 ErrorType.NAME_ERROR,
@@ -263,78 +482,60 @@ class Interpreter(InterpreterBase):
         return typed_value
     
     def evaluate_lambda(self, lambda_node):
-        free_vars = { var_name: copy.deepcopy(values[-1]) for var_name, values in self.variables.items() if len(values) > 0 }
+        free_vars = {}
+        stacks = self.stacks
+        symbols = lambda_node.free_symbols
+        for symbol in range(len(stacks)) if symbols is None else symbols:
+            values = stacks[symbol]
+            if values:
+                captured = free_vars[symbol] = self.copy_value(values[-1])
+                if captured is not None:
+                    captured.shared = True
         return TypedValue('func', Closure(lambda_node, free_vars))
 
-    def check_operands_and_coerce(self, operands, operator):
-        for type_rules in VALID_OPERAND_TYPES[operator]:
-            types, valid_coercion = type_rules
-            match = True
-            coerced = []
-            for operand, expected_type in zip(operands, types):
-                if expected_type == 'any' or operand.type == expected_type:
-                    coerced.append(operand)
-                    continue
-                if valid_coercion == (operand.type, expected_type):
-                    coerced.append(COERCIONS[(operand.type, expected_type)](operand))
-                    continue
-                match = False
-                break
-            if match:
-                return True, coerced
-        return False, None
-
-    def evaluate_operation(self, expression_node) -> TypedValue:
-        operator = expression_node.elem_type
-        op1 = self.evaluate_expression(expression_node.dict['op1'])
-        if operator in BINARY_OPERATORS:
-            op2 = self.evaluate_expression(expression_node.dict['op2'])
-            operands = [op1, op2]
+    def evaluate_binary_operation(self, expression_node) -> TypedValue:
+        op1_node = expression_node.op1
+        if op1_node.elem_type in BINARY_OPERATORS:
+            op1 = self.evaluate_operation_chain(op1_node)
         else:
-            operands = [op1]
+            op1 = self.evaluate_expression(op1_node)
+        op2 = self.evaluate_expression(expression_node.op2)
+        operation = OPERATIONS.get((expression_node.elem_type, op1.type, op2.type))
+        if operation is None:
+            self.incompatible_operands(expression_node, op1, op2)
+        return operation(op1, op2)
+
+    # Evaluates operations nested in their left operands, like the additions in
+    # 1 + 2 + 3 + ..., in a loop rather than recursively, however many there are
+    def evaluate_operation_chain(self, expression_node) -> TypedValue:
+        chain = []
+        while expression_node.elem_type in BINARY_OPERATORS:
+            chain.append(expression_node)
+            expression_node = expression_node.op1
+        op1 = self.evaluate_expression(expression_node)
+        for node in reversed(chain):
+            op2 = self.evaluate_expression(node.op2)
+            operation = OPERATIONS.get((node.elem_type, op1.type, op2.type))
+            if operation is None:
+                self.incompatible_operands(node, op1, op2)
+            op1 = operation(op1, op2)
+        return op1
+
+    def incompatible_operands(self, expression_node, op1, op2):
+        super().error(
+            ErrorType.TYPE_ERROR,
+            f"Incompatible types {op1.type}, {op2.type} for operation {expression_node.elem_type}"
+        )
 
-        valid_operands, coerced = self.check_operands_and_coerce(operands, operator)
-        if not valid_operands:
+    def evaluate_unary_operation(self, expression_node) -> TypedValue:
+        op1 = self.evaluate_expression(expression_node.op1)
+        operation = OPERATIONS.get((expression_node.elem_type, op1.type))
+        if operation is None:
             super().error(
                 ErrorType.TYPE_ERROR,
-                f"Incompatible types {', '.join([op.type for op in operands])} for operation {operator}"
+                f"Incompatible types {op1.type} for operation {expression_node.elem_type}"
             )
-        
-        op1 = coerced[0]
-        if operator in BINARY_OPERATORS:
-            op2 = coerced[1]
-        
-        match operator:
-            case '+':
-                return TypedValue(op1.type, op1.value + op2.value)
-            case '-':
-                return TypedValue('int', op1.value - op2.value)
-            case '*':
-                return TypedValue('int', op1.value * op2.value)
-            case '*':
-                return TypedValue('int', op1.value * op2.value)
-            case '/':
-                return TypedValue('int', op1.value // op2.value)
-            case '==':
-                return TypedValue('bool', op1.type == op2.type and op1.value == op2.value)
-            case '!=':
-                return TypedValue('bool', op1.type != op2.type or op1.value != op2.value)
-            case '<':
-                return TypedValue('bool', op1.value < op2.value)
-            case '<=':
-                return TypedValue('bool', op1.value <= op2.value)
-            case '>':
-                return TypedValue('bool', op1.value > op2.value)
-            case '>=':
-                return TypedValue('bool', op1.value >= op2.value)
-            case '&&':
-                return TypedValue('bool', op1.value and op2.value)
-            case '||':
-                return TypedValue('bool', op1.value or op2.value)
-            case 'neg':
-                return TypedValue('int', -op1.value)
-            case '!':
-                return TypedValue('bool', not op1.value)
+        return operation(op1)
 
     def try_coerce_to_bool(self, integer_or_bool: TypedValue):
         if integer_or_bool.type == 'int':
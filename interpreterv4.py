@@ -1,8 +1,13 @@
 from __future__ import annotations
 from intbase import InterpreterBase, ErrorType
 from brewparse import parse_program
-from element import Element
-import copy, sys
+from copyonwrite import copy_cells, copy_members, copy_pending
+from dispatch import TailCall, handler_table
+from element import Element, walk
+from shapes import Members, Shape
+from symbols import THIS
+from types import MappingProxyType
+import copy, operator, sys
 
 BINARY_OPERATORS = set(['+', '-', '*', '/', '==', '<', '<=', '>', '>=', '!=', '&&', '||'])
 UNARY_OPERATORS = set(['neg', '!'])
@@ -31,8 +36,8 @@ VALID_OPERAND_TYPES = {
     '!': [(['bool'], ('int', 'bool'))],
 }
 COERCIONS = {
-    ('int', 'bool'): lambda x: TypedValue('bool', x.value != 0),
-    ('bool', 'int'): lambda x: TypedValue('int', 1 if x.value else 0),
+    ('int', 'bool'): lambda x: bool_value(x.value != 0),
+    ('bool', 'int'): lambda x: int_value(1 if x.value else 0),
 }
 
 class Closure:
@@ -46,104 +51,422 @@ class Closure:
         return Closure(self.definition, copy.deepcopy(self.free_vars, memo))
 
 class TypedValue:
-    def __init__(self, type: str, value: int | str | bool | Closure | dict[int, Element] | dict[str, TypedValue] | None):
+    # shared is set on cells that are an object's member or a closure's captured
+    # variable, which have to be copied before they change (see copyonwrite.py)
+    __slots__ = ('type', 'value', 'shared', '__weakref__')
+
+    def __init__(self, type: str, value: int | str | bool | Closure | dict[int, Element] | Members | None):
         self.type = type
         self.value = value
+        self.shared = False
+
+    def __deepcopy__(self, memo):
+        copied = TypedValue(self.type, None)
+        memo[id(self)] = copied
+        copied.value = copy.deepcopy(self.value, memo)
+        copied.shared = self.shared
+        return copied
     
     def __repr__(self):
         return f"({self.type} {self.value})"
 
+class Constant(TypedValue):
+    # A value that is evaluated over and over (nil, true, false, small ints and
+    # literals) without allocating it each time. It must never become a variable,
+    # which can be assigned to in place: copying one gives a TypedValue, and a ref
+    # parameter is given a copy.
+    __slots__ = ()
+
+    def __copy__(self):
+        return TypedValue(self.type, self.value)
+
+    def __deepcopy__(self, memo):
+        return TypedValue(self.type, self.value)
+
+NIL = Constant('nil', None)
+TRUE = Constant('bool', True)
+FALSE = Constant('bool', False)
+SMALL_INTS = tuple(Constant('int', n) for n in range(1024))
+
+def int_value(n: int) -> TypedValue:
+    return SMALL_INTS[n] if 0 <= n < 1024 else TypedValue('int', n)
+
+def bool_value(b: bool) -> TypedValue:
+    return TRUE if b else FALSE
+
+VALUE_TYPES = ('int', 'string', 'bool', 'nil', 'func', 'overloaded_func', 'object')
+ARITHMETIC = {'+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.floordiv}
+COMPARISONS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+# Computes operator_name on operands of these types, once they're coerced
+def compute(operator_name, types):
+    match operator_name:
+        case '==' | '!=' if types[0] != types[1]:
+            return lambda op1, op2: FALSE if operator_name == '==' else TRUE
+        case '==' if types[0] == 'object':
+            return lambda op1, op2: TRUE if op1.value is op2.value else FALSE
+        case '!=' if types[0] == 'object':
+            return lambda op1, op2: FALSE if op1.value is op2.value else TRUE
+        case '==':
+            return lambda op1, op2: TRUE if op1.value == op2.value else FALSE
+        case '!=':
+            return lambda op1, op2: FALSE if op1.value == op2.value else TRUE
+        case '+' if types[0] == 'string':
+            return lambda op1, op2: TypedValue('string', op1.value + op2.value)
+        case '+' | '-' | '*' | '/':
+            apply = ARITHMETIC[operator_name]
+            return lambda op1, op2: int_value(apply(op1.value, op2.value))
+        case '<' | '<=' | '>' | '>=':
+            apply = COMPARISONS[operator_name]
+            return lambda op1, op2: TRUE if apply(op1.value, op2.value) else FALSE
+        case '&&':
+            return lambda op1, op2: TRUE if op1.value and op2.value else FALSE
+        case '||':
+            return lambda op1, op2: TRUE if op1.value or op2.value else FALSE
+        case 'neg':
+            return lambda op1: int_value(-op1.value)
+        case '!':
+            return lambda op1: FALSE if op1.value else TRUE
+
+# The function that coerces and computes operator_name on operands of these types,
+# from the first of its VALID_OPERAND_TYPES rules they match, or None if they
+# match none
+def fuse_operation(operator_name, types):
+    for expected_types, valid_coercion in VALID_OPERAND_TYPES[operator_name]:
+        coercions = []
+        coerced_types = []
+        for operand_type, expected_type in zip(types, expected_types):
+            if expected_type == 'any' or operand_type == expected_type:
+                coercions.append(None)
+                coerced_types.append(operand_type)
+            elif valid_coercion == (operand_type, expected_type):
+                coercions.append(COERCIONS[valid_coercion])
+                coerced_types.append(expected_type)
+            else:
+                break
+        else:
+            operation = compute(operator_name, coerced_types)
+            if not any(coercions):
+                return operation
+            coerce = [coercion or (lambda x: x) for coercion in coercions]
+            if len(coerce) == 1:
+                return lambda op1: operation(coerce[0](op1))
+            return lambda op1, op2: operation(coerce[0](op1), coerce[1](op2))
+    return None
+
+# Maps (operator, type) for unary operators and (operator, type1, type2) for
+# binary ones to the fused operation, for every combination of operand types the
+# operator accepts
+def build_operations():
+    operations = {}
+    for operator_name in OPERATORS:
+        if operator_name in UNARY_OPERATORS:
+            combinations = [(t,) for t in VALUE_TYPES]
+        else:
+            combinations = [(t1, t2) for t1 in VALUE_TYPES for t2 in VALUE_TYPES]
+        for types in combinations:
+            operation = fuse_operation(operator_name, types)
+            if operation is not None:
+                operations[(operator_name, *types)] = operation
+    return operations
+
+OPERATIONS = build_operations()
+
+# Counter loops, like while (i < n) { ...; i = i + 1; }, are made of two shapes of
+# node that the engines recognize when they load a program and run on fused fast
+# paths while the variables involved hold ints. increment_of gives the int added to
+# x by an assignment x = x + d or x = x - d (d an int literal), and
+# compared_variable gives (operator, x's symbol id, y) for a comparison x < y (or
+# <=, >, >=, ==, !=) of a variable with an expression, and both None for anything else.
+INT_COMPARISONS = {**COMPARISONS, '==': operator.eq, '!=': operator.ne}
+
+def increment_of(assignment_node: Element) -> int | None:
+    expression = assignment_node.expression
+    if (assignment_node.member is None and expression.elem_type in ('+', '-')
+            and expression.op1.elem_type == 'var' and expression.op1.member is None
+            and expression.op1.symbol == assignment_node.symbol and expression.op2.elem_type == 'int'):
+        return expression.op2.val if expression.elem_type == '+' else -expression.op2.val
+    return None
+
+def compared_variable(condition_node: Element) -> tuple[str, int, Element] | None:
+    if (condition_node.elem_type in INT_COMPARISONS and condition_node.op1.elem_type == 'var'
+            and condition_node.op1.member is None):
+        return condition_node.elem_type, condition_node.op1.symbol, condition_node.op2
+    return None
+
+# Maps the assignments and conditions in a program that increment_of and
+# compared_variable recognize to what they return, for the tree walker
+def find_counter_loops(ast):
+    increments = {}
+    comparisons = {}
+    for node in walk(ast):
+        match node.elem_type:
+            case '=':
+                delta = increment_of(node)
+                if delta is not None:
+                    increments[node] = delta
+            case InterpreterBase.IF_DEF | InterpreterBase.WHILE_DEF:
+                comparison = compared_variable(node.condition)
+                if comparison is not None:
+                    comparisons[node] = comparison
+    return increments, comparisons
+
+# Ways Interpreter can execute a program: walking the AST ('tree'), running
+# closures compiled from it ('closure', see closurev4.py), running bytecode
+# compiled from it ('vm', see bytecodev4.py) or running it translated to Python
+# ('python', see transpilev4.py)
+ENGINES = ('tree', 'closure', 'vm', 'python')
+# How many calls can be nested by default in the vm engine, which keeps them on
+# the heap. The other engines nest Python calls, so Python's recursion limit
+# applies instead.
+MAX_CALL_DEPTH = 100000
+
+class Program:
+    # A parsed program that can be run many times, from any thread. Nothing here is
+    # modified after construction, except that engines store what they compile from
+    # the program in `compiled` on first use; all per-run state lives in the Interpreter.
+    # source is the program's text, if known, which engines can use as a cache key.
+    __slots__ = ('ast', 'source', 'functions', 'main_func_node', 'compiled')
+
+    def __init__(self, ast, source=None):
+        self.ast = ast
+        self.source = source
+        self.compiled = {}
+        # Maps function names to their node, or to a map from parameter count
+        # to node if the function is overloaded
+        functions = {}
+        self.main_func_node = None
+        for func_node in ast.functions:
+            name = func_node.name
+            if name not in functions:
+                functions[name] = func_node
+            elif isinstance(functions[name], dict):
+                functions[name][len(func_node.args)] = func_node
+            else:
+                first_overload_node = functions[name]
+                functions[name] = {
+                    len(first_overload_node.args): first_overload_node,
+                    len(func_node.args): func_node,
+                }
+            if name == 'main':
+                self.main_func_node = func_node
+        self.functions = MappingProxyType({
+            name: MappingProxyType(func) if isinstance(func, dict) else func
+            for name, func in functions.items()
+        })
+
+    def run(self, console_output=True, inp=None, trace_output=False, engine='tree', max_call_depth=MAX_CALL_DEPTH):
+        interpreter = Interpreter(console_output, inp, trace_output, engine, max_call_depth)
+        interpreter.run_program(self)
+        return interpreter
+
+def compile_program(program: str) -> Program:
+    return Program(parse_program(program), program)
+
 class Interpreter(InterpreterBase):
-    def __init__(self, console_output=True, inp=None, trace_output=False):
+    # Methods that run each kind of node (see dispatch.py). Statement handlers
+    # return a value only when the statement returns from the function.
+    STATEMENT_HANDLERS = {
+        '=': 'do_assignment',
+        'fcall': 'do_call_statement',
+        'mcall': 'do_call_statement',
+        'if': 'do_if_statement',
+        'while': 'do_while_statement',
+        'return': 'do_return_statement',
+    }
+    EXPRESSION_HANDLERS = {
+        **dict.fromkeys(BINARY_OPERATORS, 'evaluate_binary_operation'),
+        **dict.fromkeys(UNARY_OPERATORS, 'evaluate_unary_operation'),
+        'fcall': 'do_func_call',
+        'mcall': 'do_method_call',
+        'var': 'get_variable_value',
+        'lambda': 'evaluate_lambda_definition',
+        'nil': 'evaluate_nil',
+        '@': 'evaluate_object',
+        'int': 'evaluate_literal',
+        'string': 'evaluate_literal',
+        'bool': 'evaluate_literal',
+    }
+
+    def __init__(self, console_output=True, inp=None, trace_output=False, engine='tree', max_call_depth=MAX_CALL_DEPTH):
         super().__init__(console_output, inp)
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine}. Must be one of {', '.join(ENGINES)}")
         self.trace_output = trace_output
+        self.engine = engine
+        self.max_call_depth = max_call_depth
+        self.statement_handlers = handler_table(self, self.STATEMENT_HANDLERS)
+        self.expression_handlers = handler_table(self, self.EXPRESSION_HANDLERS)
+        # Lazy copies of objects and closures that haven't been made yet
+        self.lazy_copies = {}
+        # Inline caches for member lookups: each site that reads a member maps to
+        # what its last lookup found. A member of the object itself is cached as
+        # (its Shape, the member's index), which holds for any object of that
+        # Shape. One found through proto is cached as (member_version, None, the
+        # object's Members, the member), since assigning any member, or any cell
+        # that might be one, changes the version.
+        self.member_caches = {}
+        self.member_version = 0
+        # The Shape of an object without members (see shapes.py)
+        self.empty_shape = Shape()
+        # The Constant each literal node evaluates to
+        self.literals = {}
 
     def print_if_trace(self, *args, **kwargs):
         if self.trace_output:
             print(*args, **kwargs, file=sys.stderr)
 
     def run(self, program):
-        ast = parse_program(program)
-        self.variables: dict[str, list[TypedValue]] = {} # Maps variable names to a list of shadowed scopes
-        self.scopes: list[set[str]] = [set()]
-
-        main_func_node = None
-        for func_node in ast.dict['functions']:
-            name = func_node.dict['name']
-            if self.is_variable_defined(name):
-                if self.variables[name][-1].type == 'overloaded_func':
-                    self.variables[name][-1].value[len(func_node.dict['args'])] = func_node
-                else:
-                    first_overload_node = self.variables[name][-1].value.definition
-                    self.variables[name][-1] = TypedValue('overloaded_func', {
-                        len(first_overload_node.dict['args']): first_overload_node,
-                        len(func_node.dict['args']): func_node,
-                    })
+        self.run_program(compile_program(program))
+
+    def run_program(self, program: Program):
+        # Variables are kept in stacks, indexed by symbol id (see symbols.py): each
+        # is the list of a variable's shadowed values, the visible one last. trail
+        # lists the ids of the variables each open scope defined, and marks the
+        # index in trail where each of those scopes starts.
+        self.symbols: tuple[str, ...] = program.ast.symbols
+        self.stacks: list[list[TypedValue]] = [[] for _ in self.symbols]
+        self.trail: list[int] = []
+        self.marks: list[int] = [0]
+        # Where in trail the scope of the function being run starts (None in main)
+        self.frame_start: int | None = None
+        # Sites are only unique within one program
+        self.member_caches.clear()
+
+        for func in program.functions.values():
+            if isinstance(func, MappingProxyType):
+                symbol = next(iter(func.values())).symbol
+                self.stacks[symbol].append(TypedValue('overloaded_func', dict(func)))
             else:
-                self.scopes[-1].add(name)
-                self.variables[name] = [TypedValue('func', Closure(func_node, {}))]
-            if name == 'main':
-                main_func_node = func_node
-        
-        if main_func_node is None:
+                symbol = func.symbol
+                self.stacks[symbol].append(TypedValue('func', Closure(func, {})))
+            self.trail.append(symbol)
+
+        if program.main_func_node is None:
             super().error(
                 ErrorType.NAME_ERROR,
                 "No main() function was found",
             )
-        self.run_statements(main_func_node.dict['statements'])
+        if self.engine == 'closure':
+            import closurev4
+            closurev4.run_main(self, program)
+        elif self.engine == 'vm':
+            import bytecodev4
+            bytecodev4.run_main(self, program)
+        elif self.engine == 'python':
+            import transpilev4
+            transpilev4.run_main(self, program)
+        else:
+            counter_loops = program.compiled.get('tree')
+            if counter_loops is None:
+                counter_loops = program.compiled.setdefault('tree', find_counter_loops(program.ast))
+            self.increments, self.comparisons = counter_loops
+            self.run_statements(program.main_func_node.statements)
 
     def run_statements(self, statement_list):
+        handlers = self.statement_handlers
         for statement_node in statement_list:
-            return_val = self.run_statement(statement_node)
-            if statement_node.elem_type == 'return' or (statement_node.elem_type in ['if', 'while'] and return_val is not None):
+            return_val = handlers[statement_node.elem_type](statement_node)
+            if return_val is not None:
                 return return_val
         return None
 
     def run_statement(self, statement_node):
-        match statement_node.elem_type:
-            case '=':
-                self.do_assignment(statement_node)
-                return None
-            case 'fcall':
-                return self.do_func_call(statement_node)
-            case 'mcall':
-                return self.do_method_call(statement_node)
-            case 'if':
-                return self.do_if_statement(statement_node)
-            case 'while':
-                return self.do_while_statement(statement_node)
-            case 'return':
-                if statement_node.dict['expression'] is None:
-                    return TypedValue('nil', None)
-                return copy.deepcopy(self.evaluate_expression(statement_node.dict['expression']))
-
-    def is_variable_defined(self, varname: str) -> bool:
-        return varname in self.variables and len(self.variables[varname]) > 0
+        return self.statement_handlers[statement_node.elem_type](statement_node)
+
+    def do_call_statement(self, call_node):
+        self.evaluate_expression(call_node)
+
+    def do_return_statement(self, statement_node):
+        expression = statement_node.expression
+        if expression is None:
+            return NIL
+        match expression.elem_type:
+            case InterpreterBase.FCALL_DEF:
+                return_val = self.do_func_call(expression, tail=True)
+            case InterpreterBase.MCALL_DEF:
+                return_val = self.do_method_call(expression, tail=True)
+            case _:
+                return_val = self.evaluate_expression(expression)
+        if type(return_val) is TailCall:
+            return return_val
+        return self.copy_value(return_val)
+
+    # The same as copy.deepcopy(value), but an object's members and a closure's
+    # captured variables are only copied once they're used
+    def copy_value(self, value: TypedValue) -> TypedValue:
+        match value.type:
+            case 'object':
+                copied = TypedValue('object', None)
+                copied.value = copy_members(value.value, value, copied, self.lazy_copies)
+            case 'func':
+                copied = TypedValue('func', None)
+                closure = value.value
+                copied.value = Closure(closure.definition, copy_cells(closure.free_vars, value, copied, self.lazy_copies))
+            case 'overloaded_func':
+                return TypedValue('overloaded_func', dict(value.value))
+            case _:
+                return TypedValue(value.type, value.value)
+        if value.shared:
+            copied.shared = True
+        return copied
+
+    def is_variable_defined(self, symbol: int) -> bool:
+        return len(self.stacks[symbol]) > 0
+
+    def push_scope(self, symbols=()):
+        self.marks.append(len(self.trail))
+        self.trail.extend(symbols)
+
+    def pop_scope(self):
+        mark = self.marks.pop()
+        stacks = self.stacks
+        for symbol in self.trail[mark:]:
+            stacks[symbol].pop()
+        del self.trail[mark:]
+
+    # A call being returned can replace the function that makes it, rather than
+    # run inside it, if everything that function's scope defines would be hidden
+    # by what the one it calls binds anyway
+    def can_replace_frame(self, scope) -> bool:
+        return self.frame_start is not None and scope.issuperset(self.trail[self.frame_start:])
 
     def do_assignment(self, statement_node: Element):
-        target = statement_node.dict['name'].split('.')
-        expression_value = self.evaluate_expression(statement_node.dict['expression'])
-        # self.print_if_trace(f'Assign {target} = {expression_value}')
-        if len(target) == 1:
-            self.do_var_assignment(target[0], expression_value)
+        delta = self.increments.get(statement_node)
+        if delta is not None:
+            values = self.stacks[statement_node.symbol]
+            if values:
+                variable = values[-1]
+                if variable.type == 'int' and not variable.shared:
+                    variable.value += delta
+                    return
+        expression_value = self.evaluate_expression(statement_node.expression)
+        if statement_node.member is None:
+            self.do_var_assignment(statement_node.symbol, expression_value)
         else:
-            self.do_member_assignment(target[0], target[1], expression_value)
+            self.do_member_assignment(statement_node.symbol, statement_node.member, expression_value)
 
-    def do_var_assignment(self, var_name: str, value: TypedValue):
-        if not self.is_variable_defined(var_name):
-            self.scopes[-1].add(var_name)
-            self.variables[var_name] = [copy.copy(value)]
+    def do_var_assignment(self, symbol: int, value: TypedValue):
+        values = self.stacks[symbol]
+        if not values:
+            self.trail.append(symbol)
+            values.append(copy.copy(value))
         else:
-            self.variables[var_name][-1].type = value.type
-            self.variables[var_name][-1].value = value.value
-
-    def do_member_assignment(self, var_name: str, member_name: str, value: TypedValue):
-        if not self.is_variable_defined(var_name):
+            if values[-1].shared:
+                self.member_version += 1
+                if self.lazy_copies:
+                    copy_pending(self.lazy_copies)
+            values[-1].type = value.type
+            values[-1].value = value.value
+
+    def do_member_assignment(self, symbol: int, member_name: str, value: TypedValue):
+        var_name = self.symbols[symbol]
+        if not self.is_variable_defined(symbol):
             super().error(
                 ErrorType.NAME_ERROR,
                 f"Attempting to assign member '{member_name}' to undefined variable '{var_name}'",
             )
-        obj = self.variables[var_name][-1]
+        obj = self.stacks[symbol][-1]
         if obj.type != 'object':
             super().error(
                 ErrorType.TYPE_ERROR,
@@ -154,33 +477,37 @@ class Interpreter(InterpreterBase):
                 ErrorType.TYPE_ERROR,
                 f"Attempting to assign {value.type} to '{var_name}.proto' (must be object or nil)",
             )
-        #if not member_name in obj.value:
-        obj.value[member_name] = copy.copy(value)
-        #else:
-        #    obj[member_name].type = value.type
-        #    obj[member_name].value = value.value
-
-    def do_method_call(self, method_call_node: Element):
-        var_name = method_call_node.dict['objref']
-        method_name = method_call_node.dict['name']
-        method_val = self.get_member_value(var_name, method_name)
-        return self.run_function(method_val, method_call_node.dict['args'],
-                                 method_this=self.variables[var_name][-1], debug_func_name=f"{var_name}.{method_name}")
-
-    def do_func_call(self, func_call_node: Element):
-        func_name = func_call_node.dict['name']
-        args = func_call_node.dict['args']
-        if self.is_variable_defined(func_name):
-            return self.run_function(self.variables[func_name][-1], func_call_node.dict['args'],
-                                     debug_func_name=func_name)
+        self.member_version += 1
+        if self.lazy_copies:
+            copy_pending(self.lazy_copies)
+        member = copy.copy(value)
+        member.shared = True
+        obj.value.set(member_name, member)
+
+    def do_method_call(self, method_call_node: Element, tail=False):
+        values = self.stacks[method_call_node.symbol]
+        method_name = method_call_node.name
+        method_val = self.get_member_value(method_call_node.symbol, method_name, method_call_node)
+        return self.run_function(method_val, method_call_node.args, method_this=values[-1],
+                                 debug_func_name=f"{method_call_node.objref}.{method_name}", tail=tail)
+
+    def do_func_call(self, func_call_node: Element, tail=False):
+        func_name = func_call_node.name
+        args = func_call_node.args
+        values = self.stacks[func_call_node.symbol]
+        if values:
+            return self.run_function(values[-1], func_call_node.args,
+                                     debug_func_name=func_name, tail=tail)
         match func_name:
             case 'print':
-                self.run_print(args)
-                return TypedValue('nil', None)
+                self.run_print(self.evaluate_args(args))
+                return NIL
             case 'inputi':
-                return self.run_inputi(args)
+                self.check_input_args(func_name, args)
+                return self.run_inputi(self.evaluate_args(args))
             case 'inputs':
-                return self.run_inputs(args)    
+                self.check_input_args(func_name, args)
+                return self.run_inputs(self.evaluate_args(args))
         super().error(
             ErrorType.NAME_ERROR,
             f"Function {func_name} that takes {len(args)} parameters has not been defined",
@@ -189,7 +516,9 @@ class Interpreter(InterpreterBase):
     def evaluate_args(self, arg_node_list: list[Element]) -> list[TypedValue]:
         return list(map(self.evaluate_expression, arg_node_list))
 
-    def run_function(self, func_object: TypedValue, args: list[Element], debug_func_name: str, method_this: TypedValue|None=None):
+    # With tail set, returns a TailCall instead of calling the function if it can
+    # replace the function being run
+    def run_function(self, func_object: TypedValue, args: list[Element], debug_func_name: str, method_this: TypedValue|None=None, tail=False):
         if func_object.type == 'overloaded_func':
             if len(args) not in func_object.value:
                 super().error(
@@ -201,15 +530,15 @@ class Interpreter(InterpreterBase):
         elif func_object.type == 'func':
             func_decl_node = func_object.value.definition
             free_vars = func_object.value.free_vars
-            if len(args) != len(func_decl_node.dict['args']):
+            if len(args) != len(func_decl_node.args):
                 if method_this is not None:
                     super().error(
                         ErrorType.NAME_ERROR,
-                        f"Method {debug_func_name} takes {len(func_decl_node.dict['args'])} parameters but {len(args)} were given",
+                        f"Method {debug_func_name} takes {len(func_decl_node.args)} parameters but {len(args)} were given",
                     )
                 super().error(
                     ErrorType.TYPE_ERROR,
-                    f"Function {debug_func_name} takes {len(func_decl_node.dict['args'])} parameters but {len(args)} were given",
+                    f"Function {debug_func_name} takes {len(func_decl_node.args)} parameters but {len(args)} were given",
                 )
         else:
             super().error(
@@ -217,135 +546,171 @@ class Interpreter(InterpreterBase):
                 f"Trying to call {debug_func_name} as a function, but it is of type {func_object.type}",
             )
 
+        if tail:
+            scope = {arg_node.symbol for arg_node in func_decl_node.args} | free_vars.keys()
+            if method_this:
+                scope.add(THIS)
+            if self.can_replace_frame(scope):
+                return TailCall(func_decl_node, self.evaluate_args(args), free_vars, method_this)
+
         arg_values = self.evaluate_args(args)
-        arg_names = [arg_node.dict['name'] for arg_node in func_decl_node.dict['args']]
-        arg_passing_schemes = [arg_node.elem_type for arg_node in func_decl_node.dict['args']]
-        for arg_name, value, arg_type in zip(arg_names, arg_values, arg_passing_schemes):
-            value_to_pass = value if arg_type == 'refarg' else copy.deepcopy(value)
-            if not self.is_variable_defined(arg_name):
-                self.variables[arg_name] = [value_to_pass]
-            else:
-                self.variables[arg_name].append(value_to_pass)
-        
-        arg_names_set = set(arg_names)
-        unshadowed_free_vars = [(k, v) for k, v in free_vars.items() if k not in arg_names_set]
-        if method_this:
-            unshadowed_free_vars.append(('this', method_this))
-            if not self.is_variable_defined('this'):
-                self.variables['this'] = []
-        
-        for var_name, value in unshadowed_free_vars:
-            # The variable is guaranteed to have been defined at some point,
-            # so no need to check
-            self.variables[var_name].append(value)
-        self.scopes.append(arg_names_set | { k for k, _ in unshadowed_free_vars })
-
-        return_val = self.run_statements(func_decl_node.dict['statements'])
-
-        for varname in self.scopes[-1]:
-            self.variables[varname].pop()
-        self.scopes.pop()
-        
+        stacks = self.stacks
+        frame_start = self.frame_start
+        while True:
+            arg_symbols = [arg_node.symbol for arg_node in func_decl_node.args]
+            arg_passing_schemes = [arg_node.elem_type for arg_node in func_decl_node.args]
+            for symbol, value, arg_type in zip(arg_symbols, arg_values, arg_passing_schemes):
+                if arg_type != 'refarg':
+                    value = self.copy_value(value)
+                elif type(value) is Constant:
+                    value = TypedValue(value.type, value.value)
+                stacks[symbol].append(value)
+
+            arg_symbols_set = set(arg_symbols)
+            unshadowed_free_vars = [(k, v) for k, v in free_vars.items() if k not in arg_symbols_set]
+            if method_this:
+                unshadowed_free_vars.append((THIS, method_this))
+            for symbol, value in unshadowed_free_vars:
+                stacks[symbol].append(value)
+            self.frame_start = len(self.trail)
+            # Like the rest of the scope, a variable pushed twice here is popped once
+            self.push_scope(arg_symbols_set | { k for k, _ in unshadowed_free_vars })
+
+            return_val = self.run_statements(func_decl_node.statements)
+
+            self.pop_scope()
+            if type(return_val) is not TailCall:
+                break
+            # The call returned replaces this one
+            func_decl_node, arg_values = return_val.function, return_val.args
+            free_vars, method_this = return_val.free_vars, return_val.this
+        self.frame_start = frame_start
+
         if return_val is None:
-            return TypedValue('nil', None)
+            return NIL
         return return_val
 
-    def do_if_statement(self, if_statement_node):
-        condition = self.try_coerce_to_bool(self.evaluate_expression(if_statement_node.dict['condition']))
+    # Evaluates the condition of an if or while statement to a Python bool
+    def evaluate_condition(self, statement_node, statement_name) -> bool:
+        comparison = self.comparisons.get(statement_node)
+        if comparison is not None:
+            operator_name, symbol, op2_node = comparison
+            values = self.stacks[symbol]
+            op1 = values[-1] if values and values[-1].type == 'int' else self.get_symbol_value(symbol)
+            op2 = self.evaluate_expression(op2_node)
+            if op1.type == 'int' and op2.type == 'int':
+                return INT_COMPARISONS[operator_name](op1.value, op2.value)
+            operation = OPERATIONS.get((operator_name, op1.type, op2.type))
+            if operation is None:
+                self.incompatible_operands(statement_node.condition, op1, op2)
+            return operation(op1, op2).value
+        condition = self.try_coerce_to_bool(self.evaluate_expression(statement_node.condition))
         if condition.type != 'bool':
             super().error(
                 ErrorType.TYPE_ERROR,
-                f"Expected bool inside 'if' condition but got {condition}"
+                f"Expected bool inside '{statement_name}' condition but got {condition}"
             )
-        statements = if_statement_node.dict['statements'] if condition.value else if_statement_node.dict['else_statements']
+        return condition.value
+
+    def do_if_statement(self, if_statement_node):
+        if self.evaluate_condition(if_statement_node, 'if'):
+            statements = if_statement_node.statements
+        else:
+            statements = if_statement_node.else_statements
         if statements is None:
             return None
-        self.scopes.append(set())
+        self.push_scope()
         return_val = self.run_statements(statements)
-        for var_name in self.scopes[-1]:
-            self.variables[var_name].pop()
-        self.scopes.pop()
+        self.pop_scope()
         return return_val
 
     def do_while_statement(self, while_statement_node):
-        self.scopes.append(set())
+        self.push_scope()
 
         return_val = None
-        while True:
-            condition = self.try_coerce_to_bool(self.evaluate_expression(while_statement_node.dict['condition']))
-            if condition.type != 'bool':
-                super().error(
-                    ErrorType.TYPE_ERROR,
-                    f"Expected bool inside 'while' condition but got {condition}"
-                )
-            if not condition.value:
-                break
-            return_val = self.run_statements(while_statement_node.dict['statements'])
+        while self.evaluate_condition(while_statement_node, 'while'):
+            return_val = self.run_statements(while_statement_node.statements)
             if return_val is not None:
                 break
-        
-        for var_name in self.scopes[-1]:
-            self.variables[var_name].pop()
-        self.scopes.pop()
+
+        self.pop_scope()
         return return_val
 
     def evaluate_expression(self, expression_node) -> TypedValue:
-        if expression_node.elem_type in OPERATORS:
-            return self.evaluate_operation(expression_node)
-        match expression_node.elem_type:
-            case 'fcall':
-                return self.do_func_call(expression_node)
-            case 'mcall':
-                return self.do_method_call(expression_node)
-            case 'var':
-                return self.get_variable_value(expression_node)
-            case 'lambda':
-                return self.evaluate_lambda_definition(expression_node)
-            case 'nil':
-                return TypedValue('nil', None)
-            case '@':
-                return TypedValue('object', {})
-            case 'int' | 'string' | 'bool':
-                return TypedValue(expression_node.elem_type, expression_node.dict['val'])
+        return self.expression_handlers[expression_node.elem_type](expression_node)
+
+    def evaluate_nil(self, nil_node):
+        return NIL
+
+    def evaluate_object(self, object_node):
+        return TypedValue('object', Members(self.empty_shape))
+
+    def evaluate_literal(self, literal_node):
+        constant = self.literals.get(literal_node)
+        if constant is None:
+            constant = self.literals[literal_node] = Constant(literal_node.elem_type, literal_node.val)
+        return constant
 
     def get_variable_value(self, variable_node: Element) -> TypedValue:
-        var_name_components = variable_node.dict['name'].split('.')
-        var_name = var_name_components[0]
-        if len(var_name_components) == 2:
-            return self.get_member_value(var_name, var_name_components[1])
-        
-        if not self.is_variable_defined(var_name):
+        if variable_node.member is not None:
+            return self.get_member_value(variable_node.symbol, variable_node.member, variable_node)
+        return self.get_symbol_value(variable_node.symbol)
+
+    def get_symbol_value(self, symbol: int) -> TypedValue:
+        values = self.stacks[symbol]
+        if not values:
             super().error(
                 ErrorType.NAME_ERROR,
-                f"Variable {var_name} has not been defined",
+                f"Variable {self.symbols[symbol]} has not been defined",
             )
-        typed_value = self.variables[var_name][-1]
+        typed_value = values[-1]
         if typed_value.type == 'overloaded_func':
             super().error(
                 ErrorType.NAME_ERROR,
-                f"Function {var_name} has multiple overloaded versions",
+                f"Function {self.symbols[symbol]} has multiple overloaded versions",
             )
         return typed_value
     
-    def get_member_value(self, var_name: str, member_name: str) -> TypedValue:
-        if not self.is_variable_defined(var_name):
+    # site is the node (or another key unique to the place in the program) the
+    # lookup is made for, whose inline cache it uses
+    def get_member_value(self, symbol: int, member_name: str, site=None) -> TypedValue:
+        values = self.stacks[symbol]
+        if not values:
             super().error(
                 ErrorType.NAME_ERROR,
-                f"Variable '{var_name}' has not been defined",
+                f"Variable '{self.symbols[symbol]}' has not been defined",
             )
-        variable = self.variables[var_name][-1]
+        variable = values[-1]
         if variable.type != 'object':
             super().error(
                 ErrorType.TYPE_ERROR,
                 f"Attempting to look up member '{member_name}' in {variable.type} '{variable}'"
             )
-        obj = variable
-        if member_name in obj.value:
-            return obj.value[member_name]
-        while 'proto' in obj.value and obj.value['proto'].type == 'object':
-            obj = obj.value['proto']
-            if member_name in obj.value:
-                return obj.value[member_name]
+        members = variable.value
+        cached = self.member_caches.get(site)
+        if cached is not None:
+            if cached[1] is not None:
+                if cached[0] is members.shape:
+                    return members.cells[cached[1]]
+            elif cached[2] is members and cached[0] == self.member_version:
+                return cached[3]
+
+        index = members.shape.indexes.get(member_name)
+        if index is not None:
+            if site is not None:
+                self.member_caches[site] = (members.shape, index)
+            return members.cells[index]
+        obj = members
+        while True:
+            proto = obj.get('proto')
+            if proto is None or proto.type != 'object':
+                break
+            obj = proto.value
+            member = obj.get(member_name)
+            if member is not None:
+                if site is not None:
+                    self.member_caches[site] = (self.member_version, None, members, member)
+                return member
         super().error(
             ErrorType.NAME_ERROR,
             f"Member '{member_name}' does not exist in object '{variable}'"
@@ -353,102 +718,71 @@ class Interpreter(InterpreterBase):
     
     def evaluate_lambda_definition(self, lambda_node):
         free_vars = {}
-        for var_name, values in self.variables.items():
+        stacks = self.stacks
+        symbols = lambda_node.free_symbols
+        for symbol in range(len(stacks)) if symbols is None else symbols:
+            values = stacks[symbol]
             if len(values) == 0:
                 continue
             if values[-1].type == 'object' or values[-1].type == 'func':
-                free_vars[var_name] = values[-1]
+                free_vars[symbol] = values[-1]
             elif values[-1].type == 'overloaded_func':
-                free_vars[var_name] = copy.copy(values[-1])
+                free_vars[symbol] = copy.copy(values[-1])
             else:
-                free_vars[var_name] = copy.deepcopy(values[-1])
+                free_vars[symbol] = TypedValue(values[-1].type, values[-1].value)
+            free_vars[symbol].shared = True
         return TypedValue('func', Closure(lambda_node, free_vars))
 
-    def check_operands_and_coerce(self, operands, operator):
-        for type_rules in VALID_OPERAND_TYPES[operator]:
-            types, valid_coercion = type_rules
-            match = True
-            coerced = []
-            for operand, expected_type in zip(operands, types):
-                if expected_type == 'any' or operand.type == expected_type:
-                    coerced.append(operand)
-                    continue
-                if valid_coercion == (operand.type, expected_type):
-                    coerced.append(COERCIONS[(operand.type, expected_type)](operand))
-                    continue
-                match = False
-                break
-            if match:
-                return True, coerced
-        return False, None
-
-    def evaluate_operation(self, expression_node) -> TypedValue:
-        operator = expression_node.elem_type
-        op1 = self.evaluate_expression(expression_node.dict['op1'])
-        if operator in BINARY_OPERATORS:
-            op2 = self.evaluate_expression(expression_node.dict['op2'])
-            operands = [op1, op2]
+    def evaluate_binary_operation(self, expression_node) -> TypedValue:
+        op1_node = expression_node.op1
+        if op1_node.elem_type in BINARY_OPERATORS:
+            op1 = self.evaluate_operation_chain(op1_node)
         else:
-            operands = [op1]
+            op1 = self.evaluate_expression(op1_node)
+        op2 = self.evaluate_expression(expression_node.op2)
+        operation = OPERATIONS.get((expression_node.elem_type, op1.type, op2.type))
+        if operation is None:
+            self.incompatible_operands(expression_node, op1, op2)
+        return operation(op1, op2)
+
+    # Evaluates operations nested in their left operands, like the additions in
+    # 1 + 2 + 3 + ..., in a loop rather than recursively, however many there are
+    def evaluate_operation_chain(self, expression_node) -> TypedValue:
+        chain = []
+        while expression_node.elem_type in BINARY_OPERATORS:
+            chain.append(expression_node)
+            expression_node = expression_node.op1
+        op1 = self.evaluate_expression(expression_node)
+        for node in reversed(chain):
+            op2 = self.evaluate_expression(node.op2)
+            operation = OPERATIONS.get((node.elem_type, op1.type, op2.type))
+            if operation is None:
+                self.incompatible_operands(node, op1, op2)
+            op1 = operation(op1, op2)
+        return op1
+
+    def incompatible_operands(self, expression_node, op1, op2):
+        super().error(
+            ErrorType.TYPE_ERROR,
+            f"Incompatible types {op1.type}, {op2.type} for operation {expression_node.elem_type}"
+        )
 
-        valid_operands, coerced = self.check_operands_and_coerce(operands, operator)
-        if not valid_operands:
+    def evaluate_unary_operation(self, expression_node) -> TypedValue:
+        op1 = self.evaluate_expression(expression_node.op1)
+        operation = OPERATIONS.get((expression_node.elem_type, op1.type))
+        if operation is None:
             super().error(
                 ErrorType.TYPE_ERROR,
-                f"Incompatible types {', '.join([op.type for op in operands])} for operation {operator}"
+                f"Incompatible types {op1.type} for operation {expression_node.elem_type}"
             )
-        
-        op1 = coerced[0]
-        if operator in BINARY_OPERATORS:
-            op2 = coerced[1]
-        
-        match operator:
-            case '+':
-                return TypedValue(op1.type, op1.value + op2.value)
-            case '-':
-                return TypedValue('int', op1.value - op2.value)
-            case '*':
-                return TypedValue('int', op1.value * op2.value)
-            case '*':
-                return TypedValue('int', op1.value * op2.value)
-            case '/':
-                return TypedValue('int', op1.value // op2.value)
-            case '==':
-                return TypedValue('bool', self.are_values_equal(op1, op2))
-            case '!=':
-                return TypedValue('bool', not self.are_values_equal(op1, op2))
-            case '<':
-                return TypedValue('bool', op1.value < op2.value)
-            case '<=':
-                return TypedValue('bool', op1.value <= op2.value)
-            case '>':
-                return TypedValue('bool', op1.value > op2.value)
-            case '>=':
-                return TypedValue('bool', op1.value >= op2.value)
-            case '&&':
-                return TypedValue('bool', op1.value and op2.value)
-            case '||':
-                return TypedValue('bool', op1.value or op2.value)
-            case 'neg':
-                return TypedValue('int', -op1.value)
-            case '!':
-                return TypedValue('bool', not op1.value)
-
-    def are_values_equal(self, op1: TypedValue, op2: TypedValue) -> bool:
-        if op1.type != op2.type:
-            return False
-        if op1.type == 'object':
-            return op1.value is op2.value
-        else:
-            return op1.value == op2.value
+        return operation(op1)
 
     def try_coerce_to_bool(self, integer_or_bool: TypedValue) -> TypedValue:
         if integer_or_bool.type == 'int':
             return COERCIONS[('int', 'bool')](integer_or_bool)
         return integer_or_bool
 
-    def run_print(self, args):
-        arg_vals = self.evaluate_args(args)
+    def run_print(self, arg_vals):
         output_strs = []
         for x in arg_vals:
             if x.type == 'bool':
@@ -459,24 +793,19 @@ class Interpreter(InterpreterBase):
                 output_strs.append(str(x.value))
         super().output("".join(output_strs))
 
-    def run_inputi(self, args):
+    def check_input_args(self, func_name, args):
         if len(args) > 1:
             super().error(
                 ErrorType.NAME_ERROR,
-                "No inputi() function found that takes >1 parameter",
+                f"No {func_name}() function found that takes >1 parameter",
             )
-        if len(args) > 0:
-            arg_vals = self.evaluate_args(args)
+
+    def run_inputi(self, arg_vals):
+        if len(arg_vals) > 0:
             super().output(arg_vals[0].value)
         return TypedValue('int', int(super().get_input()))
 
-    def run_inputs(self, args):
-        if len(args) > 1:
-            super().error(
-                ErrorType.NAME_ERROR,
-                "No inputs() function found that takes >1 parameter",
-            )
-        if len(args) > 0:
-            arg_vals = self.evaluate_args(args)
+    def run_inputs(self, arg_vals):
+        if len(arg_vals) > 0:
             super().output(arg_vals[0].value)
         return TypedValue('string', super().get_input())
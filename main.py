@@ -1,7 +1,4 @@
-from interpreterv1 import Interpreter as InterpreterV1
-from interpreterv2 import Interpreter as InterpreterV2
-from interpreterv3 import Interpreter as InterpreterV3
-from interpreterv4 import Interpreter as InterpreterV4
+from interpreters import VERSIONS, load_interpreter
 from argparse import ArgumentParser
 
 def main():
@@ -9,27 +6,63 @@ def main():
                             description="Run a Brewin' program")
     parser.add_argument("filename", nargs='?', default="main.brewin", help="the Brewin' source file")
     parser.add_argument("-i", "--interpreter", type=int, default=4, help="interpreter version to use from 1-4")
+    parser.add_argument("--no-brewc", action="store_true",
+                        help="always parse the source instead of using or writing a precompiled .brewc file")
+    parser.add_argument("-e", "--engine", default=None,
+                        help="execution engine for interpreter version 4: tree (default), closure, vm or python")
+    parser.add_argument("--max-call-depth", type=int, default=None,
+                        help="how many calls the vm engine can nest before reporting an error")
+    parser.add_argument("--disassemble", action="store_true",
+                        help="print the bytecode the vm engine compiles the program to instead of running it")
 
     args = parser.parse_args()
     
     interpreter_kwargs = { 'trace_output': True }
-    match args.interpreter:
-        case 1:
-            interpreter = InterpreterV1(**interpreter_kwargs)
-        case 2:
-            interpreter = InterpreterV2(**interpreter_kwargs)
-        case 3:
-            interpreter = InterpreterV3(**interpreter_kwargs)
-        case 4:
-            interpreter = InterpreterV4(**interpreter_kwargs)
-        case _:
-            print(f"Invalid interpreter version {args.interpreter}. Must be from 1-4")
+    if args.interpreter not in VERSIONS:
+        print(f"Invalid interpreter version {args.interpreter}. Must be from 1-4")
+        exit(1)
+    if args.engine is not None:
+        if args.interpreter != 4:
+            print("--engine is only supported by interpreter version 4")
             exit(1)
+        interpreter_kwargs['engine'] = args.engine
+    if args.max_call_depth is not None:
+        if args.interpreter != 4:
+            print("--max-call-depth is only supported by interpreter version 4")
+            exit(1)
+        interpreter_kwargs['max_call_depth'] = args.max_call_depth
+    if args.disassemble and args.interpreter != 4:
+        print("--disassemble is only supported by interpreter version 4")
+        exit(1)
+    interpreter_module = load_interpreter(args.interpreter)
+    if args.engine is not None and args.engine not in interpreter_module.ENGINES:
+        print(f"Invalid engine {args.engine}. Must be one of {', '.join(interpreter_module.ENGINES)}")
+        exit(1)
+    interpreter = interpreter_module.Interpreter(**interpreter_kwargs)
 
     with open(args.filename) as infile:
         program_source = infile.read()
 
-    interpreter.run(program_source)
+    try:
+        if args.no_brewc:
+            program = interpreter_module.compile_program(program_source)
+        else:
+            import brewc
+            ast = brewc.parse_file(args.filename, program_source, args.interpreter)
+            if args.interpreter == 4:
+                program = interpreter_module.Program(ast, program_source)
+            else:
+                program = interpreter_module.Program(ast)
+    except SyntaxError as error:
+        print(error.diagnostics)
+        raise
+    if program.ast.diagnostics:
+        print(program.ast.diagnostics)
+    if args.disassemble:
+        import bytecodev4
+        print(bytecodev4.disassemble_program(program))
+        return
+    interpreter.run_program(program)
 
 if __name__ == '__main__':
     main()
@@ -1,13 +1,49 @@
 from flask import Flask, request, send_from_directory
 from flask_cors import CORS
-from interpreterv4 import Interpreter as InterpreterV4
-from interpreterv3 import Interpreter as InterpreterV3
-from interpreterv2 import Interpreter as InterpreterV2
-from interpreterv1 import Interpreter as InterpreterV1
+from interpreters import VERSIONS, load_interpreter
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
 import asyncio
 from os import environ
 
 TIMEOUT = 5
+PROGRAM_CACHE_SIZE = 256
+
+class ProgramCache:
+    # Compiled programs keyed by (version, sha256 of source), evicting the least recently used
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.programs = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version, source):
+        key = (version, sha256(source.encode()).digest())
+        with self.lock:
+            program = self.programs.get(key)
+            if program is not None:
+                self.programs.move_to_end(key)
+                self.hits += 1
+                return program
+            self.misses += 1
+
+        # Compile outside the lock so one slow parse doesn't hold up other requests.
+        # Syntax errors propagate to the caller and are not cached.
+        program = load_interpreter(version).compile_program(source)
+        with self.lock:
+            self.programs[key] = program
+            self.programs.move_to_end(key)
+            while len(self.programs) > self.max_size:
+                self.programs.popitem(last=False)
+        return program
+
+    def stats(self):
+        with self.lock:
+            return { "size": len(self.programs), "max_size": self.max_size, "hits": self.hits, "misses": self.misses }
+
+program_cache = ProgramCache(PROGRAM_CACHE_SIZE)
 
 app = Flask(__name__)
 
@@ -20,40 +56,39 @@ cors = CORS(app, origins=origins)
 def get_static_file(name="index.html"):
     return send_from_directory("frontend/", name)
 
+@app.get("/api/cache")
+def get_cache_stats():
+    return program_cache.stats()
+
 @app.post("/api/run")
 async def interpret_program():
     inp = request.json["stdin"].split("\n")
+    version = request.json["version"]
+    if version not in VERSIONS:
+        raise Exception(f"Unknown version {version}")
 
-    kwargs = { "console_output": False, "inp": inp, "trace_output": False }
-
-    match request.json["version"]:
-        case 4:
-            interpreter = InterpreterV4(**kwargs)
-        case 3:
-            interpreter = InterpreterV3(**kwargs)
-        case 2:
-            interpreter = InterpreterV2(**kwargs)
-        case 1:
-            interpreter = InterpreterV1(**kwargs)
-        case _:
-            raise Exception(f"Unknown version {request.json['version']}")
-    
-    return await run_program_with_timeout(interpreter, request.json["program"])
+    return await run_program_with_timeout(version, request.json["program"], inp)
 
-def run_program(interpreter, program):
+# Responses include the lexer and parser diagnostics (the first
+# diagnostics.MAX_DIAGNOSTICS of them), also for programs that ply parsed by
+# recovering from syntax errors
+def run_program(version, program, inp):
+    try:
+        compiled_program = program_cache.get(version, program)
+    except SyntaxError as e:
+        return { "stdout": "SyntaxError", "diagnostics": e.diagnostics.to_list() }
+    diagnostics = compiled_program.ast.diagnostics.to_list()
     try:
-        interpreter.run(program)
-    except SyntaxError:
-        return { "stdout": "SyntaxError" }
+        interpreter = compiled_program.run(console_output=False, inp=inp, trace_output=False)
     except Exception as e:
         error_msg = str(e)
-        return { "stdout": error_msg if "ErrorType." in error_msg else "RuntimeError" }
-    return { "stdout": "\n".join(interpreter.get_output()) }
+        return { "stdout": error_msg if "ErrorType." in error_msg else "RuntimeError", "diagnostics": diagnostics }
+    return { "stdout": "\n".join(interpreter.get_output()), "diagnostics": diagnostics }
 
-async def run_program_with_timeout(interpreter, program):
+async def run_program_with_timeout(version, program, inp):
     try:
         async with asyncio.timeout(TIMEOUT):
-            return await asyncio.to_thread(run_program, interpreter, program)
+            return await asyncio.to_thread(run_program, version, program, inp)
     except asyncio.TimeoutError:
         return { "stdout": "Timeout" }
     
@@ -0,0 +1,61 @@
+from reprlib import recursive_repr
+import copy
+
+# The members of a version 4 object. Rather than a dict each, an object keeps its
+# member cells (TypedValues) in a list, in the order the members were first
+# assigned, and a Shape maps each member's name to its index in that list. Objects
+# whose members were added in the same order share one Shape: adding a member
+# follows (or records) a transition from the object's Shape to the next. proto is
+# a member like any other. Members are never removed, so the index a Shape gives a
+# name never changes, which is what lets an inline cache keep it (see
+# Interpreter.get_member_value).
+#
+# Each Interpreter has its own empty Shape that all its objects start from, so the
+# Shapes a program makes are dropped with the Interpreter that ran it.
+
+
+class Shape:
+    __slots__ = ('names', 'indexes', 'transitions')
+
+    def __init__(self, names=()):
+        self.names = names
+        self.indexes = {name: index for index, name in enumerate(names)}
+        self.transitions = {}
+
+    def add(self, name):
+        shape = self.transitions.get(name)
+        if shape is None:
+            shape = self.transitions[name] = Shape(self.names + (name,))
+        return shape
+
+
+class Members:
+    # lazy is only set by copyonwrite.LazyMembers, which has to have the same layout
+    __slots__ = ('shape', 'cells', 'lazy', '__weakref__')
+
+    def __init__(self, shape, cells=None):
+        self.shape = shape
+        self.cells = [] if cells is None else cells
+
+    def get(self, name):
+        index = self.shape.indexes.get(name)
+        return None if index is None else self.cells[index]
+
+    def set(self, name, cell):
+        index = self.shape.indexes.get(name)
+        if index is None:
+            self.shape = self.shape.add(name)
+            self.cells.append(cell)
+        else:
+            self.cells[index] = cell
+
+    def __deepcopy__(self, memo):
+        copied = Members(self.shape)
+        memo[id(self)] = copied
+        copied.cells = [copy.deepcopy(cell, memo) for cell in self.cells]
+        return copied
+
+    # Printed as a dict from names to cells, including when an object reaches itself
+    @recursive_repr('{...}')
+    def __repr__(self):
+        return repr(dict(zip(self.shape.names, self.cells)))
@@ -0,0 +1,78 @@
+from element import walk
+from intbase import InterpreterBase
+
+# Interns the identifiers of a program as small integer ids, so interpreters can
+# keep variables in lists indexed by id instead of dicts keyed by name.
+# intern_symbols() numbers every variable, function and argument name in order
+# of first appearance (walking the AST in preorder), stores each name's id in the
+# `symbol` slot of the nodes that use it, splits "var.member" names into the
+# variable's id and the `member` name, and lists the names by id in ast.symbols.
+# 'this' is always interned first, as THIS. With members=False (for versions of
+# Brewin' without objects) "var.member" is interned whole, as one variable's name.
+# Interning fills in the nodes themselves, so an AST is interned one way, once.
+#
+# It also stores in each lambda's `free_symbols` the ids of the variables that
+# creating it has to capture (see find_free_symbols).
+
+THIS = 0
+BUILTINS = ('print', 'inputi', 'inputs')
+
+
+def intern_symbols(ast, members=True):
+    ids = {InterpreterBase.THIS_DEF: THIS}
+
+    def intern(name):
+        symbol = ids.get(name)
+        if symbol is None:
+            symbol = ids[name] = len(ids)
+        return symbol
+
+    for node in walk(ast):
+        match node.elem_type:
+            case InterpreterBase.FUNC_DEF | InterpreterBase.FCALL_DEF | InterpreterBase.ARG_DEF | InterpreterBase.REFARG_DEF:
+                node.symbol = intern(node.name)
+            case InterpreterBase.MCALL_DEF:
+                node.symbol = intern(node.objref)
+            case InterpreterBase.VAR_DEF | '=' if not members:
+                node.symbol = intern(node.name)
+                node.member = None
+            case InterpreterBase.VAR_DEF | '=':
+                var_name, _, member_name = node.name.partition('.')
+                node.symbol = intern(var_name)
+                node.member = member_name or None
+    ast.symbols = tuple(ids)
+    ast.members = members
+
+    lambdas = []
+    defined = set()
+    for node in walk(ast):
+        match node.elem_type:
+            case InterpreterBase.LAMBDA_DEF:
+                lambdas.append(node)
+            case InterpreterBase.FUNC_DEF | InterpreterBase.ARG_DEF | InterpreterBase.REFARG_DEF:
+                defined.add(node.symbol)
+            case '=' if node.member is None:
+                defined.add(node.symbol)
+    builtins = frozenset(ids[name] for name in BUILTINS if name in ids and ids[name] not in defined)
+    for node in lambdas:
+        node.free_symbols = find_free_symbols(node, builtins)
+    return ast
+
+
+# The sorted ids of the variables a lambda's body (or a lambda nested in it) uses,
+# other than its own parameters, plus 'this', which a method call binds again.
+# Variables are dynamically scoped, so a function called from the body can use
+# any of the lambda's variables too: a lambda that calls anything other than a
+# builtin no function or variable of the program replaces gets None, for all.
+def find_free_symbols(lambda_node, builtins):
+    free = {THIS}
+    for node in walk(lambda_node):
+        match node.elem_type:
+            case InterpreterBase.FCALL_DEF if node.symbol in builtins:
+                pass
+            case InterpreterBase.FCALL_DEF | InterpreterBase.MCALL_DEF:
+                return None
+            case InterpreterBase.VAR_DEF | '=':
+                free.add(node.symbol)
+    free.difference_update(arg.symbol for arg in lambda_node.args)
+    return tuple(sorted(free))
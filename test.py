@@ -1,5 +1,7 @@
 import subprocess, sys, shutil
 
+SUPPORT_FILES = ['brewc.py', 'brewlex.py', 'brewparse.py', 'brewrdparse.py', 'brewscan.py', 'bytecodev4.py', 'closurev4.py', 'copyonwrite.py', 'diagnostics.py', 'dispatch.py', 'element.py', 'intbase.py', 'shapes.py', 'symbols.py', 'transpilev4.py']
+
 # TODO: Make the tester behave the same regardless of where it is called from
 def main():
     if len(sys.argv) < 1:
@@ -10,6 +12,10 @@ def main():
     if version_num < 1 or version_num > 4:
         print("Must provide a version number between 1-4")
         exit(1)
+    # The interpreters depend on this repo's parser and AST classes, so use them in
+    # place of the autograder's copies
+    for support_file in SUPPORT_FILES:
+        shutil.copy(support_file, f'autograder/{support_file}')
     shutil.copy(f'interpreterv{version}.py', f'autograder/interpreterv{version}.py')
     subprocess.run([sys.executable, 'tester.py', str(version)], cwd='autograder')
 
@@ -0,0 +1,470 @@
+from __future__ import annotations
+from bytecodev4 import BINARY_OPCODES, OPCODES, binary_operation, resolve_function, test_condition
+from closurev4 import INT_OR_BOOL, CompiledFunction, incompatible
+from copyonwrite import copy_pending
+from element import walk
+from intbase import ErrorType
+from interpreterv4 import TypedValue, Constant, NIL, TRUE, FALSE, compared_variable, increment_of, int_value, bool_value
+from shapes import Members
+from symbols import THIS
+from hashlib import sha256
+from importlib.util import MAGIC_NUMBER
+from os import environ
+import brewc, closurev4
+import marshal, os, types
+
+# Transpiling engine for interpreterv4 (Interpreter(engine='python')). The whole
+# program is translated into the source of a Python module, with one function
+# per Brewin' function or lambda, and compiled with compile(), so CPython's own
+# bytecode loop runs it. Expressions become straight-line code on temporaries,
+# with the int/int case of each operator inlined and everything else (including
+# the coercions in VALID_OPERAND_TYPES) handled by bytecodev4's helpers. As in
+# the other engines, variables and their scopes live in the Interpreter, and
+# generated code indexes interpreter.stacks by symbol id (see symbols.py).
+#
+# Generated code refers to AST nodes (lambda definitions, call sites for error
+# messages) by their index in referenced_nodes(ast). That order depends only on
+# the AST, so the compiled code object can be cached on disk, keyed by a hash of
+# the Brewin' source, and reused by any later run of the same program.
+
+CACHE_DIR = environ.get("BREWIN_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "brewin")
+CACHE_EXTENSION = ".brewpy"
+# Modules whose code or helpers the generated code depends on
+TRANSPILER_MODULES = ("transpilev4.py", "bytecodev4.py", "closurev4.py", "interpreterv4.py", "copyonwrite.py", "shapes.py", "symbols.py")
+# Node types the generated code refers to
+REFERENCED_NODES = frozenset(('func', 'lambda', 'fcall', 'mcall'))
+INT_RESULTS = {'+': '+', '-': '-', '*': '*', '/': '//'}
+BOOL_RESULTS = {'<': '<', '<=': '<=', '>': '>', '>=': '>=', '==': '=='}
+
+_transpiler_signature = None
+
+
+def transpiler_signature():
+    global _transpiler_signature
+    if _transpiler_signature is None:
+        digest = sha256(MAGIC_NUMBER)
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for module in TRANSPILER_MODULES:
+            with open(os.path.join(directory, module), "rb") as infile:
+                digest.update(infile.read())
+        digest.update(brewc.grammar_signature())
+        _transpiler_signature = digest.digest()
+    return _transpiler_signature
+
+
+def cache_path(source):
+    key = sha256(transpiler_signature() + source.encode()).hexdigest()
+    return os.path.join(CACHE_DIR, key + CACHE_EXTENSION)
+
+
+def run_main(interpreter, program):
+    functions = program.compiled.get('python')
+    if functions is None:
+        functions = program.compiled.setdefault('python', compile_functions(program))
+    if not functions:
+        # The program can't be expressed as a Python module (see compile_functions)
+        closurev4.run_main(interpreter, program)
+        return
+    functions[program.main_func_node].body(interpreter)
+
+
+# Lists the nodes generated code can refer to, in a fixed (preorder) order
+def referenced_nodes(ast):
+    return [node for node in walk(ast) if node.elem_type in REFERENCED_NODES]
+
+
+# Returns a map from definition nodes to CompiledFunctions whose bodies are the
+# generated Python functions, or an empty map if the generated module is too
+# deeply nested for CPython to compile
+def compile_functions(program):
+    nodes = referenced_nodes(program.ast)
+    path = None
+    if program.source is not None and not program.ast.diagnostics:
+        path = cache_path(program.source)
+        code = load_code(path)
+        if code is not None:
+            functions = load_functions(code, nodes)
+            if functions is not None:
+                return functions
+    try:
+        code = compile(transpile(program.ast, nodes), "<brewin>", "exec")
+    except (SyntaxError, RecursionError, MemoryError):
+        return {}
+    if path is not None:
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            brewc.write_atomically(path, marshal.dumps(code))
+        except OSError:
+            pass
+    return load_functions(code, nodes)
+
+
+def load_code(path):
+    try:
+        with open(path, "rb") as infile:
+            code = marshal.loads(infile.read())
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+    return code if isinstance(code, types.CodeType) else None
+
+
+# Runs the module code, returning None if it wasn't generated from these nodes
+def load_functions(code, nodes):
+    functions = {}
+    namespace = {
+        'N': nodes,
+        'functions': functions,
+        'TypedValue': TypedValue,
+        'Constant': Constant,
+        'Members': Members,
+        'NIL': NIL,
+        'TRUE': TRUE,
+        'FALSE': FALSE,
+        'int_value': int_value,
+        'bool_value': bool_value,
+        'INT_OR_BOOL': INT_OR_BOOL,
+        'copy_pending': copy_pending,
+        'incompatible': incompatible,
+        'binary_operation': binary_operation,
+        'resolve_function': resolve_function,
+        'test_condition': test_condition,
+        'builtin_function': builtin_function,
+        'call_function': call_function,
+    }
+    namespace.update((OPCODES[opcode], opcode) for opcode in BINARY_OPCODES.values())
+    exec(code, namespace)
+    if namespace.get('NODE_COUNT') != len(nodes):
+        return None
+    for index, body in namespace['FUNCTIONS'].items():
+        functions[nodes[index]] = CompiledFunction(body, nodes[index])
+    return functions
+
+
+# Returns the name of the builtin called by call_node, if it can be called with
+# its arguments
+def builtin_function(interpreter, call_node):
+    name = call_node.name
+    match name:
+        case 'print':
+            return name
+        case 'inputi' | 'inputs':
+            interpreter.check_input_args(name, call_node.args)
+            return name
+    interpreter.error(
+        ErrorType.NAME_ERROR,
+        f"Function {name} that takes {len(call_node.args)} parameters has not been defined",
+    )
+
+
+# Calls what builtin_function or resolve_function returned, binding the arguments
+# like Interpreter.run_function
+def call_function(interpreter, function, arg_values):
+    match function:
+        case 'print':
+            interpreter.run_print(arg_values)
+            return NIL
+        case 'inputi':
+            return interpreter.run_inputi(arg_values)
+        case 'inputs':
+            return interpreter.run_inputs(arg_values)
+
+    callee, free_vars, method_this = function
+    stacks = interpreter.stacks
+    arg_symbols = callee.arg_symbols
+    for symbol, value, by_ref in zip(arg_symbols, arg_values, callee.by_ref):
+        if not by_ref:
+            value = interpreter.copy_value(value)
+        elif type(value) is Constant:
+            value = TypedValue(value.type, value.value)
+        stacks[symbol].append(value)
+    scope = set(arg_symbols)
+    for symbol, value in free_vars.items():
+        if symbol not in arg_symbols:
+            stacks[symbol].append(value)
+            scope.add(symbol)
+    if method_this is not None:
+        stacks[THIS].append(method_this)
+        scope.add(THIS)
+    base = len(interpreter.marks)
+    interpreter.push_scope(scope)
+
+    return_val = callee.body(interpreter)
+
+    # A return inside an if or while leaves their scopes open too
+    while len(interpreter.marks) > base:
+        interpreter.pop_scope()
+    return return_val
+
+
+def transpile(ast, nodes):
+    return Transpiler(nodes).transpile_program(ast)
+
+
+# A translated expression: Python code for its value, and the literal's
+# (type, value) if it is one
+class Operand:
+    __slots__ = ('code', 'literal')
+
+    def __init__(self, code, literal=None):
+        self.code = code
+        self.literal = literal
+
+    def type_is(self, elem_type):
+        if self.literal is not None:
+            return 'True' if self.literal[0] == elem_type else 'False'
+        return f"{self.code}.type == {elem_type!r}"
+
+    def value(self):
+        return repr(self.literal[1]) if self.literal is not None else f"{self.code}.value"
+
+
+class Transpiler:
+    def __init__(self, nodes):
+        self.node_index = {node: i for i, node in enumerate(nodes)}
+        self.symbols = ()
+        self.lines = []
+        self.depth = 0
+        self.temps = 0
+        # Lambdas found while translating a function, translated after it
+        self.pending = []
+        # The name of the module-level Constant for each literal's (type, value)
+        self.constants = {}
+        # Member reads so far, which number their inline caches (see
+        # Interpreter.get_member_value); method calls use their node instead
+        self.sites = 0
+
+    def line(self, text):
+        self.lines.append("    " * self.depth + text)
+
+    def temp(self):
+        self.temps += 1
+        return f"t{self.temps}"
+
+    def node(self, node):
+        return f"N[{self.node_index[node]}]"
+
+    def transpile_program(self, ast):
+        self.line("# Generated by transpilev4")
+        self.symbols = ast.symbols
+        function_names = {}
+        self.pending = list(ast.functions)
+        while self.pending:
+            definition = self.pending.pop(0)
+            index = self.node_index[definition]
+            function_names[index] = f"brewin_{index}_{getattr(definition, 'name', 'lambda')}"
+            self.transpile_function(definition, function_names[index])
+        self.line("")
+        for (elem_type, val), name in self.constants.items():
+            self.line(f"{name} = Constant({elem_type!r}, {val!r})")
+        self.line("FUNCTIONS = {" + ", ".join(f"{index}: {name}" for index, name in function_names.items()) + "}")
+        self.line(f"NODE_COUNT = {len(self.node_index)}")
+        return "\n".join(self.lines) + "\n"
+
+    def transpile_function(self, definition, name):
+        self.temps = 0
+        self.line("")
+        self.line(f"def {name}(interpreter):")
+        self.depth += 1
+        self.line("stacks = interpreter.stacks")
+        self.line("trail = interpreter.trail")
+        self.line("marks = interpreter.marks")
+        self.transpile_block(definition.statements)
+        self.line("return NIL")
+        self.depth -= 1
+
+    def transpile_block(self, statements):
+        for statement in statements:
+            self.transpile_statement(statement)
+
+    def transpile_scope(self, statements):
+        self.line("marks.append(len(trail))")
+        self.transpile_block(statements)
+        self.line("interpreter.pop_scope()")
+
+    # Code for the stack of the variable with this id, commented with its name
+    def stack(self, symbol):
+        return f"stacks[{symbol}]  # {self.symbols[symbol]}"
+
+    def transpile_condition(self, condition, statement_name):
+        comparison = compared_variable(condition)
+        if comparison is not None:
+            # Compares the variable's int value with the other operand's directly,
+            # without making a bool for the result. Brewin's comparison operators
+            # are spelled like Python's.
+            operator_name, symbol, op2_node = comparison
+            op1 = self.temp()
+            self.line(f"{op1} = {self.stack(symbol)}")
+            self.line(f"{op1} = {op1}[-1] if {op1} and {op1}[-1].type == 'int' else interpreter.get_symbol_value({symbol})")
+            op2 = self.transpile_expression(op2_node)
+            slow_path = (f"binary_operation(interpreter, {OPCODES[BINARY_OPCODES[operator_name]]}, "
+                         f"{op1}, {op2.code}).value")
+            if op2.type_is('int') == 'False':
+                return slow_path
+            checks = " and ".join(check for check in (f"{op1}.type == 'int'", op2.type_is('int')) if check != 'True')
+            return f"({op1}.value {operator_name} {op2.value()} if {checks} else {slow_path})"
+        value = self.materialize(self.transpile_expression(condition))
+        return f"({value}.value if {value}.type == 'bool' else test_condition(interpreter, {value}, {statement_name!r}))"
+
+    # Expression statements other than calls are skipped: the tree walker doesn't
+    # evaluate them
+    def transpile_statement(self, node):
+        match node.elem_type:
+            case '=':
+                delta = increment_of(node)
+                if delta is not None:
+                    self.line(f"values = {self.stack(node.symbol)}")
+                    self.line("if values and values[-1].type == 'int' and not values[-1].shared:")
+                    self.line(f"    values[-1].value += {delta}")
+                    self.line("else:")
+                    self.depth += 1
+                    self.transpile_assignment(node)
+                    self.depth -= 1
+                else:
+                    self.transpile_assignment(node)
+            case 'fcall' | 'mcall':
+                self.transpile_expression(node)
+            case 'if':
+                condition = self.transpile_condition(node.condition, 'if')
+                self.line(f"if {condition}:")
+                self.depth += 1
+                self.transpile_scope(node.statements)
+                self.depth -= 1
+                if node.else_statements is not None:
+                    self.line("else:")
+                    self.depth += 1
+                    self.transpile_scope(node.else_statements)
+                    self.depth -= 1
+            case 'while':
+                # One scope for the whole loop, like the tree walker
+                self.line("marks.append(len(trail))")
+                self.line("while True:")
+                self.depth += 1
+                condition = self.transpile_condition(node.condition, 'while')
+                self.line(f"if not {condition}:")
+                self.line("    break")
+                self.transpile_block(node.statements)
+                self.depth -= 1
+                self.line("interpreter.pop_scope()")
+            case 'return':
+                if node.expression is None:
+                    self.line("return NIL")
+                    return
+                value = self.transpile_expression(node.expression)
+                if value.literal is not None:
+                    self.line(f"return {value.code}")
+                else:
+                    self.line(f"return interpreter.copy_value({value.code})")
+
+    def transpile_assignment(self, node):
+        value = self.materialize(self.transpile_expression(node.expression))
+        if node.member is not None:
+            self.line(f"interpreter.do_member_assignment({node.symbol}, {node.member!r}, {value})")
+            return
+        self.line(f"values = {self.stack(node.symbol)}")
+        self.line("if values:")
+        self.line("    if values[-1].shared:")
+        self.line("        interpreter.member_version += 1")
+        self.line("        if interpreter.lazy_copies:")
+        self.line("            copy_pending(interpreter.lazy_copies)")
+        self.line(f"    values[-1].type = {value}.type")
+        self.line(f"    values[-1].value = {value}.value")
+        self.line("else:")
+        self.line(f"    trail.append({node.symbol})")
+        self.line(f"    values.append(TypedValue({value}.type, {value}.value))")
+
+    # Literals are translated to a Constant defined once in the module, and every
+    # other expression to a temporary
+    def transpile_expression(self, node):
+        match node.elem_type:
+            case 'int' | 'string' | 'bool':
+                literal = (node.elem_type, node.val)
+                if literal not in self.constants:
+                    self.constants[literal] = f"K{len(self.constants)}"
+                return Operand(self.constants[literal], literal)
+            case 'nil':
+                return Operand("NIL", ('nil', None))
+            case '@':
+                return self.assign("TypedValue('object', Members(interpreter.empty_shape))")
+            case 'var':
+                if node.member is not None:
+                    self.sites += 1
+                    return self.assign(f"interpreter.get_member_value({node.symbol}, {node.member!r}, {self.sites})")
+                result = self.temp()
+                self.line(f"{result} = {self.stack(node.symbol)}")
+                self.line(f"{result} = {result}[-1] if {result} and {result}[-1].type != 'overloaded_func' "
+                          f"else interpreter.get_symbol_value({node.symbol})")
+                return Operand(result)
+            case 'lambda':
+                self.pending.append(node)
+                return self.assign(f"interpreter.evaluate_lambda_definition({self.node(node)})")
+            case 'fcall':
+                function = self.temp()
+                self.line(f"{function} = {self.stack(node.symbol)}")
+                self.line(f"{function} = resolve_function(interpreter, functions, {function}[-1], {self.node(node)}, "
+                          f"{node.name!r}, None) if {function} else builtin_function(interpreter, {self.node(node)})")
+                return self.transpile_call(function, node)
+            case 'mcall':
+                function = self.temp()
+                self.line(f"{function} = resolve_function(interpreter, functions, "
+                          f"interpreter.get_member_value({node.symbol}, {node.name!r}, {self.node(node)}), {self.node(node)}, "
+                          f"{node.objref + '.' + node.name!r}, stacks[{node.symbol}][-1])")
+                return self.transpile_call(function, node)
+            case 'neg':
+                value = self.materialize(self.transpile_expression(node.op1))
+                self.line(f"if {value}.type != 'int':")
+                self.line(f"    incompatible(interpreter, 'neg', {value})")
+                return self.assign(f"int_value(-{value}.value)")
+            case '!':
+                value = self.materialize(self.transpile_expression(node.op1))
+                self.line(f"if {value}.type not in INT_OR_BOOL:")
+                self.line(f"    incompatible(interpreter, '!', {value})")
+                return self.assign(f"FALSE if {value}.value else TRUE")
+        return self.transpile_binary_operation(node)
+
+    def transpile_call(self, function, node):
+        args = [self.materialize(self.transpile_expression(arg)) for arg in node.args]
+        return self.assign(f"call_function(interpreter, {function}, [{', '.join(args)}])")
+
+    # Operations nested in the left operand (1 + 2 + 3 + ...) are translated in a
+    # loop, each into its own statement, so a long chain of them doesn't recurse
+    def transpile_binary_operation(self, node):
+        chain = []
+        while node.elem_type in BINARY_OPCODES:
+            chain.append(node)
+            node = node.op1
+        op1 = self.transpile_expression(node)
+        for node in reversed(chain):
+            op1 = self.transpile_operation(node.elem_type, op1, self.transpile_expression(node.op2))
+        return op1
+
+    def transpile_operation(self, operator_name, op1, op2):
+        slow_path = f"binary_operation(interpreter, {OPCODES[BINARY_OPCODES[operator_name]]}, {op1.code}, {op2.code})"
+        if operator_name in INT_RESULTS:
+            result_type, python_operator = 'int', INT_RESULTS[operator_name]
+        elif operator_name in BOOL_RESULTS:
+            result_type, python_operator = 'bool', BOOL_RESULTS[operator_name]
+        else:
+            return self.assign(slow_path)
+        # Inline the int/int case, which needs no coercion
+        checks = [check for check in (op1.type_is('int'), op2.type_is('int')) if check != 'True']
+        if 'False' in checks:
+            return self.assign(slow_path)
+        fast_path = f"{result_type}_value({op1.value()} {python_operator} {op2.value()})"
+        if not checks:
+            return self.assign(fast_path)
+        result = self.temp()
+        self.line(f"if {' and '.join(checks)}:")
+        self.line(f"    {result} = {fast_path}")
+        self.line("else:")
+        self.line(f"    {result} = {slow_path}")
+        return Operand(result)
+
+    def assign(self, code):
+        result = self.temp()
+        self.line(f"{result} = {code}")
+        return Operand(result)
+
+    def materialize(self, operand):
+        if operand.literal is None:
+            return operand.code
+        return self.assign(operand.code).code